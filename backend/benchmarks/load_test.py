@@ -0,0 +1,226 @@
+"""Offline load test of the API's hot paths against baselines kept in the repo.
+
+The app runs in-process behind httpx's ASGI transport, with mongomock-motor
+standing in for MongoDB and the fake LLM backend answering chat after a fixed
+delay, so runs need no network and are repeatable on one machine.
+
+Run from the backend directory:
+    python benchmarks/load_test.py                   # compare with baselines.json
+    python benchmarks/load_test.py --save            # record new baselines
+    python benchmarks/load_test.py --only list,chat  # a subset of scenarios
+
+Each scenario is measured --repeat times and keeps its best p95 and req/s,
+since noise on a shared machine only ever makes a round slower. Exits non-zero
+when that best p95 latency or time per request is worse than its baseline by
+more than --tolerance and also by more than --floor-ms, so sub-millisecond
+scenarios do not fail on scheduler jitter. Baselines are machine-specific:
+record them on the machine that runs the comparison. mongomock scans
+collections without indexes, so chat paths slow down as sessions accumulate
+within a run; compare runs with the same settings rather than reading the
+numbers as production ones.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import time
+from itertools import count
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+BASELINES = Path(__file__).resolve().parent / "baselines.json"
+
+# A scenario builds (method, path, json body) for its i-th request
+Scenario = Callable[[int], Tuple[str, str, Dict]]
+
+
+def configure_environment(args):
+    os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    os.environ.setdefault('DB_NAME', 'load_test')
+    os.environ['LLM_BACKEND'] = 'fake'
+    os.environ['FAKE_LLM_FIRST_TOKEN_DELAY'] = str(args.llm_latency)
+    os.environ['FAKE_LLM_TOKEN_DELAY'] = '0'
+    os.environ.pop('TRACE_FILE', None)
+    # mongomock clients do not share data, so keep writes on the main client
+    os.environ['MONGO_WRITE_POOL_SIZE'] = '0'
+    os.environ['IMAGE_PREFETCH'] = 'false'
+    # Every run starts from the seeded mongomock data, not a snapshot of another database
+    os.environ['CATALOG_SNAPSHOT'] = ''
+    # Every simulated user shares one client address and would be rate limited
+    os.environ['CHAT_RATE_LIMIT_ENABLED'] = 'false'
+
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+
+    # Must happen before server is imported, which connects at import time
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+
+
+def build_scenarios(monasteries: List[Dict]) -> Dict[str, Scenario]:
+    ids = [monastery["id"] for monastery in monasteries]
+    lat, lng = monasteries[0]["coordinates"]["lat"], monasteries[0]["coordinates"]["lng"]
+    # Sessions stay unique across warm-up and measured runs: a returning
+    # session carries conversation memory, which bypasses the response cache
+    sessions = count()
+    return {
+        "list": lambda i: ("GET", "/api/monasteries", None),
+        "list_summary_page": lambda i: ("GET", "/api/monasteries?fields=summary&limit=3", None),
+        "search": lambda i: ("GET", f"/api/monasteries?search={('rumtek', 'pema', 'lake', 'nyingma')[i % 4]}", None),
+        "filter": lambda i: ("GET", "/api/monasteries?district=East%20Sikkim", None),
+        "detail": lambda i: ("GET", f"/api/monasteries/{ids[i % len(ids)]}", None),
+        "facets": lambda i: ("GET", ("/api/districts", "/api/traditions", "/api/festivals")[i % 3], None),
+        "nearby": lambda i: ("GET", f"/api/monasteries/nearby?lat={lat}&lng={lng}&radius_km=50&k=5", None),
+        # Every question is new, so each request waits for the (fake) LLM
+        "chat": lambda i: ("POST", "/api/chat", {
+            "message": f"What should I know before visiting, question {i}?",
+            "session_id": f"load-{next(sessions)}",
+            "bypass_cache": True
+        }),
+        # One question asked by many sessions, answered from the response cache
+        "chat_cached": lambda i: ("POST", "/api/chat", {
+            "message": "When is the best time to visit Rumtek?",
+            "session_id": f"load-{next(sessions)}"
+        }),
+    }
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+async def run_scenario(client, scenario: Scenario, requests: int, concurrency: int) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    issued = count()
+
+    async def worker():
+        nonlocal errors
+        while True:
+            i = next(issued)
+            if i >= requests:
+                return
+            method, path, body = scenario(i)
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(1000 * percentile(latencies, 50), 3),
+        "p95_ms": round(1000 * percentile(latencies, 95), 3),
+        "p99_ms": round(1000 * percentile(latencies, 99), 3),
+    }
+
+
+def best_of(rounds: List[Dict]) -> Dict:
+    """Combine repeated rounds: the lowest p95 (with its round's p50/p99) and the highest req/s"""
+    best = dict(min(rounds, key=lambda result: result["p95_ms"]))
+    best["rps"] = max(result["rps"] for result in rounds)
+    best["errors"] = sum(result["errors"] for result in rounds)
+    best["rounds"] = len(rounds)
+    return best
+
+
+def compare(name: str, result: Dict, baseline: Dict, tolerance: float, floor_ms: float) -> bool:
+    """Print one result against its baseline; False when it regressed"""
+    p95_change = result["p95_ms"] / baseline["p95_ms"] - 1 if baseline["p95_ms"] else 0.0
+    rps_change = result["rps"] / baseline["rps"] - 1 if baseline["rps"] else 0.0
+    # Throughput as time per request, so both checks share the absolute floor
+    per_request_ms = 1000 / result["rps"] - 1000 / baseline["rps"] if result["rps"] and baseline["rps"] else 0.0
+    regressed = (
+        (p95_change > tolerance and result["p95_ms"] - baseline["p95_ms"] > floor_ms)
+        or (rps_change < -tolerance and per_request_ms > floor_ms)
+    )
+    print(
+        f"{'':<18} baseline {baseline['rps']:>9.1f} req/s  p95 {baseline['p95_ms']:>8.2f} ms"
+        f"   change: p95 {p95_change:+.0%}, req/s {rps_change:+.0%}{'   REGRESSION' if regressed else ''}"
+    )
+    return not regressed
+
+
+async def run(args) -> int:
+    import httpx
+    import server
+
+    baselines = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+    settings = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "llm_latency": args.llm_latency,
+        "repeat": args.repeat,
+    }
+    if baselines and not args.save and baselines.get("settings") != settings:
+        print(f"Warning: baselines were recorded with {baselines.get('settings')}, comparing anyway")
+
+    results: Dict[str, Dict] = {}
+    healthy = True
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.app.router.lifespan_context(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=60) as client:
+            monasteries = (await client.get("/api/monasteries")).json()
+            scenarios = build_scenarios(monasteries)
+            selected = args.only.split(",") if args.only else list(scenarios)
+            for name in selected:
+                # Warm caches and lazy loads so the numbers describe the steady state
+                await run_scenario(client, scenarios[name], min(args.requests, 2 * args.concurrency), args.concurrency)
+                result = best_of([
+                    await run_scenario(client, scenarios[name], args.requests, args.concurrency)
+                    for _ in range(args.repeat)
+                ])
+                results[name] = result
+                print(
+                    f"{name:<18} {result['rps']:>9.1f} req/s  p50 {result['p50_ms']:>8.2f} ms"
+                    f"  p95 {result['p95_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms"
+                    f"  errors {result['errors']}"
+                )
+                if result["errors"]:
+                    healthy = False
+                baseline = baselines.get("scenarios", {}).get(name)
+                if baseline and not args.save:
+                    healthy = compare(name, result, baseline, args.tolerance, args.floor_ms) and healthy
+
+    if args.save:
+        scenarios_saved = {**baselines.get("scenarios", {}), **results}
+        BASELINES.write_text(json.dumps({
+            "settings": settings,
+            "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+            "scenarios": scenarios_saved,
+        }, indent=2) + "\n")
+        print(f"Saved baselines for {len(results)} scenarios to {BASELINES}")
+    return 0 if healthy else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at once")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="fake LLM response time in seconds")
+    parser.add_argument("--only", help="comma-separated scenarios to run")
+    parser.add_argument("--repeat", type=int, default=5, help="measured rounds per scenario; the best one counts")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative regression before failing")
+    parser.add_argument("--floor-ms", type=float, default=0.5, help="regressions smaller than this in ms never fail")
+    parser.add_argument("--save", action="store_true", help=f"write results to {BASELINES.name}")
+    args = parser.parse_args()
+
+    configure_environment(args)
+    logging.disable(logging.WARNING)
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Compare the old model-validate-encode path for /api/monasteries with pre-encoded bodies.
+
+Run from the backend directory:  python benchmarks/serialization_bench.py [--copies N]
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pydantic import TypeAdapter  # noqa: E402
+
+from serialization import ResponseBodyCache, orjson  # noqa: E402
+from server import SikkimMonastery, sikkim_monasteries_data  # noqa: E402
+
+
+def build_documents(copies: int) -> List[dict]:
+    return [SikkimMonastery(**data).dict() for _ in range(copies) for data in sikkim_monasteries_data]
+
+
+def measure(name: str, func, seconds: float = 2.0):
+    func()
+    runs, started = 0, time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        func()
+        runs += 1
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<34} {runs / elapsed:>10.1f} req/s   {1000 * elapsed / runs:>8.3f} ms/req   peak alloc {peak / 1024:>9.1f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--copies", type=int, default=50, help="copies of the seed data (6 monasteries each)")
+    args = parser.parse_args()
+
+    documents = build_documents(args.copies)
+    adapter = TypeAdapter(List[SikkimMonastery])
+    print(f"{len(documents)} monasteries, encoder: {'orjson' if orjson else 'json'}")
+
+    def before():
+        # Handler builds models, FastAPI validates the response_model and json.dumps the result
+        models = [SikkimMonastery(**document) for document in documents]
+        validated = adapter.validate_python(models, from_attributes=True)
+        return json.dumps(adapter.dump_python(validated, mode="json")).encode()
+
+    models = [SikkimMonastery(**document) for document in documents]
+
+    def after_cold():
+        return ResponseBodyCache().put_listing(0, "all", models, None, None)
+
+    warm = ResponseBodyCache()
+    warm.put_listing(0, "all", models, None, None)
+
+    def after_warm():
+        return warm.get_listing(0, "all")[0]
+
+    assert json.loads(before()) == json.loads(after_cold())
+    measure("before: validate + json.dumps", before)
+    measure("after: encode every body (miss)", after_cold)
+    measure("after: cached listing (hit)", after_warm)
+
+
+if __name__ == "__main__":
+    main()
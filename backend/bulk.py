@@ -0,0 +1,124 @@
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from serialization import dumps
+
+# Longest NDJSON line accepted before it is rejected without being parsed
+MAX_LINE_BYTES = 1024 * 1024
+
+# Per-line errors reported back; later ones are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+async def iter_ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """Split a byte stream into (line number, line) pairs without buffering the whole body.
+
+    Lines longer than MAX_LINE_BYTES are dropped while streaming and
+    reported as ``None`` so the caller can record an error for them.
+    """
+    buffer = b""
+    line_number = 0
+    oversized = False
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            yield line_number, None if oversized else line
+            oversized = False
+        if len(buffer) > MAX_LINE_BYTES:
+            oversized = True
+            buffer = b""
+    if oversized:
+        yield line_number + 1, None
+    elif buffer.strip():
+        yield line_number + 1, buffer
+
+
+class BulkImportReport:
+    def __init__(self):
+        self.received = 0
+        self.upserted = 0
+        self.modified = 0
+        self.error_count = 0
+        self.errors: List[Dict] = []
+
+    def error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self) -> Dict:
+        return {
+            "received": self.received,
+            "upserted": self.upserted,
+            "modified": self.modified,
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
+
+
+async def bulk_upsert_monasteries(collection, lines: AsyncIterator[Tuple[int, Optional[bytes]]], model, batch_size: int = 500) -> BulkImportReport:
+    """Validate NDJSON records against ``model`` and upsert them by name in unordered batches"""
+    report = BulkImportReport()
+    operations: List[UpdateOne] = []
+    batch_lines: List[int] = []
+
+    async def flush():
+        if not operations:
+            return
+        try:
+            result = await collection.bulk_write(operations, ordered=False)
+            report.upserted += result.upserted_count
+            report.modified += result.modified_count
+        except BulkWriteError as e:
+            details = e.details
+            report.upserted += details.get("nUpserted", 0)
+            report.modified += details.get("nModified", 0)
+            for write_error in details.get("writeErrors", []):
+                report.error(batch_lines[write_error["index"]], write_error.get("errmsg", "write failed"))
+        operations.clear()
+        batch_lines.clear()
+
+    async for line_number, line in lines:
+        if line is None:
+            report.received += 1
+            report.error(line_number, f"Line longer than {MAX_LINE_BYTES} bytes")
+            continue
+        if not line.strip():
+            continue
+        report.received += 1
+        try:
+            record = model(**json.loads(line))
+        except json.JSONDecodeError as e:
+            report.error(line_number, f"Invalid JSON: {e.msg}")
+            continue
+        except (ValidationError, TypeError) as e:
+            report.error(line_number, str(e))
+            continue
+        operations.append(UpdateOne(
+            {"name": record.name},
+            {
+                "$set": record.dict(),
+                "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": datetime.now(timezone.utc)},
+            },
+            upsert=True
+        ))
+        batch_lines.append(line_number)
+        if len(operations) >= batch_size:
+            await flush()
+    await flush()
+    return report
+
+
+async def export_ndjson(collection, batch_size: int = 500) -> AsyncIterator[bytes]:
+    """Yield every document as one NDJSON line straight from a Mongo cursor"""
+    cursor = collection.find({}, {"_id": 0}, batch_size=batch_size)
+    async for document in cursor:
+        yield dumps(document) + b"\n"
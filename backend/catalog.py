@@ -0,0 +1,313 @@
+import asyncio
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import bson
+
+from facets import CatalogFacets, aggregate_facets
+from geo import GeoIndex
+from search_index import SearchIndex
+from serialization import loads
+from snapshot import CatalogSnapshot, SnapshotError, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def digest_documents(documents: List[Dict], digest=None):
+    """Feed documents, in collection order, into a running catalog fingerprint"""
+    digest = digest if digest is not None else hashlib.blake2b(digest_size=16)
+    for document in documents:
+        digest.update(json.dumps(document, sort_keys=True, default=str).encode())
+    return digest
+
+
+def fingerprint_documents(documents: List[Dict]) -> str:
+    return digest_documents(documents).hexdigest()
+
+
+def stored_form(document: Dict) -> Dict:
+    """A document as find() returns it once stored: datetimes at millisecond precision and naive"""
+    return bson.decode(bson.encode(document))
+
+
+class SnapshotRecord:
+    """A catalog entry still encoded in a mapped snapshot.
+
+    id, district, tradition and coordinates come from the snapshot's key
+    table, ``dict()`` decodes the record without validating it and
+    ``encoded`` is the record itself, so filtering, paging and response
+    bodies need no model. Any other attribute builds the model once.
+    """
+
+    __slots__ = ("_snapshot", "_position", "_factory", "_model", "id", "district", "tradition", "coordinates")
+
+    def __init__(self, snapshot: CatalogSnapshot, position: int, factory: Callable, keys: List):
+        self._snapshot = snapshot
+        self._position = position
+        self._factory = factory
+        self._model = None
+        self.id, self.district, self.tradition, self.coordinates = keys
+
+    @property
+    def encoded(self) -> memoryview:
+        return self._snapshot.record(self._position)
+
+    def dict(self, include=None) -> Dict:
+        document = loads(self.encoded)
+        if include:
+            return {key: value for key, value in document.items() if key in include}
+        return document
+
+    def __getattr__(self, name: str):
+        if self._model is None:
+            self._model = self._factory(**loads(self.encoded))
+        return getattr(self._model, name)
+
+
+class MonasteryCatalog:
+    """Versioned in-memory copy of the monastery collection.
+
+    The catalog is loaded from Mongo on first use and reloaded lazily after
+    every ``invalidate()`` call, so reads never go back to Mongo while the
+    data is unchanged and never observe a stale version after a write.
+
+    With a ``snapshot_path``, ``load_snapshot()`` fills the catalog from a
+    prebuilt snapshot file instead (see snapshot.py) and ``verify()`` later
+    checks it against Mongo. The file stays mapped and its entries are
+    SnapshotRecords until the next load from Mongo, which also rewrites the
+    snapshot when its data differs, so the next cold start is current.
+    """
+
+    def __init__(
+        self,
+        collection,
+        factory: Callable,
+        facets_source: str = "python",
+        primary_collection=None,
+        snapshot_path: Optional[Path] = None,
+    ):
+        self._collection = collection
+        # Same collection read from the primary, for reloads right after a write
+        self._primary_collection = primary_collection if primary_collection is not None else collection
+        self._factory = factory
+        self._facets_source = facets_source
+        self._lock = asyncio.Lock()
+        self._by_id: Dict[str, object] = {}
+        self._items: List[object] = []
+        self._index = SearchIndex([])
+        self._facets = CatalogFacets()
+        self._geo = GeoIndex([])
+        self._loaded_version = -1
+        self._read_primary = False
+        self.fingerprint = ""
+        # Running digest behind the fingerprint, so add() can extend it the way
+        # another worker loading the same documents from Mongo would compute it
+        self._digest = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        # Fingerprint of the snapshot file as last read or written by this process
+        self._snapshot_fingerprint: Optional[str] = None
+        self.source = "none"
+        self.version = 0
+        # Kept open while entries are served from it; records still held by
+        # response caches keep the mapping alive after the catalog moves on
+        self._snapshot: Optional[CatalogSnapshot] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_version == self.version
+
+    def invalidate(self, read_primary: bool = False):
+        """Bump the catalog version so the next read reloads from Mongo.
+
+        Pass ``read_primary`` after writing through this process so the
+        reload uses the primary collection and cannot miss data that has not
+        replicated to secondaries yet.
+        """
+        self.version += 1
+        self._read_primary = self._read_primary or read_primary
+
+    async def ensure_loaded(self):
+        if self.loaded:
+            return
+        async with self._lock:
+            if self.loaded:
+                return
+            version = self.version
+            collection = self._primary_collection if self._read_primary else self._collection
+            self._read_primary = False
+            documents = await collection.find({}, {"_id": 0}).to_list(length=None)
+            await self._apply_documents(documents, collection, version)
+
+    async def _apply_documents(self, documents: List[Dict], collection, version: int):
+        items = [self._factory(**document) for document in documents]
+        if self._facets_source == "mongo":
+            facets = await aggregate_facets(collection)
+        else:
+            facets = CatalogFacets.from_items(items)
+        digest = digest_documents(documents)
+        self._apply(items, digest.hexdigest(), SearchIndex(items), facets, version)
+        self._digest = digest
+        self._snapshot = None
+        self.source = "mongo"
+        logger.info("Loaded %d monasteries into catalog (version %d)", len(items), version)
+        if self.snapshot_path and self.fingerprint != self._snapshot_fingerprint:
+            # Copied here; writes on the event loop may change the catalog while the thread encodes
+            contents = self._snapshot_contents()
+            try:
+                await asyncio.to_thread(write_snapshot, self.snapshot_path, *contents)
+                self._snapshot_fingerprint = contents[1]
+            except OSError as e:
+                logger.warning("Could not refresh the catalog snapshot: %s", e)
+
+    def _apply(self, items: List[object], fingerprint: str, index: SearchIndex, facets: CatalogFacets, version: int):
+        self.fingerprint = fingerprint
+        self._digest = None
+        self._items = items
+        self._by_id = {item.id: item for item in items}
+        self._index = index
+        self._geo = GeoIndex(items)
+        self._facets = facets
+        self._loaded_version = version
+
+    def load_snapshot(self) -> bool:
+        """Fill a never-loaded catalog from the snapshot file; False if there is none usable"""
+        if self.snapshot_path is None or self._loaded_version != -1 or not self.snapshot_path.exists():
+            return False
+        try:
+            snapshot = CatalogSnapshot(self.snapshot_path)
+        except SnapshotError as e:
+            logger.warning("Ignoring catalog snapshot: %s", e)
+            return False
+        try:
+            items = [
+                SnapshotRecord(snapshot, position, self._factory, keys)
+                for position, keys in enumerate(snapshot.keys())
+            ]
+            index = SearchIndex.from_postings(items, snapshot.postings())
+            facets = CatalogFacets.from_aggregation(snapshot.facets())
+        except (KeyError, TypeError, ValueError) as e:
+            snapshot.close()
+            logger.warning("Ignoring catalog snapshot: %s", e)
+            return False
+        self._apply(items, snapshot.fingerprint, index, facets, self.version)
+        self._snapshot = snapshot
+        self._snapshot_fingerprint = snapshot.fingerprint
+        self.source = "snapshot"
+        logger.info("Mapped %d monasteries from the catalog snapshot built at %s", len(items), snapshot.built_at)
+        return True
+
+    async def verify(self) -> bool:
+        """Swap in Mongo's data if it differs from a snapshot-loaded catalog; True if it did.
+
+        Unlike ``invalidate()``, reads keep being served from the snapshot
+        while Mongo is queried.
+        """
+        if self.source != "snapshot" or not self.loaded:
+            return False
+        async with self._lock:
+            version = self.version
+            documents = await self._collection.find({}, {"_id": 0}).to_list(length=None)
+            if not self.loaded or self.version != version:
+                # A write landed meanwhile and its own reload takes precedence
+                return False
+            digest = digest_documents(documents)
+            if digest.hexdigest() == self.fingerprint:
+                self._digest = digest
+                return False
+            logger.info("Catalog snapshot is out of date; reloading from Mongo")
+            self.version += 1
+            await self._apply_documents(documents, self._collection, self.version)
+            return True
+
+    def _snapshot_contents(self):
+        facets = self._facets.as_aggregation()
+        facets["festivals"] = list(facets["festivals"])
+        return [item.dict() for item in self._items], self.fingerprint, facets, self._index.postings()
+
+    def save_snapshot(self, path: Path) -> int:
+        """Write the loaded catalog to a snapshot file; returns its size in bytes"""
+        contents = self._snapshot_contents()
+        size = write_snapshot(path, *contents)
+        self._snapshot_fingerprint = contents[1]
+        return size
+
+    def add(self, item):
+        """Apply a newly inserted monastery in place instead of reloading everything"""
+        if not self.loaded or self._digest is None:
+            # A snapshot-loaded catalog has no digest to extend until verify() has run
+            self.invalidate(read_primary=True)
+            return
+        self._items.append(item)
+        self._by_id[item.id] = item
+        self._index.add(item)
+        self._geo.add(item)
+        self._facets.add(item)
+        # Inserts come last in collection order, so this matches a full recompute
+        self.fingerprint = digest_documents([stored_form(item.dict())], self._digest).hexdigest()
+        self.version += 1
+        self._loaded_version = self.version
+
+    async def all(self) -> List[object]:
+        await self.ensure_loaded()
+        return self._items
+
+    async def get(self, monastery_id: str):
+        await self.ensure_loaded()
+        return self._by_id.get(monastery_id)
+
+    async def facets(self) -> CatalogFacets:
+        await self.ensure_loaded()
+        return self._facets
+
+    async def geo(self) -> GeoIndex:
+        await self.ensure_loaded()
+        return self._geo
+
+    async def filter(
+        self,
+        district: Optional[str] = None,
+        tradition: Optional[str] = None,
+        search: Optional[str] = None,
+    ) -> List[object]:
+        """Filter by district/tradition substring; rank by relevance when searching"""
+        await self.ensure_loaded()
+        results = self._index.search(search) if search else self._items
+        if district:
+            needle = district.casefold()
+            results = [m for m in results if needle in m.district.casefold()]
+        if tradition:
+            needle = tradition.casefold()
+            results = [m for m in results if needle in m.tradition.casefold()]
+        return results
+
+    def start_watching(self):
+        """Invalidate on every change reported by a Mongo change stream.
+
+        Change streams need a replica set; on a standalone server the watcher
+        logs a warning and exits, leaving explicit invalidation in charge.
+        """
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop_watching(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    async def _watch(self):
+        try:
+            async with self._collection.watch() as stream:
+                async for _ in stream:
+                    self.invalidate()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Catalog change stream unavailable: %s", e)
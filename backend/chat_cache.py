@@ -0,0 +1,96 @@
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from search_index import tokenize
+
+# Filler words ignored when comparing questions for similarity
+STOPWORDS = frozenset(
+    "a an the is are was what when where which who how do does i me my can could "
+    "you please tell about to of in for on at there any".split()
+)
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(tokenize(question))
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    content = " ".join(word for word in text.split(" ") if word not in STOPWORDS) or text
+    padded = f"  {content} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class ChatResponseCache:
+    """LRU cache of guide replies keyed on monastery context and normalised question.
+
+    Lookups try an exact match first and then, when ``similarity_threshold``
+    is set, the most similar cached question for the same context by
+    character-trigram Jaccard similarity. Entries expire after ``ttl`` seconds.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600, similarity_threshold: Optional[float] = 0.8):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[Tuple, Tuple[str, float, FrozenSet[str]]]" = OrderedDict()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _context(self, monastery_id: Optional[str], version: int) -> Tuple:
+        return (monastery_id or "", version)
+
+    def get(self, question: str, monastery_id: Optional[str], version: int = 0) -> Optional[str]:
+        now = time.monotonic()
+        context = self._context(monastery_id, version)
+        normalized = normalize_question(question)
+        key = context + (normalized,)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[0]
+            del self._entries[key]
+
+        if self.similarity_threshold:
+            grams = trigrams(normalized)
+            best_key, best_score = None, self.similarity_threshold
+            for candidate, (_, expires_at, candidate_grams) in self._entries.items():
+                if candidate[:2] != context or expires_at <= now:
+                    continue
+                score = len(grams & candidate_grams) / len(grams | candidate_grams)
+                if score >= best_score:
+                    best_key, best_score = candidate, score
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self.similar_hits += 1
+                return self._entries[best_key][0]
+
+        self.misses += 1
+        return None
+
+    def put(self, question: str, monastery_id: Optional[str], response: str, version: int = 0):
+        normalized = normalize_question(question)
+        key = self._context(monastery_id, version) + (normalized,)
+        self._entries[key] = (response, time.monotonic() + self.ttl, trigrams(normalized))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.exact_hits + self.similar_hits) / lookups, 4) if lookups else 0.0,
+        }
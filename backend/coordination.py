@@ -0,0 +1,244 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+import socket
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Large enough for any invalidation message; they carry a topic and a few ids
+MAX_MESSAGE_BYTES = 65536
+
+
+def process_identity() -> str:
+    """host:pid of the calling process; read at call time so forked workers differ"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class InvalidationBus:
+    """Tells the other workers serving this app to drop cached state.
+
+    Each worker keeps its own caches and subscribes handlers by topic;
+    publishing reaches every other worker but never the publisher, which
+    updates its own caches directly. This base class has no peers and is
+    the single-process default.
+    """
+
+    transport = "none"
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable]] = {}
+        self._tasks = set()
+        self.origin = ""
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+
+    def subscribe(self, topic: str, handler: Callable[[Dict], object]):
+        """Call handler(payload) for each peer message on topic; coroutines run as tasks"""
+        self._handlers.setdefault(topic, []).append(handler)
+
+    async def publish(self, topic: str, **payload):
+        """Best effort: a failed publish is logged and never fails the caller"""
+        self.published += 1
+        try:
+            await self._send({"topic": topic, "origin": self.origin, "payload": payload})
+        except Exception as e:
+            self.dropped += 1
+            logger.warning("Could not publish %s invalidation: %s", topic, e)
+
+    async def _send(self, message: Dict):
+        pass
+
+    def _deliver(self, message: Dict):
+        if message.get("origin") == self.origin:
+            return
+        self.received += 1
+        for handler in self._handlers.get(message.get("topic"), []):
+            try:
+                result = handler(message.get("payload") or {})
+                if inspect.isawaitable(result):
+                    task = asyncio.ensure_future(result)
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+            except Exception as e:
+                logger.error("Invalidation handler for %s failed: %s", message.get("topic"), e)
+
+    async def start(self):
+        # Set here rather than in __init__: a preloading master builds this
+        # object before forking, and each worker needs its own identity
+        self.origin = f"{process_identity()}:{uuid.uuid4().hex[:8]}"
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+    def stats(self) -> Dict:
+        return {
+            "transport": self.transport,
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+
+class LocalInvalidationBus(InvalidationBus):
+    """Peers are the processes bound to a Unix datagram socket in one directory.
+
+    A stand-in for a message broker when all workers run on one node, as
+    under gunicorn. Sockets left behind by dead workers are removed the
+    first time a send to them is refused.
+    """
+
+    transport = "local"
+
+    def __init__(self, directory: Path):
+        super().__init__()
+        self.directory = Path(directory)
+        self._socket: Optional[socket.socket] = None
+        self._path: Optional[Path] = None
+
+    async def start(self):
+        await super().start()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._path = self.directory / f"{os.getpid()}.sock"
+        self._path.unlink(missing_ok=True)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._socket.bind(str(self._path))
+        asyncio.get_running_loop().add_reader(self._socket.fileno(), self._read)
+
+    def _read(self):
+        while True:
+            try:
+                data = self._socket.recv(MAX_MESSAGE_BYTES)
+            except (BlockingIOError, InterruptedError):
+                return
+            try:
+                self._deliver(json.loads(data))
+            except ValueError as e:
+                logger.warning("Ignoring malformed invalidation message: %s", e)
+
+    async def _send(self, message: Dict):
+        if self._socket is None:
+            return
+        data = json.dumps(message).encode()
+        for path in self.directory.glob("*.sock"):
+            if path == self._path:
+                continue
+            try:
+                self._socket.sendto(data, str(path))
+            except (ConnectionRefusedError, FileNotFoundError):
+                path.unlink(missing_ok=True)
+            except BlockingIOError:
+                # The peer's receive buffer is full; it is too busy to read anyway
+                self.dropped += 1
+
+    async def stop(self):
+        await super().stop()
+        if self._socket is not None:
+            asyncio.get_running_loop().remove_reader(self._socket.fileno())
+            self._socket.close()
+            self._socket = None
+            self._path.unlink(missing_ok=True)
+
+
+class MongoInvalidationBus(InvalidationBus):
+    """Peers are every process watching one collection through a change stream.
+
+    Works across nodes, but change streams need a replica set; on a
+    standalone server the watcher logs a warning and this worker only
+    publishes.
+    """
+
+    transport = "mongo"
+
+    def __init__(self, collection, ttl_seconds: int = 3600):
+        super().__init__()
+        self._collection = collection
+        self.ttl_seconds = ttl_seconds
+        self._watch_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await super().start()
+        try:
+            await self._collection.create_index("at", name="at_ttl", expireAfterSeconds=self.ttl_seconds)
+        except Exception as e:
+            logger.error("Could not create the invalidation TTL index: %s", e)
+        self._watch_task = asyncio.create_task(self._watch())
+
+    async def _send(self, message: Dict):
+        await self._collection.insert_one({**message, "at": datetime.now(timezone.utc)})
+
+    async def _watch(self):
+        try:
+            async with self._collection.watch([{"$match": {"operationType": "insert"}}]) as stream:
+                async for change in stream:
+                    self._deliver(change["fullDocument"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Invalidation change stream unavailable: %s", e)
+
+    async def stop(self):
+        await super().stop()
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+
+def create_invalidation_bus(collection, name: str) -> InvalidationBus:
+    """Build the bus selected by CACHE_INVALIDATION ("none", "local" or "mongo")"""
+    transport = os.environ.get('CACHE_INVALIDATION', 'none')
+    if transport == "local":
+        default_dir = Path(tempfile.gettempdir()) / f"{name}-invalidation"
+        return LocalInvalidationBus(Path(os.environ.get('CACHE_INVALIDATION_DIR', str(default_dir))))
+    if transport == "mongo":
+        return MongoInvalidationBus(
+            collection, ttl_seconds=int(os.environ.get('CACHE_INVALIDATION_TTL_SECONDS', '3600'))
+        )
+    if transport != "none":
+        raise ValueError(f"Unknown CACHE_INVALIDATION transport: {transport}")
+    return InvalidationBus()
+
+
+class MongoLease:
+    """A named lease that one process holds at a time, for jobs only one worker should run.
+
+    ``acquire`` renews the lease for its holder or takes it over once it
+    has expired, so a dead holder is replaced after at most ``ttl_seconds``.
+    """
+
+    def __init__(self, collection, name: str, ttl_seconds: float):
+        self._collection = collection
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+
+    async def acquire(self) -> bool:
+        now = datetime.now(timezone.utc)
+        holder = process_identity()
+        try:
+            await self._collection.find_one_and_update(
+                {"_id": self.name, "$or": [{"holder": holder}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"holder": holder, "expires_at": now + timedelta(seconds=self.ttl_seconds)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # Another live process holds it: the filter missed and the upsert collided
+            return False
+
+    async def release(self):
+        await self._collection.delete_one({"_id": self.name, "holder": process_identity()})
@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+
+def client_options(pool_size_var: str = 'MONGO_MAX_POOL_SIZE', default_pool_size: str = '100') -> Dict:
+    """Pool, timeout and compression settings for AsyncIOMotorClient from MONGO_* variables"""
+    options = {
+        "maxPoolSize": int(os.environ.get(pool_size_var, default_pool_size)),
+        "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+        "maxIdleTimeMS": int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000')),
+        # Fail a request quickly instead of queueing forever behind a saturated pool
+        "waitQueueTimeoutMS": int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000')),
+        "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+        "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+        "appname": os.environ.get('MONGO_APP_NAME', 'sikkim-monasteries'),
+    }
+    socket_timeout = os.environ.get('MONGO_SOCKET_TIMEOUT_MS')
+    if socket_timeout:
+        options["socketTimeoutMS"] = int(socket_timeout)
+    # e.g. "zstd,snappy,zlib"; zstd and snappy need the zstandard / python-snappy packages
+    compressors = os.environ.get('MONGO_COMPRESSORS', '').strip()
+    if compressors:
+        options["compressors"] = compressors
+        options["zlibCompressionLevel"] = int(os.environ.get('MONGO_ZLIB_COMPRESSION_LEVEL', '-1'))
+    return options
+
+
+def read_preference(name: str, max_staleness: int = -1):
+    """Read preference from its connection-string name, e.g. secondaryPreferred"""
+    modes = {
+        "primary": lambda: Primary(),
+        "primaryPreferred": lambda: PrimaryPreferred(max_staleness=max_staleness),
+        "secondary": lambda: Secondary(max_staleness=max_staleness),
+        "secondaryPreferred": lambda: SecondaryPreferred(max_staleness=max_staleness),
+        "nearest": lambda: Nearest(max_staleness=max_staleness),
+    }
+    if name not in modes:
+        raise ValueError(f"Unknown read preference: {name}")
+    return modes[name]()
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool utilisation of one client, summed over its servers.
+
+    Checkout waits are measured between the started and checked-out events,
+    which pymongo emits on the same thread.
+    """
+
+    def __init__(self, max_pool_size: int):
+        self.max_pool_size = max_pool_size
+        self._lock = threading.Lock()
+        self._started = threading.local()
+        self._wait_times = deque(maxlen=1000)
+        self.open = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.checkout_failures: Dict[str, int] = {}
+        self.cleared = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_check_out_started(self, event):
+        self._started.at = time.monotonic()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures[event.reason] = self.checkout_failures.get(event.reason, 0) + 1
+
+    def connection_checked_out(self, event):
+        started = getattr(self._started, "at", None)
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            if started is not None:
+                self._wait_times.append(time.monotonic() - started)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            wait_times = sorted(self._wait_times)
+            return {
+                "max_pool_size": self.max_pool_size,
+                "open": self.open,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "utilisation": round(self.in_use / self.max_pool_size, 4) if self.max_pool_size else 0.0,
+                "checkouts": self.checkouts,
+                "checkout_failures": sum(self.checkout_failures.values()),
+                "checkout_failures_by_reason": dict(self.checkout_failures),
+                "pool_cleared": self.cleared,
+                "wait_ms_p95": round(1000 * wait_times[int(0.95 * (len(wait_times) - 1))], 3) if wait_times else 0.0,
+            }
+
+
+class Database:
+    """The app's Motor clients and database handles.
+
+    Writes that arrive with chat traffic (messages, memory, retention) go
+    through a separate client whose pool is capped at MONGO_WRITE_POOL_SIZE,
+    so a burst of them cannot take every connection away from reads. Catalog
+    loads read with MONGO_CATALOG_READ_PREFERENCE (secondaryPreferred by
+    default) to keep them off the primary when a replica set has secondaries.
+    """
+
+    def __init__(self, url: str, name: str, event_listeners: Iterable = ()):
+        options = client_options()
+        self.pools: Dict[str, PoolStats] = {"main": PoolStats(options["maxPoolSize"])}
+        self.client = AsyncIOMotorClient(
+            url, event_listeners=[*event_listeners, self.pools["main"]], **options
+        )
+        write_options = client_options('MONGO_WRITE_POOL_SIZE', '10')
+        if write_options["maxPoolSize"] > 0:
+            self.pools["writes"] = PoolStats(write_options["maxPoolSize"])
+            self.write_client = AsyncIOMotorClient(
+                url, event_listeners=[*event_listeners, self.pools["writes"]], **write_options
+            )
+        else:
+            # 0 shares the main pool
+            self.write_client = self.client
+
+        self.catalog_read_preference = read_preference(
+            os.environ.get('MONGO_CATALOG_READ_PREFERENCE', 'secondaryPreferred'),
+            int(os.environ.get('MONGO_CATALOG_MAX_STALENESS_SECONDS', '-1'))
+        )
+        self.db = self.client[name]
+        self.write_db = self.write_client[name]
+        self.catalog_db = self.client.get_database(name, read_preference=self.catalog_read_preference)
+
+    def stats(self) -> Dict:
+        return {
+            "catalog_read_preference": self.catalog_read_preference.name,
+            "pools": {name: pool.stats() for name, pool in self.pools.items()},
+        }
+
+    def close(self):
+        if self.write_client is not self.client:
+            self.write_client.close()
+        self.client.close()
+
+
+def pool_samples(database: Database, keys: Optional[Iterable[str]] = None):
+    """Per-pool gauges for the metrics registry"""
+    stats = {name: pool.stats() for name, pool in database.pools.items()}
+    for key in keys or ("open", "in_use", "utilisation", "checkout_failures", "wait_ms_p95"):
+        yield f"mongo_pool_{key}", f"Connection pool {key.replace('_', ' ')}", [
+            ({"pool": name}, pool_stats[key]) for name, pool_stats in stats.items()
+        ]
@@ -0,0 +1,89 @@
+from collections import Counter
+from typing import Dict, List
+
+
+class CatalogFacets:
+    """District and tradition counts plus a flat festival table for the catalog"""
+
+    def __init__(self):
+        self.districts: Counter = Counter()
+        self.traditions: Counter = Counter()
+        self.festivals: List[Dict[str, str]] = []
+        self._payloads: Dict[str, Dict] = {}
+
+    @classmethod
+    def from_items(cls, items) -> "CatalogFacets":
+        facets = cls()
+        for item in items:
+            facets.add(item)
+        return facets
+
+    @classmethod
+    def from_aggregation(cls, result: Dict) -> "CatalogFacets":
+        facets = cls()
+        facets.districts = Counter({row["_id"]: row["count"] for row in result["districts"]})
+        facets.traditions = Counter({row["_id"]: row["count"] for row in result["traditions"]})
+        facets.festivals = result["festivals"]
+        return facets
+
+    def add(self, monastery):
+        self._payloads.clear()
+        self.districts[monastery.district] += 1
+        self.traditions[monastery.tradition] += 1
+        for festival in monastery.festivals:
+            self.festivals.append({
+                "name": festival.name,
+                "date": festival.date,
+                "description": festival.description,
+                "significance": festival.significance,
+                "monastery": monastery.name,
+                "location": monastery.location
+            })
+
+    def as_aggregation(self) -> Dict:
+        """The shape of an aggregate_facets result, for from_aggregation"""
+        return {
+            "districts": [{"_id": name, "count": count} for name, count in self.districts.items()],
+            "traditions": [{"_id": name, "count": count} for name, count in self.traditions.items()],
+            "festivals": self.festivals,
+        }
+
+    def payload(self, facet: str) -> Dict:
+        """Response body for 'districts', 'traditions' or 'festivals', built once per change"""
+        if facet not in self._payloads:
+            if facet == "festivals":
+                self._payloads[facet] = {"festivals": self.festivals}
+            else:
+                counts = getattr(self, facet)
+                self._payloads[facet] = {facet: sorted(counts), "counts": dict(sorted(counts.items()))}
+        return self._payloads[facet]
+
+
+# Computes the same facets inside Mongo with $unwind rather than in Python
+FACETS_PIPELINE = [
+    {"$facet": {
+        "districts": [
+            {"$group": {"_id": "$district", "count": {"$sum": 1}}},
+        ],
+        "traditions": [
+            {"$group": {"_id": "$tradition", "count": {"$sum": 1}}},
+        ],
+        "festivals": [
+            {"$unwind": "$festivals"},
+            {"$project": {
+                "_id": 0,
+                "name": "$festivals.name",
+                "date": "$festivals.date",
+                "description": "$festivals.description",
+                "significance": "$festivals.significance",
+                "monastery": "$name",
+                "location": "$location"
+            }},
+        ],
+    }}
+]
+
+
+async def aggregate_facets(collection) -> CatalogFacets:
+    result = await collection.aggregate(FACETS_PIPELINE).to_list(length=1)
+    return CatalogFacets.from_aggregation(result[0])
@@ -0,0 +1,150 @@
+import math
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """Great-circle distances from one point to arrays of points, all in radians"""
+    dlat = lats - lat
+    dlng = lngs - lng
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def distance_matrix(points: Sequence[Tuple[float, float]]) -> np.ndarray:
+    """Pairwise haversine distances in km for (lat, lng) points in degrees"""
+    coordinates = np.radians(np.asarray(points, dtype=float).reshape(-1, 2))
+    lats, lngs = coordinates[:, 0], coordinates[:, 1]
+    dlat = lats[:, None] - lats[None, :]
+    dlng = lngs[:, None] - lngs[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lats)[:, None] * np.cos(lats)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GeoIndex:
+    """Coordinates of every catalog entry held as radian arrays.
+
+    Queries first discard points outside a latitude band and a longitude
+    window around the radius, then compute exact haversine distances for the
+    remainder in one vectorised pass.
+    """
+
+    def __init__(self, items):
+        located = [
+            item for item in items
+            if "lat" in item.coordinates and "lng" in item.coordinates
+        ]
+        self._items = located
+        self._lats = np.radians(np.array([item.coordinates["lat"] for item in located], dtype=float))
+        self._lngs = np.radians(np.array([item.coordinates["lng"] for item in located], dtype=float))
+
+    def add(self, item):
+        if "lat" in item.coordinates and "lng" in item.coordinates:
+            self._items.append(item)
+            self._lats = np.append(self._lats, math.radians(item.coordinates["lat"]))
+            self._lngs = np.append(self._lngs, math.radians(item.coordinates["lng"]))
+
+    def nearby(self, lat: float, lng: float, radius_km: Optional[float] = None, k: Optional[int] = None) -> List[Tuple[object, float]]:
+        """Entries within radius_km of (lat, lng) in degrees, nearest first, at most k"""
+        if not self._items:
+            return []
+        lat, lng = math.radians(lat), math.radians(lng)
+        candidates = np.arange(len(self._items))
+        if radius_km is not None:
+            band = radius_km / EARTH_RADIUS_KM
+            mask = np.abs(self._lats - lat) <= band
+            # Widest longitude offset of the circle; near the poles it spans every longitude
+            if math.sin(band) < math.cos(lat):
+                window = math.asin(math.sin(band) / math.cos(lat))
+                dlng = np.abs((self._lngs - lng + math.pi) % (2 * math.pi) - math.pi)
+                mask &= dlng <= window
+            candidates = candidates[mask]
+        distances = haversine_km(lat, lng, self._lats[candidates], self._lngs[candidates])
+        if radius_km is not None:
+            within = distances <= radius_km
+            candidates, distances = candidates[within], distances[within]
+        if k is not None and k < len(candidates):
+            nearest = np.argpartition(distances, k - 1)[:k]
+            candidates, distances = candidates[nearest], distances[nearest]
+        order = np.argsort(distances, kind="stable")
+        return [(self._items[candidates[i]], float(distances[i])) for i in order]
+
+
+def _nearest_neighbour(distances: np.ndarray, start: int, end: Optional[int]) -> List[int]:
+    count = len(distances)
+    unvisited = np.ones(count, dtype=bool)
+    unvisited[start] = False
+    if end is not None:
+        unvisited[end] = False
+    order = [start]
+    while unvisited.any():
+        row = np.where(unvisited, distances[order[-1]], np.inf)
+        following = int(np.argmin(row))
+        order.append(following)
+        unvisited[following] = False
+    if end is not None:
+        order.append(end)
+    return order
+
+
+def _two_opt(order: List[int], distances: np.ndarray, fixed_end: bool, max_passes: int = 50) -> List[int]:
+    """Reverse segments while that shortens the path; the first stop never moves"""
+    route = np.array(order)
+    count = len(route)
+    last = count - 2 if fixed_end else count - 1
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, last):
+            before, first = route[i - 1], route[i]
+            ends = np.arange(i + 1, last + 1)
+            segment_ends = route[ends]
+            has_next = ends < count - 1
+            following = route[np.minimum(ends + 1, count - 1)]
+            current = distances[before, first] + np.where(has_next, distances[segment_ends, following], 0.0)
+            proposed = distances[before, segment_ends] + np.where(has_next, distances[first, following], 0.0)
+            delta = proposed - current
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                j = ends[best]
+                route[i:j + 1] = route[i:j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return route.tolist()
+
+
+def plan_route(
+    points: Sequence[Tuple[float, float]],
+    start: Optional[Tuple[float, float]] = None,
+    return_to_start: bool = False,
+) -> Tuple[List[int], List[float]]:
+    """Order points into a short visiting route (nearest neighbour + 2-opt).
+
+    Returns the visiting order as indices into ``points`` and the length in
+    km of each leg; the first leg starts at ``start`` when one is given.
+    Without a start the route may begin at any point.
+    """
+    if not points:
+        return [], []
+    nodes = [start] + list(points) if start is not None else list(points)
+    distances = distance_matrix(nodes)
+    if start is None:
+        # A virtual depot at zero distance from every point leaves both ends free
+        distances = np.pad(distances, ((1, 0), (1, 0)))
+    end = len(distances) if return_to_start and start is not None else None
+    if end is not None:
+        distances = np.pad(distances, ((0, 1), (0, 1)))
+        distances[-1, :] = distances[0, :]
+        distances[:, -1] = distances[:, 0]
+    route = _nearest_neighbour(distances, 0, end)
+    route = _two_opt(route, distances, fixed_end=end is not None)
+    legs = [float(distances[a, b]) for a, b in zip(route, route[1:])]
+    stops = route[1:-1] if end is not None else route[1:]
+    if start is None:
+        # Drop the depot's zero-length first leg
+        legs = legs[1:]
+    # Point indices are shifted by one by the start point or the depot
+    return [index - 1 for index in stops], legs
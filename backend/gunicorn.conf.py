@@ -0,0 +1,33 @@
+"""Gunicorn settings for serving the API with one uvicorn worker per core.
+
+Run from the backend directory:
+    gunicorn -c gunicorn.conf.py server:app
+
+The app is imported once in the master and forked (preload_app); each worker
+then runs the lifespan in server.py and opens its own Mongo connections,
+background tasks and image process pool. Caches stay per worker and are kept
+coherent through the invalidation bus: "local" (the default here) reaches the
+workers on this node, "mongo" reaches every node but needs a replica set.
+
+Limits such as LLM_MAX_CONCURRENCY, MONGO_MAX_POOL_SIZE and IMAGE_WORKERS
+apply per worker, and /metrics reports the worker that answers the scrape.
+"""
+import multiprocessing
+import os
+
+# Must be set before the app is imported by the preloading master
+os.environ.setdefault('CACHE_INVALIDATION', 'local')
+
+bind = os.environ.get('BIND', '0.0.0.0:8001')
+workers = int(os.environ.get('WEB_CONCURRENCY', str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Chat streams can run for a while; give them time to finish on shutdown
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+
+# Recycle workers after this many requests (0 disables), with jitter so they do not restart together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '0'))
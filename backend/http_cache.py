@@ -0,0 +1,82 @@
+import hashlib
+import re
+from typing import Callable, List, Optional, Tuple
+
+
+def make_etag(*parts: str) -> str:
+    digest = hashlib.blake2b("|".join(parts).encode(), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        # If-None-Match uses weak comparison, so W/ prefixes are ignored
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+class CacheRule:
+    """Paths whose representation is fully determined by ``token()`` plus the URL"""
+
+    def __init__(self, pattern: str, token: Callable[[], Optional[str]], cache_control: str):
+        self.pattern = re.compile(pattern)
+        self.token = token
+        self.cache_control = cache_control
+
+
+class ConditionalGetMiddleware:
+    """ETag / If-None-Match handling for read-only endpoints.
+
+    The ETag is derived from the rule's token (e.g. the catalog fingerprint)
+    and the request URL, so a matching If-None-Match is answered with 304
+    before the request reaches FastAPI. A rule whose token is None (catalog
+    not loaded yet) lets the request through untouched.
+    """
+
+    def __init__(self, app, rules: List[CacheRule]):
+        self.app = app
+        self.rules = rules
+
+    def _match(self, scope) -> Optional[Tuple[CacheRule, str]]:
+        for rule in self.rules:
+            if rule.pattern.fullmatch(scope["path"]):
+                token = rule.token()
+                if token is None:
+                    return None
+                query = scope.get("query_string", b"").decode("latin-1")
+                return rule, make_etag(token, scope["path"], query)
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            return await self.app(scope, receive, send)
+        matched = self._match(scope)
+        if matched is None:
+            return await self.app(scope, receive, send)
+        rule, etag = matched
+        cache_headers = [
+            (b"etag", etag.encode()),
+            (b"cache-control", rule.cache_control.encode()),
+        ]
+
+        if_none_match = next(
+            (value.decode("latin-1") for name, value in scope["headers"] if name == b"if-none-match"),
+            None
+        )
+        if if_none_match and etag_matches(if_none_match, etag):
+            await send({"type": "http.response.start", "status": 304, "headers": cache_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message["headers"] = list(message.get("headers", [])) + cache_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
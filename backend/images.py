@@ -0,0 +1,447 @@
+import asyncio
+import base64
+import fcntl
+import hashlib
+import io
+import ipaddress
+import json
+import logging
+import multiprocessing
+import os
+import re
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import httpx
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+IMMUTABLE = "public, max-age=31536000, immutable"
+PLACEHOLDER_WIDTH = 16
+
+_HASH = re.compile(r"[0-9a-f]{64}")
+
+# Image hosts of the bundled catalog; a leading dot also allows subdomains
+DEFAULT_ALLOWED_HOSTS = ("images.pexels.com", "images.unsplash.com")
+MAX_REDIRECTS = 5
+
+
+class SourceNotAllowed(ValueError):
+    """A source URL, or a redirect it led to, is outside the allowed schemes, hosts or addresses"""
+
+
+def available_formats() -> List[str]:
+    """Output formats this Pillow build can encode, best first"""
+    if Image is None:
+        return []
+    return [name for name in ("avif", "webp") if features.check(name)] + ["jpeg"]
+
+
+def _open(path: str):
+    image = Image.open(path)
+    return ImageOps.exif_transpose(image)
+
+
+def probe_image(path: str) -> Dict:
+    """Size and an inline LQIP placeholder for an original; runs in the process pool"""
+    with _open(path) as image:
+        width, height = image.size
+        thumbnail = image.convert("RGB")
+        thumbnail.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH * 4))
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, "WEBP" if features.check("webp") else "JPEG", quality=40)
+    mime = "image/webp" if features.check("webp") else "image/jpeg"
+    return {
+        "width": width,
+        "height": height,
+        "placeholder": f"data:{mime};base64,{base64.b64encode(buffer.getvalue()).decode()}",
+    }
+
+
+def render_derivative(source: str, destination: str, width: int, fmt: str, quality: int, avif_speed: int):
+    """Resize an original to ``width`` and encode it; runs in the process pool"""
+    with _open(source) as image:
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        keep_alpha = fmt != "jpeg" and image.mode in ("RGBA", "LA", "P")
+        image = image.convert("RGBA" if keep_alpha else "RGB")
+        options = {"quality": quality}
+        if fmt == "avif":
+            options["speed"] = avif_speed
+        elif fmt == "webp":
+            options["method"] = 4
+        else:
+            options.update(optimize=True, progressive=True)
+        temporary = f"{destination}.{os.getpid()}.tmp"
+        image.save(temporary, fmt.upper(), **options)
+    os.replace(temporary, destination)
+
+
+class SingleFlight:
+    """Run one call per key at a time; concurrent callers for the key share its result"""
+
+    def __init__(self):
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+
+    async def run(self, key: Tuple, factory):
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await factory()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+
+class ImageService:
+    """Fetch-once image originals with resized, re-encoded derivatives.
+
+    Originals are downloaded a single time and stored under the SHA-256 of
+    their bytes, so URLs that serve the same file share one copy, and a
+    derivative URL (hash + width) always names the same bytes and can be
+    cached forever. Decoding, resizing and encoding run in a process pool.
+    Only URLs handed to ``ingest`` are ever fetched; requests for
+    derivatives are served from the cache or rendered from a stored original.
+    Since catalog records name the URLs, every fetch and every redirect hop
+    must use an allowed scheme and host and resolve to public addresses.
+
+    Several workers may share one cache directory: index.json is merged
+    under a file lock on every write, and ``reload_index`` picks up what
+    other workers have ingested.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        widths: Sequence[int] = (320, 640, 960, 1280, 1920),
+        quality: Optional[Dict[str, int]] = None,
+        avif_speed: int = 6,
+        workers: int = 2,
+        fetch_concurrency: int = 4,
+        fetch_timeout: float = 20.0,
+        max_source_bytes: int = 25 * 1024 * 1024,
+        allowed_hosts: Sequence[str] = DEFAULT_ALLOWED_HOSTS,
+        allowed_schemes: Sequence[str] = ("https",),
+        allow_private_addresses: bool = False,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.widths = tuple(sorted(widths))
+        self.quality = {"avif": 50, "webp": 75, "jpeg": 80, **(quality or {})}
+        self.avif_speed = avif_speed
+        self.workers = workers
+        self.fetch_timeout = fetch_timeout
+        self.max_source_bytes = max_source_bytes
+        self.allowed_hosts = tuple(host.lower() for host in allowed_hosts)
+        self.allowed_schemes = tuple(allowed_schemes)
+        self.allow_private_addresses = allow_private_addresses
+        self.formats = available_formats()
+        self._fetch_slots = asyncio.Semaphore(fetch_concurrency)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._flights = SingleFlight()
+        self._sources: Dict[str, str] = {}
+        self._images: Dict[str, Dict] = {}
+        self._failed: Dict[str, str] = {}
+        # Bumped whenever new image metadata becomes available
+        self.version = 0
+        self._fingerprint = (-1, "")
+        self.rendered = 0
+        self.served_from_cache = 0
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    @property
+    def _index_path(self) -> Path:
+        return self.cache_dir / "index.json"
+
+    def original_path(self, digest: str) -> Path:
+        return self.cache_dir / "originals" / digest[:2] / digest
+
+    def _derivative_path(self, digest: str, width: int, fmt: str) -> Path:
+        return self.cache_dir / "derived" / digest[:2] / digest / f"{width}.{fmt}"
+
+    @property
+    def fingerprint(self) -> str:
+        """Digest of which sources have metadata; unlike version, equal across workers that agree"""
+        if self._fingerprint[0] != self.version:
+            digest = hashlib.blake2b(json.dumps(sorted(self._sources.items())).encode(), digest_size=8)
+            self._fingerprint = (self.version, digest.hexdigest())
+        return self._fingerprint[1]
+
+    def start(self):
+        if not self.enabled:
+            logger.warning("Pillow is not installed; image derivatives are disabled")
+            return
+        (self.cache_dir / "originals").mkdir(parents=True, exist_ok=True)
+        if self._merge(self._read_index()):
+            self.version += 1
+        # Spawned workers do not inherit the server's threads or open sockets
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        # Redirects are followed in _download, which checks every hop
+        self._http = httpx.AsyncClient(timeout=self.fetch_timeout, follow_redirects=False)
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _read_index(self) -> Dict:
+        if not self._index_path.exists():
+            return {}
+        return json.loads(self._index_path.read_text())
+
+    def _merge(self, index: Dict) -> bool:
+        """Add index entries this process does not know yet; True if there were any"""
+        images = {digest: image for digest, image in index.get("images", {}).items() if digest not in self._images}
+        sources = {url: digest for url, digest in index.get("sources", {}).items() if url not in self._sources}
+        self._images.update(images)
+        self._sources.update(sources)
+        for url in sources:
+            self._failed.pop(url, None)
+        return bool(images or sources)
+
+    def _save_index(self, sources: Dict[str, str], images: Dict[str, Dict]) -> Dict:
+        """Merge entries into index.json; returns the index as other workers left it"""
+        with open(self.cache_dir / "index.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = self._read_index()
+            temporary = self._index_path.with_suffix(f".{os.getpid()}.tmp")
+            temporary.write_text(json.dumps({
+                "sources": {**index.get("sources", {}), **sources},
+                "images": {**index.get("images", {}), **images},
+            }))
+            os.replace(temporary, self._index_path)
+        return index
+
+    async def reload_index(self):
+        """Pick up images that other workers sharing the cache directory have ingested"""
+        if self._pool is None:
+            return
+        if self._merge(await asyncio.to_thread(self._read_index)):
+            self.version += 1
+
+    def _host_allowed(self, host: str) -> bool:
+        host = host.lower()
+        return any(
+            host == allowed or (allowed.startswith(".") and host.endswith(allowed))
+            for allowed in self.allowed_hosts
+        )
+
+    async def check_source(self, url: httpx.URL):
+        """Raise SourceNotAllowed unless the URL may be fetched"""
+        if url.scheme not in self.allowed_schemes:
+            raise SourceNotAllowed(f"Scheme not allowed: {url.scheme or 'none'}")
+        if not url.host or not self._host_allowed(url.host):
+            raise SourceNotAllowed(f"Host not allowed: {url.host or 'none'}")
+        if self.allow_private_addresses:
+            return
+        port = url.port or (443 if url.scheme == "https" else 80)
+        try:
+            addresses = await asyncio.get_running_loop().getaddrinfo(url.host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise SourceNotAllowed(f"Cannot resolve {url.host}: {e}")
+        for *_, sockaddr in addresses:
+            address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+            if not address.is_global:
+                raise SourceNotAllowed(f"{url.host} resolves to a non-public address")
+
+    async def _download(self, url: str) -> Tuple[str, Path]:
+        digest = hashlib.sha256()
+        name = hashlib.sha256(url.encode()).hexdigest()
+        temporary = self.cache_dir / "originals" / f"download-{name}.{os.getpid()}.tmp"
+        size = 0
+        location = httpx.URL(url)
+        try:
+            async with self._fetch_slots:
+                for _ in range(MAX_REDIRECTS + 1):
+                    await self.check_source(location)
+                    async with self._http.stream("GET", location) as response:
+                        if response.is_redirect:
+                            location = response.url.join(response.headers["location"])
+                            continue
+                        response.raise_for_status()
+                        content_type = response.headers.get("content-type", "")
+                        if not content_type.startswith("image/"):
+                            raise ValueError(f"Not an image: {content_type or 'no content type'}")
+                        with open(temporary, "wb") as output:
+                            async for chunk in response.aiter_bytes():
+                                size += len(chunk)
+                                if size > self.max_source_bytes:
+                                    raise ValueError(f"Image larger than {self.max_source_bytes} bytes")
+                                digest.update(chunk)
+                                output.write(chunk)
+                        break
+                else:
+                    raise ValueError(f"More than {MAX_REDIRECTS} redirects")
+        except BaseException:
+            temporary.unlink(missing_ok=True)
+            raise
+        return digest.hexdigest(), temporary
+
+    async def _ingest(self, url: str) -> Dict:
+        digest, temporary = await self._download(url)
+        try:
+            original = self.original_path(digest)
+            if digest not in self._images:
+                original.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(temporary, original)
+                self._images[digest] = await self.run_in_pool(probe_image, str(original))
+        finally:
+            temporary.unlink(missing_ok=True)
+        self._sources[url] = digest
+        self._failed.pop(url, None)
+        # Snapshots, since the event loop keeps adding entries while the thread writes
+        index = await asyncio.to_thread(self._save_index, dict(self._sources), dict(self._images))
+        self._merge(index)
+        self.version += 1
+        return self._images[digest]
+
+    async def ingest(self, url: str) -> Optional[Dict]:
+        """Fetch and probe a source URL once; later calls answer from the index"""
+        if not self.enabled or self._pool is None:
+            return None
+        if url in self._sources:
+            return self._images.get(self._sources[url])
+        try:
+            return await self._flights.run(("ingest", url), lambda: self._ingest(url))
+        except Exception as e:
+            self._failed[url] = str(e)
+            logger.warning("Could not ingest image %s: %s", url, e)
+            return None
+
+    async def ingest_many(self, urls: Iterable[str]):
+        # Skip sources another worker has fetched in the meantime
+        await self.reload_index()
+        pending = [url for url in dict.fromkeys(urls) if url and url not in self._sources]
+        if pending:
+            await asyncio.gather(*(self.ingest(url) for url in pending))
+            logger.info("Image cache holds %d sources (%d failed)", len(self._sources), len(self._failed))
+
+    def digest_for(self, url: str) -> Optional[str]:
+        """Content hash of an ingested source URL"""
+        return self._sources.get(url)
+
+    async def run_in_pool(self, function, *args):
+        """Run CPU-bound image work in the process pool"""
+        return await asyncio.get_running_loop().run_in_executor(self._pool, function, *args)
+
+    def _widths_for(self, original_width: int) -> List[int]:
+        """Configured widths worth offering; the first at or above the original stands for it"""
+        widths = [width for width in self.widths if width < original_width]
+        larger = [width for width in self.widths if width >= original_width]
+        return widths + larger[:1]
+
+    def variants(self, url: str) -> Optional[Dict]:
+        """srcset metadata for an ingested source URL, or None until it is ingested"""
+        digest = self._sources.get(url)
+        image = self._images.get(digest) if digest else None
+        if image is None:
+            return None
+        candidates = [
+            f"/api/images/{digest}/{width} {min(width, image['width'])}w"
+            for width in self._widths_for(image["width"])
+        ]
+        return {
+            "hash": digest,
+            "width": image["width"],
+            "height": image["height"],
+            "srcset": ", ".join(candidates),
+            "formats": [MEDIA_TYPES[fmt] for fmt in self.formats],
+            "placeholder": image["placeholder"],
+        }
+
+    def negotiate(self, accept: str, requested: Optional[str] = None) -> str:
+        """Pick an output format from ?format= or the Accept header"""
+        if requested:
+            if requested not in self.formats:
+                raise ValueError(f"Unsupported format: {requested}")
+            return requested
+        for fmt in self.formats:
+            if MEDIA_TYPES[fmt] in accept:
+                return fmt
+        return "jpeg"
+
+    async def derivative(self, digest: str, width: int, fmt: str) -> Optional[Path]:
+        """Path to the cached derivative, rendering it first if needed; None if unknown"""
+        if not _HASH.fullmatch(digest) or self._pool is None:
+            return None
+        if digest not in self._images and self.original_path(digest).exists():
+            # Ingested by another worker since this one last read the index
+            await self.reload_index()
+        if digest not in self._images:
+            return None
+        if width not in self.widths:
+            raise ValueError(f"Width must be one of {', '.join(map(str, self.widths))}")
+        path = self._derivative_path(digest, width, fmt)
+        if path.exists():
+            self.served_from_cache += 1
+            return path
+
+        async def render():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            await self.run_in_pool(
+                render_derivative,
+                str(self.original_path(digest)), str(path), width, fmt, self.quality[fmt], self.avif_speed
+            )
+            self.rendered += 1
+            return path
+
+        return await self._flights.run(("render", digest, width, fmt), render)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "formats": self.formats,
+            "widths": list(self.widths),
+            "sources": len(self._sources),
+            "originals": len(self._images),
+            "failed": len(self._failed),
+            "rendered": self.rendered,
+            "served_from_cache": self.served_from_cache,
+        }
+
+
+def create_image_service(default_dir: Path) -> ImageService:
+    """Build the image service from IMAGE_* environment variables"""
+    return ImageService(
+        Path(os.environ.get('IMAGE_CACHE_DIR', str(default_dir))),
+        widths=[int(width) for width in os.environ.get('IMAGE_WIDTHS', '320,640,960,1280,1920').split(',')],
+        quality={
+            "avif": int(os.environ.get('IMAGE_AVIF_QUALITY', '50')),
+            "webp": int(os.environ.get('IMAGE_WEBP_QUALITY', '75')),
+            "jpeg": int(os.environ.get('IMAGE_JPEG_QUALITY', '80')),
+        },
+        avif_speed=int(os.environ.get('IMAGE_AVIF_SPEED', '6')),
+        workers=int(os.environ.get('IMAGE_WORKERS', '2')),
+        fetch_concurrency=int(os.environ.get('IMAGE_FETCH_CONCURRENCY', '4')),
+        fetch_timeout=float(os.environ.get('IMAGE_FETCH_TIMEOUT_SECONDS', '20')),
+        max_source_bytes=int(os.environ.get('IMAGE_MAX_SOURCE_BYTES', str(25 * 1024 * 1024))),
+        allowed_hosts=[host.strip() for host in os.environ.get('IMAGE_ALLOWED_HOSTS', ','.join(DEFAULT_ALLOWED_HOSTS)).split(',') if host.strip()],
+        allowed_schemes=[scheme.strip() for scheme in os.environ.get('IMAGE_ALLOWED_SCHEMES', 'https').split(',')],
+        allow_private_addresses=os.environ.get('IMAGE_ALLOW_PRIVATE_ADDRESSES', 'false').lower() == 'true'
+    )
@@ -0,0 +1,104 @@
+import logging
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Every index the API relies on, keyed by collection
+INDEXES: Dict[str, List[IndexModel]] = {
+    "sikkim_monasteries": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Not unique: same-named monasteries are allowed; backs upserts by name
+        IndexModel([("name", ASCENDING)], name="name"),
+        IndexModel([("district", ASCENDING)], name="district"),
+        IndexModel([("tradition", ASCENDING)], name="tradition"),
+    ],
+    "chat_messages": [
+        IndexModel(
+            [("session_id", ASCENDING), ("timestamp", DESCENDING), ("id", DESCENDING)],
+            name="session_timestamp_id"
+        ),
+    ],
+    "status_check_rollups": [
+        IndexModel([("client_name", ASCENDING), ("hour", DESCENDING)], name="client_hour_unique", unique=True),
+        IndexModel([("hour", DESCENDING)], name="hour"),
+    ],
+    "chat_memory": [
+        IndexModel([("session_id", ASCENDING)], name="session_unique", unique=True),
+    ],
+}
+
+# Indexes earlier versions declared that would now conflict with INDEXES;
+# dropping one removes no documents
+OBSOLETE_INDEXES: Dict[str, List[str]] = {
+    "sikkim_monasteries": ["name_unique"],
+}
+
+# Query shapes issued on hot paths, checked against the planner at startup
+HOT_QUERIES = [
+    {"collection": "sikkim_monasteries", "filter": {"id": ""}},
+    {"collection": "sikkim_monasteries", "distinct": "district"},
+    {"collection": "sikkim_monasteries", "distinct": "tradition"},
+    {"collection": "chat_messages", "filter": {"session_id": ""}, "sort": [("timestamp", DESCENDING), ("id", DESCENDING)]},
+]
+
+
+async def ensure_indexes(db):
+    """Create any declared index that does not exist yet, each on its own so one failure spares the rest"""
+    for collection, models in INDEXES.items():
+        for name in OBSOLETE_INDEXES.get(collection, []):
+            try:
+                if name in await db[collection].index_information():
+                    await db[collection].drop_index(name)
+                    logger.info("Dropped obsolete index %s on %s", name, collection)
+            except OperationFailure as e:
+                logger.error("Could not drop obsolete index %s on %s: %s", name, collection, e)
+        created = []
+        for model in models:
+            name = model.document["name"]
+            try:
+                await db[collection].create_indexes([model])
+                created.append(name)
+            except OperationFailure as e:
+                logger.error("Could not create index %s on %s: %s", name, collection, e)
+        logger.info("Ensured indexes on %s: %s", collection, ", ".join(created))
+
+
+def _plan_stages(plan) -> List[str]:
+    stages = []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, dict):
+            if "stage" in node:
+                stages.append(node["stage"])
+            pending.extend(node.values())
+        elif isinstance(node, list):
+            pending.extend(node)
+    return stages
+
+
+async def check_query_plans(db):
+    """Log whether each hot query is answered from an index or a collection scan"""
+    for query in HOT_QUERIES:
+        collection = query["collection"]
+        if "distinct" in query:
+            command = {"distinct": collection, "key": query["distinct"]}
+            label = f"{collection}.distinct({query['distinct']})"
+        else:
+            command = {"find": collection, "filter": query["filter"]}
+            if "sort" in query:
+                command["sort"] = dict(query["sort"])
+            label = f"{collection}.find({', '.join(query['filter'])})"
+        try:
+            explanation = await db.command("explain", command, verbosity="queryPlanner")
+        except Exception as e:
+            logger.warning("Could not explain %s: %s", label, e)
+            continue
+        stages = _plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+        if "COLLSCAN" in stages or not any(s in ("IXSCAN", "DISTINCT_SCAN") for s in stages):
+            logger.warning("Query %s is not index-covered (plan: %s)", label, " > ".join(stages))
+        else:
+            logger.info("Query %s uses an index (plan: %s)", label, " > ".join(stages))
@@ -0,0 +1,408 @@
+import asyncio
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+from prompts import TokenCounter
+from tracing import tracer
+
+# Upstream status codes worth retrying
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+LLM_DURATION = REGISTRY.histogram(
+    "llm_request_duration_seconds",
+    "Upstream LLM call time including retries, excluding queueing",
+    ["mode", "outcome"],
+    LLM_BUCKETS
+)
+LLM_TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from an admitted streaming call to its first token",
+    [],
+    LLM_BUCKETS
+)
+LLM_QUEUE_WAIT = REGISTRY.histogram(
+    "llm_queue_wait_seconds",
+    "Time spent waiting for a dispatcher slot",
+    [],
+    (0.0, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total",
+    "Prompt and completion tokens sent to and received from the LLM",
+    ["kind"]
+)
+
+
+class EmergentLlmBackend:
+    """LLM calls through emergentintegrations' LlmChat"""
+
+    def __init__(self, api_key: str, provider: str = "openai", model: str = "gpt-4o-mini"):
+        self.api_key = api_key
+        self.provider = provider
+        self.model = model
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    def _chat(self, session_id: str, system_message: str):
+        from emergentintegrations.llm.chat import LlmChat
+
+        return LlmChat(
+            api_key=self.api_key,
+            session_id=session_id,
+            system_message=system_message
+        ).with_model(self.provider, self.model)
+
+    async def complete(self, session_id: str, system_message: str, text: str, usage: Optional["LlmUsage"] = None) -> str:
+        from emergentintegrations.llm.chat import UserMessage
+
+        # LlmChat returns only the reply text, so usage is left for the dispatcher to estimate
+        chat = self._chat(session_id, system_message)
+        return await chat.send_message(UserMessage(text=text))
+
+    async def stream(self, session_id: str, system_message: str, text: str, usage: Optional["LlmUsage"] = None) -> AsyncIterator[str]:
+        # LlmChat only exposes whole completions, so the reply arrives as one chunk
+        yield await self.complete(session_id, system_message, text, usage)
+
+
+class FakeLlmBackend:
+    """Offline stand-in that yields a canned reply word by word on a schedule"""
+
+    configured = True
+
+    def __init__(self, first_token_delay: float = 0.2, token_delay: float = 0.02):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+
+    def _reply(self, text: str) -> str:
+        return (
+            f"Thank you for asking about \"{text}\". Sikkim's monasteries are best visited "
+            "between October and May, when the mountain views are clear and most festivals "
+            "take place. Remember to carry your Inner Line Permit and dress respectfully."
+        )
+
+    async def complete(self, session_id: str, system_message: str, text: str, usage: Optional["LlmUsage"] = None) -> str:
+        return "".join([token async for token in self.stream(session_id, system_message, text, usage)])
+
+    async def stream(self, session_id: str, system_message: str, text: str, usage: Optional["LlmUsage"] = None) -> AsyncIterator[str]:
+        await asyncio.sleep(self.first_token_delay)
+        words = self._reply(text).split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield word if i == 0 else f" {word}"
+
+
+class LlmUsage:
+    """Tokens that one caller's LLM calls consumed; a call coalesced onto another's costs nothing.
+
+    Backends that get token counts from their provider add them to the
+    ``usage`` passed to ``complete``/``stream``; for the others the
+    dispatcher estimates them with its TokenCounter.
+    """
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @property
+    def total(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class LlmOverloaded(Exception):
+    """Raised when a call cannot be admitted; carries the HTTP status and Retry-After"""
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: int = 1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS_CODES
+    name = type(error).__name__
+    return any(marker in name for marker in ("RateLimit", "Timeout", "APIConnection", "ServiceUnavailable"))
+
+
+class ReservedStream:
+    """Token stream holding a dispatcher slot until it is exhausted or closed"""
+
+    def __init__(self, dispatcher: "LlmDispatcher", generator):
+        self._dispatcher = dispatcher
+        self._generator = generator
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            return await self._generator.__anext__()
+        except BaseException:
+            self._release()
+            raise
+
+    async def aclose(self):
+        try:
+            await self._generator.aclose()
+        finally:
+            self._release()
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._dispatcher._release()
+
+
+class LlmDispatcher:
+    """Admission control in front of an LLM backend.
+
+    At most ``max_concurrency`` calls run at once and at most ``max_queue``
+    wait for a slot, each for no longer than ``queue_timeout`` seconds;
+    anything beyond that fails fast with ``LlmOverloaded``. Identical
+    in-flight completions share one upstream call, and retryable upstream
+    errors are retried with full-jitter exponential backoff.
+    """
+
+    def __init__(
+        self,
+        backend,
+        max_concurrency: int = 8,
+        max_queue: int = 64,
+        queue_timeout: float = 10.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        token_counter: Optional[TokenCounter] = None,
+    ):
+        self.backend = backend
+        self.token_counter = token_counter or TokenCounter()
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self._waiting = 0
+        self._running = 0
+        self._wait_times = deque(maxlen=1000)
+        self._service_times = deque(maxlen=1000)
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.retries = 0
+        self.coalesced = 0
+        # Calls whose tokens came from the provider rather than the TokenCounter
+        self.reported_usage = 0
+        self.estimated_usage = 0
+
+    @property
+    def configured(self) -> bool:
+        return self.backend.configured
+
+    def retry_after(self) -> int:
+        """Rough seconds until a queued call would get a slot"""
+        service_time = sum(self._service_times) / len(self._service_times) if self._service_times else 1.0
+        return max(1, math.ceil(service_time * (self._waiting + 1) / self.max_concurrency))
+
+    async def _acquire(self):
+        if not self._semaphore.locked() and not self._waiting:
+            await self._semaphore.acquire()
+            self._wait_times.append(0.0)
+            LLM_QUEUE_WAIT.observe(0.0)
+            self._running += 1
+            return
+        if self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise LlmOverloaded("AI service is busy, please retry shortly", 503, self.retry_after())
+        self._waiting += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise LlmOverloaded("Timed out waiting for the AI service", 503, self.retry_after())
+        finally:
+            self._waiting -= 1
+            self._wait_times.append(time.monotonic() - started)
+            LLM_QUEUE_WAIT.observe(time.monotonic() - started)
+        self._running += 1
+
+    def _release(self):
+        self._running -= 1
+        self._semaphore.release()
+
+    async def _backoff(self, attempt: int, error: Exception):
+        if attempt >= self.max_retries or not is_retryable(error):
+            if getattr(error, "status_code", None) == 429 or "RateLimit" in type(error).__name__:
+                raise LlmOverloaded("AI service rate limit reached", 429, self.retry_after()) from error
+            raise error
+        self.retries += 1
+        await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+
+    def _count_tokens(
+        self, system_message: str, text: str, response: Optional[str], reported: LlmUsage, usage: Optional[LlmUsage] = None
+    ):
+        """Record a call's tokens: as the provider reported them, else estimated"""
+        if reported.total:
+            self.reported_usage += 1
+            prompt_tokens, completion_tokens = reported.prompt_tokens, reported.completion_tokens
+        else:
+            self.estimated_usage += 1
+            prompt_tokens = self.token_counter.count(system_message) + self.token_counter.count(text)
+            completion_tokens = self.token_counter.count(response) if response else 0
+        LLM_TOKENS.inc(prompt_tokens, kind="prompt")
+        if completion_tokens:
+            LLM_TOKENS.inc(completion_tokens, kind="completion")
+        if usage is not None:
+            usage.prompt_tokens += prompt_tokens
+            usage.completion_tokens += completion_tokens
+
+    async def _complete(self, session_id: str, system_message: str, text: str, usage: Optional[LlmUsage] = None) -> str:
+        with tracer.span("llm.queue"):
+            await self._acquire()
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            with tracer.span("llm.complete"):
+                attempt = 0
+                while True:
+                    try:
+                        reported = LlmUsage()
+                        response = await self.backend.complete(session_id, system_message, text, reported)
+                        self.completed += 1
+                        outcome = "ok"
+                        self._count_tokens(system_message, text, response, reported, usage)
+                        return response
+                    except Exception as e:
+                        await self._backoff(attempt, e)
+                        attempt += 1
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            self._service_times.append(elapsed)
+            LLM_DURATION.observe(elapsed, mode="complete", outcome=outcome)
+            self._release()
+
+    async def complete(self, session_id: str, system_message: str, text: str, usage: Optional[LlmUsage] = None) -> str:
+        """Complete one message; tokens it consumed are added to ``usage`` when given"""
+        key = (system_message, text)
+        call = self._inflight.get(key)
+        if call is not None:
+            self.coalesced += 1
+        else:
+            # A task of its own, so a caller that goes away does not cancel it
+            # for the others sharing it
+            call = asyncio.get_running_loop().create_task(self._complete(session_id, system_message, text, usage))
+            self._inflight[key] = call
+            call.add_done_callback(lambda _: self._inflight.pop(key, None) if self._inflight.get(key) is call else None)
+        self._waiters[call] = self._waiters.get(call, 0) + 1
+        try:
+            return await asyncio.shield(call)
+        finally:
+            self._waiters[call] -= 1
+            if not self._waiters[call]:
+                del self._waiters[call]
+                # Nobody is left to read the reply
+                call.cancel()
+
+    async def _stream(self, session_id: str, system_message: str, text: str, usage: Optional[LlmUsage] = None) -> AsyncIterator[str]:
+        started = time.monotonic()
+        outcome = "error"
+        chunks: List[str] = []
+        reported = LlmUsage()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    async for token in self.backend.stream(session_id, system_message, text, reported):
+                        if not chunks:
+                            LLM_TIME_TO_FIRST_TOKEN.observe(time.monotonic() - started)
+                        chunks.append(token)
+                        yield token
+                    self.completed += 1
+                    outcome = "ok"
+                    return
+                except Exception as e:
+                    # Tokens already sent cannot be taken back, so only retry before the first one
+                    if chunks:
+                        raise
+                    await self._backoff(attempt, e)
+                    attempt += 1
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            self._service_times.append(elapsed)
+            if outcome == "error" and chunks:
+                outcome = "interrupted"
+            LLM_DURATION.observe(elapsed, mode="stream", outcome=outcome)
+            self._count_tokens(system_message, text, "".join(chunks), reported, usage)
+            # A span cannot wrap the yields of a generator, so export it once measured
+            tracer.record("llm.stream", time.time() - elapsed, elapsed, outcome=outcome, chunks=len(chunks))
+
+    async def open_stream(self, session_id: str, system_message: str, text: str, usage: Optional[LlmUsage] = None) -> ReservedStream:
+        """Wait for a slot, then return a token stream that frees it when done"""
+        with tracer.span("llm.queue"):
+            await self._acquire()
+        return ReservedStream(self, self._stream(session_id, system_message, text, usage))
+
+    def stats(self) -> Dict[str, float]:
+        wait_times = sorted(self._wait_times)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "queue_depth": self._waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "retries": self.retries,
+            "coalesced": self.coalesced,
+            "reported_usage": self.reported_usage,
+            "estimated_usage": self.estimated_usage,
+            "wait_ms_mean": round(1000 * sum(wait_times) / len(wait_times), 2) if wait_times else 0.0,
+            "wait_ms_p95": round(1000 * wait_times[int(0.95 * (len(wait_times) - 1))], 2) if wait_times else 0.0,
+        }
+
+
+def create_llm_backend():
+    """Build the backend selected by LLM_BACKEND ("emergent" or "fake")"""
+    if os.environ.get('LLM_BACKEND', 'emergent') == 'fake':
+        return FakeLlmBackend(
+            first_token_delay=float(os.environ.get('FAKE_LLM_FIRST_TOKEN_DELAY', '0.2')),
+            token_delay=float(os.environ.get('FAKE_LLM_TOKEN_DELAY', '0.02'))
+        )
+    return EmergentLlmBackend(api_key=os.environ.get('EMERGENT_LLM_KEY'))
+
+
+def create_llm_dispatcher(backend, token_counter: Optional[TokenCounter] = None) -> LlmDispatcher:
+    """Build a dispatcher configured from LLM_* environment variables"""
+    return LlmDispatcher(
+        backend,
+        token_counter=token_counter,
+        max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', '8')),
+        max_queue=int(os.environ.get('LLM_MAX_QUEUE', '64')),
+        queue_timeout=float(os.environ.get('LLM_QUEUE_TIMEOUT_SECONDS', '10')),
+        max_retries=int(os.environ.get('LLM_MAX_RETRIES', '2'))
+    )
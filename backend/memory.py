@@ -0,0 +1,146 @@
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from prompts import TokenCounter
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+# Attempts at a conditional memory update that keeps losing races to other requests
+MAX_RECORD_ATTEMPTS = 5
+
+
+def truncate_to_tokens(text: str, budget: int, counter: TokenCounter) -> str:
+    """Cut text at a word boundary so it fits within the token budget"""
+    if counter.count(text) <= budget:
+        return text
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if counter.count(" ".join(words[:middle])) + 1 <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low]) + "…"
+
+
+class ConversationMemory:
+    """Rolling window of recent turns plus a running summary per chat session.
+
+    Documents live in their own collection next to ``chat_messages``. Turns
+    that fall out of the window are folded into an extractive summary which,
+    like every turn in the window, is trimmed to a fixed token budget, so the
+    memory block added to the prompt never outgrows ``token_budget``.
+    """
+
+    def __init__(
+        self,
+        collection,
+        window_turns: int = 6,
+        turn_tokens: int = 200,
+        summary_tokens: int = 300,
+        counter: Optional[TokenCounter] = None,
+    ):
+        self._collection = collection
+        self.window_turns = window_turns
+        self.turn_tokens = turn_tokens
+        self.summary_tokens = summary_tokens
+        self._counter = counter or TokenCounter()
+
+    @property
+    def token_budget(self) -> int:
+        return self.summary_tokens + self.window_turns * self.turn_tokens
+
+    async def load(self, session_id: str) -> Dict:
+        memory = await self._collection.find_one({"session_id": session_id}, {"_id": 0})
+        return memory or {"session_id": session_id, "summary": "", "turns": [], "turn_count": 0}
+
+    def render(self, memory: Dict) -> str:
+        """Format a session's memory as a prompt block ('' for a new session)"""
+        if not memory["turns"] and not memory["summary"]:
+            return ""
+        lines = ["", "Conversation so far:"]
+        if memory["summary"]:
+            lines.append(f"Earlier in this conversation: {memory['summary']}")
+        for turn in memory["turns"]:
+            lines.append(f"Visitor: {turn['user']}")
+            lines.append(f"Guide: {turn['assistant']}")
+        return "\n".join(lines) + "\n"
+
+    def _summarize_turn(self, turn: Dict) -> str:
+        first_sentence = SENTENCE_END.split(turn["assistant"].strip(), maxsplit=1)[0]
+        question = truncate_to_tokens(turn["user"], 30, self._counter)
+        answer = truncate_to_tokens(first_sentence, 40, self._counter)
+        return f"Visitor asked \"{question}\"; guide said: {answer}"
+
+    def _compact_summary(self, summary: str, folded: List[Dict]) -> str:
+        parts = [part for part in summary.split(" | ") if part]
+        parts.extend(self._summarize_turn(turn) for turn in folded)
+        # Drop the oldest points until the summary fits its budget
+        while len(parts) > 1 and self._counter.count(" | ".join(parts)) > self.summary_tokens:
+            parts.pop(0)
+        return truncate_to_tokens(" | ".join(parts), self.summary_tokens, self._counter)
+
+    async def record(self, session_id: str, user_message: str, ai_response: str) -> Dict:
+        """Append a turn, folding turns beyond the window into the summary.
+
+        The write only applies if ``turn_count`` is still the one read, so
+        concurrent requests in a session cannot overwrite each other's turns;
+        the loser reads again and retries.
+        """
+        turn = {
+            "user": truncate_to_tokens(user_message, self.turn_tokens // 2, self._counter),
+            "assistant": truncate_to_tokens(ai_response, self.turn_tokens // 2, self._counter),
+        }
+        for _ in range(MAX_RECORD_ATTEMPTS):
+            memory = await self.load(session_id)
+            turn_count = memory["turn_count"]
+            turns = memory["turns"] + [turn]
+            summary = memory["summary"]
+            if len(turns) > self.window_turns:
+                folded, turns = turns[:-self.window_turns], turns[-self.window_turns:]
+                summary = self._compact_summary(summary, folded)
+            memory.update({
+                "summary": summary,
+                "turns": turns,
+                "turn_count": turn_count + 1,
+                "updated_at": datetime.now(timezone.utc),
+            })
+            if not turn_count:
+                try:
+                    await self._collection.insert_one(dict(memory))
+                    return memory
+                except DuplicateKeyError:
+                    continue
+            result = await self._collection.update_one(
+                {"session_id": session_id, "turn_count": turn_count},
+                {"$set": {key: memory[key] for key in ("summary", "turns", "turn_count", "updated_at")}}
+            )
+            if result.matched_count:
+                return memory
+        # Still contended: keep the turn, though the one it pushes out is not summarized
+        await self._collection.update_one(
+            {"session_id": session_id},
+            {
+                "$push": {"turns": {"$each": [turn], "$slice": -self.window_turns}},
+                "$inc": {"turn_count": 1},
+                "$set": {"updated_at": datetime.now(timezone.utc)},
+                "$setOnInsert": {"summary": ""},
+            },
+            upsert=True
+        )
+        return await self.load(session_id)
+
+    def usage(self, memory: Dict) -> Dict:
+        block = self.render(memory)
+        return {
+            "session_id": memory["session_id"],
+            "turn_count": memory["turn_count"],
+            "window_turns": len(memory["turns"]),
+            "summary": memory["summary"],
+            "memory_tokens": self._counter.count(block) if block else 0,
+            "token_budget": self.token_budget,
+        }
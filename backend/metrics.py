@@ -0,0 +1,257 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+from starlette.routing import Match
+
+from tracing import tracer
+
+# Prometheus' default latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Observations arrive from the event loop and from pymongo's listener threads
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: count per bucket (last one is +Inf), sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        lines = self.header()
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# A collector returns (name, documentation, samples) gauges read at scrape time,
+# each sample being (labels, value)
+Collector = Callable[[], Iterable[Tuple[str, str, Iterable[Tuple[Dict[str, str], float]]]]]
+
+
+class MetricsRegistry:
+    """Counters and histograms plus gauges computed when /metrics is scraped"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+
+    def _register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, collect: Collector):
+        self._collectors.append(collect)
+
+    def render(self) -> bytes:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, documentation, samples in collect():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return ("\n".join(lines) + "\n").encode()
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Time from request start to the last response byte, by route template",
+    ["method", "route", "status"]
+)
+MONGO_COMMAND_DURATION = REGISTRY.histogram(
+    "mongo_command_duration_seconds",
+    "MongoDB command round trips by collection and command",
+    ["collection", "command", "outcome"]
+)
+SPAN_DURATION = REGISTRY.histogram(
+    "span_duration_seconds",
+    "Duration of named stages inside request handlers",
+    ["span"]
+)
+
+tracer.on_end(lambda span: SPAN_DURATION.observe(span.duration, span=span.name))
+
+
+class MetricsMiddleware:
+    """Times every HTTP request under a root span, labelled by its route template"""
+
+    def __init__(self, app, routes: Sequence = ()):
+        self.app = app
+        self.routes = routes
+
+    def _route_path(self, scope) -> str:
+        # The router stores the matched route in the shared scope; requests
+        # answered by an outer middleware (such as a 304) are matched here
+        route = scope.get("route")
+        if route is None:
+            route = next((r for r in self.routes if r.matches(scope)[0] == Match.FULL), None)
+        return getattr(route, "path", None) or "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        with tracer.span("http.request", method=scope["method"], path=scope["path"]) as span:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route_path = self._route_path(scope)
+                span.attributes.update(route=route_path, status=status["code"])
+                HTTP_REQUEST_DURATION.observe(
+                    time.perf_counter() - started,
+                    method=scope["method"], route=route_path, status=str(status["code"])
+                )
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo listener timing each command and exporting it as a span.
+
+    Motor runs commands on executor threads with the caller's context copied,
+    so each command span is parented to the handler stage that issued it.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple, Tuple[str, float]] = {}
+
+    @staticmethod
+    def _collection(event: monitoring.CommandStartedEvent) -> str:
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        return target if isinstance(target, str) else "-"
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        self._pending[(event.connection_id, event.request_id)] = (self._collection(event), time.time())
+
+    def _finish(self, event, outcome: str):
+        collection, started_at = self._pending.pop((event.connection_id, event.request_id), ("-", None))
+        duration = event.duration_micros / 1e6
+        MONGO_COMMAND_DURATION.observe(duration, collection=collection, command=event.command_name, outcome=outcome)
+        if started_at is not None:
+            tracer.record(
+                f"mongo.{event.command_name}", started_at, duration,
+                collection=collection, outcome=outcome
+            )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finish(event, "ok")
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finish(event, "error")
+
+
+def cache_samples(caches: Dict[str, Tuple[int, int]]):
+    """Hit, miss and hit-ratio gauges for named caches given (hits, misses)"""
+    yield "cache_hits", "Lookups answered from the cache", [({"cache": name}, hits) for name, (hits, _) in caches.items()]
+    yield "cache_misses", "Lookups the cache could not answer", [({"cache": name}, misses) for name, (_, misses) in caches.items()]
+    yield "cache_hit_ratio", "Share of lookups answered from the cache", [
+        ({"cache": name}, round(hits / (hits + misses), 4) if hits + misses else 0.0)
+        for name, (hits, misses) in caches.items()
+    ]
+
+
+def stats_samples(prefix: str, documentation: str, stats: Dict, labels: Optional[Dict[str, str]] = None):
+    """One gauge per numeric entry of a component's stats() dict"""
+    for key, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}_{key}", f"{documentation}: {key}", [(labels or {}, value)]
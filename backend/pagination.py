@@ -0,0 +1,65 @@
+import base64
+import json
+from typing import Dict, Iterable, List, Optional, Set
+
+
+def encode_cursor(position: Dict) -> str:
+    raw = json.dumps(position, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict:
+    """Decode an opaque cursor; raises ValueError when it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor")
+    return position
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str], presets: Dict[str, List[str]]) -> Optional[Set[str]]:
+    """Turn a comma-separated ``fields`` parameter into a set of field names.
+
+    Preset names expand to their field lists; unknown names raise ValueError.
+    ``id`` is always included so results can be fetched in full later.
+    """
+    if not fields:
+        return None
+    allowed = set(allowed)
+    selected = {"id"}
+    for name in (part.strip() for part in fields.split(",")):
+        if not name:
+            continue
+        if name in presets:
+            selected.update(presets[name])
+        elif name in allowed:
+            selected.add(name)
+        else:
+            raise ValueError(f"Unknown field: {name}")
+    return selected
+
+
+def page_after(items: List, cursor: Optional[str], limit: Optional[int]):
+    """Slice an ordered in-memory result list after the cursor position.
+
+    Returns the page and the cursor for the next one (None on the last page).
+    """
+    start = 0
+    if cursor:
+        position = decode_cursor(cursor)
+        after = position.get("after")
+        for i, item in enumerate(items):
+            if item.id == after:
+                start = i + 1
+                break
+        else:
+            raise ValueError("Cursor no longer matches the catalog")
+    end = len(items) if limit is None else start + limit
+    page = items[start:end]
+    next_cursor = None
+    if end < len(items) and page:
+        next_cursor = encode_cursor({"after": page[-1].id})
+    return page, next_cursor
@@ -0,0 +1,297 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from images import ImageService, SingleFlight
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Cube faces in Pannellum's order: front, right, back, left, up, down
+FACES = "frblud"
+
+# Face pixels resampled per numpy pass; working memory is about 170 bytes each
+PIXELS_PER_PASS = 65536
+
+TILE = re.compile(r"(\d+)_(\d+)(?:\.\w+)?")
+
+
+def _face_vectors(face: str, a: np.ndarray, b: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """View directions (y up, front along +z) for face coordinates a (right) and b (down) in [-1, 1]"""
+    one = np.ones_like(a)
+    return {
+        "f": (a, -b, one),
+        "r": (one, -b, -a),
+        "b": (-a, -b, -one),
+        "l": (-one, -b, a),
+        "u": (a, one, b),
+        "d": (a, -one, -b),
+    }[face]
+
+
+def _sample_bilinear(panorama: np.ndarray, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    height, width = panorama.shape[:2]
+    u0 = np.floor(u).astype(np.int64)
+    v0 = np.floor(v).astype(np.int64)
+    fu = (u - u0)[..., None]
+    fv = (v - v0)[..., None]
+    # Longitude wraps around; latitude clamps at the poles
+    left, right = u0 % width, (u0 + 1) % width
+    top, bottom = np.clip(v0, 0, height - 1), np.clip(v0 + 1, 0, height - 1)
+    pixels = (
+        panorama[top, left] * (1 - fu) * (1 - fv)
+        + panorama[top, right] * fu * (1 - fv)
+        + panorama[bottom, left] * (1 - fu) * fv
+        + panorama[bottom, right] * fu * fv
+    )
+    return np.clip(pixels + 0.5, 0, 255).astype(np.uint8)
+
+
+def cube_face(panorama: np.ndarray, face: str, size: int) -> np.ndarray:
+    """Resample one size x size cube face from an equirectangular panorama.
+
+    Works on a band of about PIXELS_PER_PASS pixels at a time and reads the
+    8-bit source in place, so memory beyond the source and the face stays
+    the same whatever the panorama's size.
+    """
+    height, width = panorama.shape[:2]
+    coordinates = (np.arange(size, dtype=np.float32) + 0.5) / size * 2 - 1
+    output = np.empty((size, size, 3), dtype=np.uint8)
+    rows = max(1, PIXELS_PER_PASS // size)
+    for start in range(0, size, rows):
+        b, a = np.meshgrid(coordinates[start:start + rows], coordinates, indexing="ij")
+        x, y, z = _face_vectors(face, a, b)
+        longitude = np.arctan2(x, z)
+        latitude = np.arctan2(y, np.hypot(x, z))
+        u = (longitude / (2 * np.pi) + 0.5) * width - 0.5
+        v = (0.5 - latitude / np.pi) * height - 0.5
+        output[start:start + rows] = _sample_bilinear(panorama, u, v)
+    return output
+
+
+def pyramid_levels(cube_resolution: int, tile_resolution: int) -> int:
+    return max(1, math.ceil(math.log2(cube_resolution / tile_resolution)) + 1)
+
+
+def level_resolution(cube_resolution: int, levels: int, level: int) -> int:
+    """Face size at a 1-based level; the top level is the full cube resolution"""
+    return math.ceil(cube_resolution / 2 ** (levels - level))
+
+
+def pyramid_config(source_width: int, tile_resolution: int, extension: str) -> Dict:
+    """Pannellum multires parameters for a panorama, known before any tile exists"""
+    # Pannellum's generate.py sizing: about one cube pixel per source pixel at the equator
+    cube_resolution = max(tile_resolution, 8 * int(source_width / math.pi / 8))
+    return {
+        "cubeResolution": cube_resolution,
+        "tileResolution": tile_resolution,
+        "maxLevel": pyramid_levels(cube_resolution, tile_resolution),
+        "extension": extension,
+    }
+
+
+def _open_rgb(source: str, size: Optional[Tuple[int, int]] = None):
+    with Image.open(source) as opened:
+        if size is not None:
+            # Lets JPEG decode at a fraction of full size when that is enough
+            opened.draft("RGB", size)
+        return ImageOps.exif_transpose(opened).convert("RGB")
+
+
+def build_preview(source: str, destination: str, preview_width: int, fmt: str, quality: int):
+    """Write a small equirectangular preview of a panorama; runs in the process pool"""
+    size = (preview_width, preview_width // 2)
+    preview = _open_rgb(source, size).resize(size, Image.LANCZOS)
+    temporary = f"{destination}.{os.getpid()}.tmp"
+    preview.save(temporary, fmt.upper(), quality=quality)
+    os.replace(temporary, destination)
+
+
+def build_pyramid(source: str, destination: str, config: Dict, quality: int):
+    """Slice an equirectangular panorama into a multires cube tile pyramid; runs in the process pool.
+
+    Tiles go to ``{level}/{face}/{x}_{y}.{extension}`` under destination
+    with level 1 the smallest, as in Pannellum's multires format. The
+    directory appears, with its config.json, only once every tile is written.
+    """
+    cube_resolution, tile_resolution = config["cubeResolution"], config["tileResolution"]
+    levels, fmt = config["maxLevel"], config["extension"]
+    staging = Path(f"{destination}.{os.getpid()}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    panorama = np.asarray(_open_rgb(source))
+    for face in FACES:
+        face_image = Image.fromarray(cube_face(panorama, face, cube_resolution))
+        for level in range(levels, 0, -1):
+            size = level_resolution(cube_resolution, levels, level)
+            scaled = face_image if size == cube_resolution else face_image.resize((size, size), Image.LANCZOS)
+            directory = staging / str(level) / face
+            directory.mkdir(parents=True)
+            tiles = math.ceil(size / tile_resolution)
+            for y in range(tiles):
+                for x in range(tiles):
+                    box = (
+                        x * tile_resolution,
+                        y * tile_resolution,
+                        min(size, (x + 1) * tile_resolution),
+                        min(size, (y + 1) * tile_resolution),
+                    )
+                    scaled.crop(box).save(directory / f"{x}_{y}.{fmt}", fmt.upper(), quality=quality)
+
+    (staging / "config.json").write_text(json.dumps(config))
+    try:
+        os.replace(staging, destination)
+    except OSError:
+        # Another worker finished the same pyramid first
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+class PanoramaTiler:
+    """Cube-map tile pyramids for panoramic images, built once per source on local disk.
+
+    Sources are fetched through the ImageService, so each panorama is
+    downloaded once and pyramids are keyed by the content hash. ``prepare``
+    builds a small preview and then the pyramid in the background, normally
+    right after ingest; a viewer that arrives first gets its config and
+    preview at once, and its tile requests wait for the pyramid.
+    """
+
+    def __init__(self, images: ImageService, tile_resolution: int = 512, preview_width: int = 1024, quality: int = 80):
+        self.images = images
+        self.tile_resolution = tile_resolution
+        self.preview_width = preview_width
+        self.quality = quality
+        self.extension = "webp" if Image is not None and features.check("webp") else "jpeg"
+        self._flights = SingleFlight()
+        self._tasks = set()
+        # Content hashes whose pyramid is known to be complete on disk
+        self._built = set()
+        self.built = 0
+        self.previews = 0
+
+    def _directory(self, digest: str) -> Path:
+        return self.images.cache_dir / "panoramas" / digest[:2] / digest
+
+    def _tiles_directory(self, digest: str) -> Path:
+        return self._directory(digest) / "tiles"
+
+    async def pyramid(self, url: str) -> Optional[Tuple[str, Dict]]:
+        """(content hash, pyramid config) for a panorama URL; starts building the pyramid if needed"""
+        if not self.images.enabled:
+            return None
+        image = await self.images.ingest(url)
+        digest = self.images.digest_for(url)
+        if image is None or digest is None:
+            return None
+        config = pyramid_config(image["width"], self.tile_resolution, self.extension)
+        if not self._is_built(digest):
+            self._in_background(self._build(digest, config))
+        return digest, config
+
+    async def prepare(self, url: str):
+        """Ingest a panorama, then build its preview and its pyramid"""
+        if not self.images.enabled:
+            return
+        image = await self.images.ingest(url)
+        digest = self.images.digest_for(url)
+        if image is not None and digest is not None:
+            await self.tiles_ready(digest, pyramid_config(image["width"], self.tile_resolution, self.extension))
+
+    def _in_background(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _is_built(self, digest: str) -> bool:
+        if digest not in self._built and (self._tiles_directory(digest) / "config.json").exists():
+            self._built.add(digest)
+        return digest in self._built
+
+    async def preview_path(self, digest: str) -> Path:
+        """Path of the panorama's preview, written first thing for a new panorama"""
+        path = self._directory(digest) / f"preview.{self.extension}"
+        if path.exists():
+            return path
+
+        async def build():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            await self.images.run_in_pool(
+                build_preview, str(self.images.original_path(digest)), str(path),
+                self.preview_width, self.extension, self.quality
+            )
+            self.previews += 1
+            return path
+
+        return await self._flights.run(("preview", digest), build)
+
+    async def _build(self, digest: str, config: Dict):
+        try:
+            await self.tiles_ready(digest, config)
+        except Exception as e:
+            logger.warning("Could not build the panorama pyramid for %s: %s", digest, e)
+
+    async def tiles_ready(self, digest: str, config: Dict):
+        """Wait until the pyramid is on disk, building it (after the preview) if needed"""
+        if self._is_built(digest):
+            return
+
+        async def build():
+            await self.preview_path(digest)
+            await self.images.run_in_pool(
+                build_pyramid, str(self.images.original_path(digest)), str(self._tiles_directory(digest)),
+                config, self.quality
+            )
+            self._built.add(digest)
+            self.built += 1
+
+        await self._flights.run(("pyramid", digest), build)
+
+    def tile_path(self, digest: str, config: Dict, level: int, face: str, tile: str) -> Optional[Path]:
+        """Path of one tile named "x_y" (an extension is ignored), or None if out of range"""
+        match = TILE.fullmatch(tile)
+        if match is None or face not in FACES or not 1 <= level <= config["maxLevel"]:
+            return None
+        x, y = int(match.group(1)), int(match.group(2))
+        size = level_resolution(config["cubeResolution"], config["maxLevel"], level)
+        tiles = math.ceil(size / config["tileResolution"])
+        if x >= tiles or y >= tiles:
+            return None
+        return self._tiles_directory(digest) / str(level) / face / f"{x}_{y}.{config['extension']}"
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.images.enabled,
+            "tile_resolution": self.tile_resolution,
+            "extension": self.extension,
+            "pyramids": len(self._built),
+            "building": len(self._tasks),
+            "built": self.built,
+            "previews": self.previews,
+        }
+
+
+def create_panorama_tiler(images: ImageService) -> PanoramaTiler:
+    """Build the panorama tiler from PANORAMA_* environment variables"""
+    return PanoramaTiler(
+        images,
+        tile_resolution=int(os.environ.get('PANORAMA_TILE_SIZE', '512')),
+        preview_width=int(os.environ.get('PANORAMA_PREVIEW_WIDTH', '1024')),
+        quality=int(os.environ.get('PANORAMA_QUALITY', '80'))
+    )
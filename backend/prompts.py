@@ -0,0 +1,96 @@
+from typing import Dict, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+GUIDE_PROMPT_TEMPLATE = """You are an expert guide specializing in Sikkim monasteries, Himalayan Buddhism, and Sikkimese culture. You have deep knowledge about:
+
+- All major monasteries in Sikkim (Rumtek, Pemayangtse, Enchey, Tashiding, Do-drul Chorten, Khecheopalri)
+- Tibetan Buddhist traditions (Nyingma, Kagyu schools)
+- Sikkim's unique Buddhist culture and festivals
+- Himalayan geography and travel in Sikkim
+- Local customs, permits, and travel logistics
+- Sacred sites and pilgrimage routes
+
+{monastery_context}
+
+Guidelines:
+- Provide detailed, accurate information about Sikkim monasteries and culture
+- Include practical travel advice when relevant (permits, weather, accessibility)
+- Explain Buddhist concepts and traditions respectfully
+- Mention relevant festivals and their significance
+- Suggest related monasteries or sites when appropriate
+- Keep responses informative but conversational (2-3 paragraphs)
+- Focus specifically on Sikkim's unique Buddhist heritage
+"""
+
+
+def render_monastery_context(monastery) -> str:
+    return f"""
+Current Monastery Context:
+Name: {monastery.name}
+Location: {monastery.location}, {monastery.district}
+Altitude: {monastery.altitude}
+Tradition: {monastery.tradition}
+Founded: {monastery.founded}
+Description: {monastery.description}
+Architecture: {monastery.architecture}
+Spiritual Significance: {monastery.spiritual_significance}
+Cultural Importance: {monastery.cultural_importance}
+Highlights: {', '.join(monastery.highlights)}
+Visiting Hours: {monastery.visiting_hours}
+Festivals: {', '.join(f.name for f in monastery.festivals)}
+Travel Info: Best time - {monastery.travel_info.best_time_to_visit}
+"""
+
+
+class TokenCounter:
+    """Counts prompt tokens with tiktoken when installed, else estimates ~4 chars per token"""
+
+    def __init__(self, encoding: str = "o200k_base"):
+        self._encoding = tiktoken.get_encoding(encoding) if tiktoken else None
+        self.name = "tiktoken" if self._encoding is not None else "estimate"
+
+    def count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        return (len(text) + 3) // 4
+
+
+class PromptCache:
+    """Rendered system prompts keyed by monastery id and catalog version"""
+
+    def __init__(self, counter: Optional[TokenCounter] = None):
+        self._counter = counter or TokenCounter()
+        self._prompts: Dict[Tuple[str, int], Tuple[str, int]] = {}
+        self.renders = 0
+        self.hits = 0
+
+    def get(self, monastery, version: int) -> Tuple[str, int]:
+        """Return the system prompt and its token count for a monastery (or None)"""
+        key = (monastery.id if monastery is not None else "", version)
+        prompt = self._prompts.get(key)
+        if prompt is not None:
+            self.hits += 1
+            return prompt
+        context = render_monastery_context(monastery) if monastery is not None else ""
+        system_message = GUIDE_PROMPT_TEMPLATE.format(monastery_context=context)
+        prompt = (system_message, self._counter.count(system_message))
+        # Prompts rendered against an older catalog version can never be hit again
+        self._prompts = {k: v for k, v in self._prompts.items() if k[1] == version}
+        self._prompts[key] = prompt
+        self.renders += 1
+        return prompt
+
+    def stats(self) -> Dict[str, float]:
+        token_counts = [tokens for _, tokens in self._prompts.values()]
+        return {
+            "cached_prompts": len(self._prompts),
+            "renders": self.renders,
+            "hits": self.hits,
+            "tokenizer": self._counter.name,
+            "max_prompt_tokens": max(token_counts, default=0),
+            "mean_prompt_tokens": round(sum(token_counts) / len(token_counts), 1) if token_counts else 0,
+        }
@@ -0,0 +1,335 @@
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_DECISIONS = REGISTRY.counter(
+    "chat_rate_limit_decisions_total",
+    "Chat requests admitted or turned away, by the limit that decided",
+    ["limit", "outcome"]
+)
+QUOTA_TOKENS = REGISTRY.counter(
+    "chat_quota_tokens_total",
+    "LLM tokens charged against daily chat quotas",
+    ["scope"]
+)
+
+# Attempts at a Mongo bucket update that keeps losing races to other workers
+MAX_TAKE_ATTEMPTS = 3
+
+
+class RateLimited(Exception):
+    """Raised when a client is over its request rate or daily token quota; carries Retry-After"""
+
+    status_code = 429
+
+    def __init__(self, message: str, retry_after: int, limit: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.limit = limit
+
+
+class Limit:
+    """A token bucket holding ``burst`` requests that refills at ``per_minute``.
+
+    Backends store it in its GCRA form: one "theoretical arrival time" per
+    key, which may run at most ``window`` seconds ahead of now.
+    """
+
+    def __init__(self, per_minute: float, burst: int):
+        self.interval = 60.0 / per_minute
+        self.burst = max(1, burst)
+
+    @property
+    def window(self) -> float:
+        return self.interval * (self.burst - 1)
+
+
+def utc_day(now: float) -> str:
+    return datetime.fromtimestamp(now, timezone.utc).strftime("%Y-%m-%d")
+
+
+def seconds_until_next_day(now: float) -> int:
+    moment = datetime.fromtimestamp(now, timezone.utc)
+    midnight = (moment + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(1, math.ceil((midnight - moment).total_seconds()))
+
+
+def client_ip(request, trusted_proxies: int = 0) -> str:
+    """Client address; behind ``trusted_proxies`` proxies, the one they saw in X-Forwarded-For"""
+    if trusted_proxies:
+        forwarded = [part.strip() for part in request.headers.get("x-forwarded-for", "").split(",") if part.strip()]
+        if len(forwarded) >= trusted_proxies:
+            return forwarded[-trusted_proxies]
+    return request.client.host if request.client else "unknown"
+
+
+class MemoryRateLimitBackend:
+    """Buckets and daily token usage in this process's memory.
+
+    The least recently used keys are dropped beyond ``max_keys``; an idle
+    bucket is full again anyway, so only usage counts can be lost.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._arrivals: "OrderedDict[str, float]" = OrderedDict()
+        self._usage: "OrderedDict[str, int]" = OrderedDict()
+        self._day = ""
+
+    @staticmethod
+    def _bounded(entries: OrderedDict, key: str, max_keys: int):
+        entries.move_to_end(key)
+        if len(entries) > max_keys:
+            entries.popitem(last=False)
+
+    async def take(self, key: str, limit: Limit, now: float) -> float:
+        """Take a request from the bucket; 0 if admitted, else seconds until one is available"""
+        arrival = max(self._arrivals.get(key, now), now)
+        if arrival - now > limit.window:
+            return arrival - now - limit.window
+        self._arrivals[key] = arrival + limit.interval
+        self._bounded(self._arrivals, key, self.max_keys)
+        return 0.0
+
+    async def usage(self, key: str, day: str) -> int:
+        return self._usage.get(key, 0) if day == self._day else 0
+
+    async def add_usage(self, key: str, day: str, tokens: int):
+        if day != self._day:
+            self._day = day
+            self._usage.clear()
+        self._usage[key] = self._usage.get(key, 0) + tokens
+        self._bounded(self._usage, key, self.max_keys)
+
+    @property
+    def tracked_keys(self) -> int:
+        return len(self._arrivals)
+
+
+class MongoRateLimitBackend:
+    """Buckets and daily token usage shared by every worker through Mongo.
+
+    Taking a request is one conditional update on the key's arrival time
+    (two when the bucket is partly drained). Documents expire through TTL
+    indexes once their bucket is full again or their day is over.
+    """
+
+    name = "mongo"
+
+    def __init__(self, buckets, usage):
+        self._buckets = buckets
+        self._usage = usage
+
+    async def ensure_indexes(self):
+        await self._buckets.create_index("expires_at", name="expires_at_ttl", expireAfterSeconds=0)
+        await self._usage.create_index("expires_at", name="expires_at_ttl", expireAfterSeconds=0)
+
+    async def take(self, key: str, limit: Limit, now: float) -> float:
+        expires_at = datetime.fromtimestamp(now + limit.interval * (limit.burst + 1), timezone.utc)
+        for _ in range(MAX_TAKE_ATTEMPTS):
+            # Idle since its bucket refilled
+            result = await self._buckets.update_one(
+                {"_id": key, "arrival": {"$lt": now}},
+                {"$set": {"arrival": now + limit.interval, "expires_at": expires_at}}
+            )
+            if result.matched_count:
+                return 0.0
+            result = await self._buckets.update_one(
+                {"_id": key, "arrival": {"$gte": now, "$lte": now + limit.window}},
+                {"$inc": {"arrival": limit.interval}, "$set": {"expires_at": expires_at}}
+            )
+            if result.matched_count:
+                return 0.0
+            bucket = await self._buckets.find_one({"_id": key})
+            if bucket is None:
+                try:
+                    await self._buckets.insert_one({"_id": key, "arrival": now + limit.interval, "expires_at": expires_at})
+                    return 0.0
+                except DuplicateKeyError:
+                    continue
+            if bucket["arrival"] - now > limit.window:
+                return bucket["arrival"] - now - limit.window
+        # Still contended after several tries: the bucket is busy enough to say no
+        return limit.interval
+
+    async def usage(self, key: str, day: str) -> int:
+        document = await self._usage.find_one({"_id": f"{day}|{key}"}, {"tokens": 1})
+        return document["tokens"] if document else 0
+
+    async def add_usage(self, key: str, day: str, tokens: int):
+        expires_at = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc) + timedelta(days=2)
+        await self._usage.update_one(
+            {"_id": f"{day}|{key}"},
+            {"$inc": {"tokens": tokens}, "$setOnInsert": {"key": key, "day": day, "expires_at": expires_at}},
+            upsert=True
+        )
+
+
+class ChatRateLimiter:
+    """Admission control for chat requests by client IP and session id.
+
+    ``check`` runs before a chat request reads Mongo or calls the LLM and
+    raises RateLimited when either key is over its request rate or its
+    daily token quota; ``charge`` adds the tokens the request consumed once
+    it is answered. Every check first consults an in-memory bucket: a
+    client over its limit in this worker is over it across all workers, so
+    it is turned away without a round trip to a shared backend. Failures of
+    the shared backend admit the request rather than failing chat.
+
+    Quotas are charged with the token counts the LLM provider reports.
+    Where a backend gets none, the dispatcher's TokenCounter estimates
+    them, which without tiktoken installed is one token per four
+    characters; the dispatcher's stats show how often that happens.
+    """
+
+    def __init__(
+        self,
+        backend,
+        limits: Dict[str, Optional[Limit]],
+        quotas: Dict[str, int],
+        enabled: bool = True,
+        trusted_proxies: int = 0,
+    ):
+        self.backend = backend
+        self.limits = {scope: limit for scope, limit in limits.items() if limit is not None}
+        self.quotas = {scope: quota for scope, quota in quotas.items() if quota > 0}
+        self.enabled = enabled
+        # Proxy hops whose X-Forwarded-For entries are believed; see client_ip
+        self.trusted_proxies = trusted_proxies
+        self._local = backend if isinstance(backend, MemoryRateLimitBackend) else MemoryRateLimitBackend()
+        # Keys whose quota is known to be used up, with the day it applies to
+        self._exhausted: Dict[str, str] = {}
+        self.allowed = 0
+        self.limited: Dict[str, int] = {}
+        self.backend_errors = 0
+        self.tokens_charged = 0
+
+    @staticmethod
+    def _keys(ip: str, session_id: str) -> Dict[str, str]:
+        return {"ip": f"ip:{ip}", "session": f"session:{session_id}"}
+
+    def _reject(self, limit: str, retry_after: float, message: str):
+        self.limited[limit] = self.limited.get(limit, 0) + 1
+        RATE_LIMIT_DECISIONS.inc(limit=limit, outcome="limited")
+        raise RateLimited(message, max(1, math.ceil(retry_after)), limit)
+
+    async def start(self):
+        if self.enabled and isinstance(self.backend, MongoRateLimitBackend):
+            try:
+                await self.backend.ensure_indexes()
+            except Exception as e:
+                logger.error("Could not create rate limit indexes: %s", e)
+
+    async def check(self, ip: str, session_id: str):
+        if not self.enabled:
+            return
+        now = time.time()
+        day = utc_day(now)
+        keys = self._keys(ip, session_id)
+        for scope, key in keys.items():
+            if self._exhausted.get(key) == day:
+                self._reject(f"{scope}_quota", seconds_until_next_day(now), "Daily chat allowance used up, it resets at midnight UTC")
+        for scope, limit in self.limits.items():
+            wait = await self._local.take(keys[scope], limit, now)
+            if not wait and self.backend is not self._local:
+                try:
+                    wait = await self.backend.take(keys[scope], limit, now)
+                except Exception as e:
+                    self.backend_errors += 1
+                    logger.warning("Rate limit backend failed, admitting the request: %s", e)
+            if wait:
+                self._reject(f"{scope}_rate", wait, "Too many chat requests, please retry shortly")
+        for scope, quota in self.quotas.items():
+            try:
+                used = await self.backend.usage(keys[scope], day)
+            except Exception as e:
+                self.backend_errors += 1
+                logger.warning("Rate limit backend failed, admitting the request: %s", e)
+                continue
+            if used >= quota:
+                self._exhausted = {key: d for key, d in self._exhausted.items() if d == day}
+                self._exhausted[keys[scope]] = day
+                self._reject(f"{scope}_quota", seconds_until_next_day(now), "Daily chat allowance used up, it resets at midnight UTC")
+        self.allowed += 1
+        RATE_LIMIT_DECISIONS.inc(limit="all", outcome="allowed")
+
+    async def charge(self, ip: str, session_id: str, tokens: int):
+        """Count LLM tokens a request consumed against its keys' daily quotas"""
+        if not self.enabled or not tokens or not self.quotas:
+            return
+        day = utc_day(time.time())
+        keys = self._keys(ip, session_id)
+        self.tokens_charged += tokens
+        for scope in self.quotas:
+            QUOTA_TOKENS.inc(tokens, scope=scope)
+            try:
+                await self.backend.add_usage(keys[scope], day, tokens)
+            except Exception as e:
+                self.backend_errors += 1
+                logger.warning("Could not record chat token usage: %s", e)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend.name,
+            "limits": {
+                scope: {"per_minute": round(60 / limit.interval, 3), "burst": limit.burst}
+                for scope, limit in self.limits.items()
+            },
+            "daily_token_quotas": dict(self.quotas),
+            "trusted_proxies": self.trusted_proxies,
+            "allowed": self.allowed,
+            "limited": sum(self.limited.values()),
+            "limited_by_limit": dict(self.limited),
+            "backend_errors": self.backend_errors,
+            "tokens_charged": self.tokens_charged,
+            "tracked_keys": self._local.tracked_keys,
+        }
+
+
+def _limit_from_env(scope: str, per_minute: str, burst: str) -> Optional[Limit]:
+    rate = float(os.environ.get(f'CHAT_RATE_PER_{scope}_PER_MINUTE', per_minute))
+    return Limit(rate, int(os.environ.get(f'CHAT_BURST_PER_{scope}', burst))) if rate > 0 else None
+
+
+def create_chat_rate_limiter(db) -> ChatRateLimiter:
+    """Build the chat limiter from CHAT_RATE_* / CHAT_DAILY_TOKENS_* variables; 0 disables a limit.
+
+    Clients pick their own session ids, so the per-IP limit and quota are
+    what bound a client minting a new session per request. The IP is the
+    socket peer unless RATE_LIMIT_TRUSTED_PROXIES gives the number of
+    proxies in front of the app that append to X-Forwarded-For; set it
+    behind a proxy, or every visitor shares the proxy's address.
+    """
+    backend_name = os.environ.get('CHAT_RATE_LIMIT_BACKEND', 'memory')
+    if backend_name == "mongo":
+        backend = MongoRateLimitBackend(db.rate_limit_buckets, db.chat_token_usage)
+    elif backend_name == "memory":
+        backend = MemoryRateLimitBackend()
+    else:
+        raise ValueError(f"Unknown CHAT_RATE_LIMIT_BACKEND: {backend_name}")
+    return ChatRateLimiter(
+        backend,
+        limits={
+            "ip": _limit_from_env("IP", '30', '10'),
+            "session": _limit_from_env("SESSION", '12', '5'),
+        },
+        quotas={
+            "ip": int(os.environ.get('CHAT_DAILY_TOKENS_PER_IP', '200000')),
+            "session": int(os.environ.get('CHAT_DAILY_TOKENS_PER_SESSION', '50000')),
+        },
+        enabled=os.environ.get('CHAT_RATE_LIMIT_ENABLED', 'true').lower() == 'true',
+        trusted_proxies=int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', '0'))
+    )
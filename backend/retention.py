@@ -0,0 +1,237 @@
+import asyncio
+import gzip
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# Sessions archived per file write and delete
+ARCHIVE_BATCH_SESSIONS = 100
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name, '').strip()
+    return float(value) if value else None
+
+
+class RetentionPolicy:
+    """Retention settings; any value left unset disables that part"""
+
+    def __init__(
+        self,
+        chat_ttl_days: Optional[float] = None,
+        status_ttl_days: Optional[float] = None,
+        status_rollup_after_hours: Optional[float] = None,
+        chat_archive_dir: Optional[str] = None,
+        chat_archive_after_days: Optional[float] = None,
+        interval_seconds: float = 3600,
+    ):
+        self.chat_ttl_days = chat_ttl_days
+        self.status_ttl_days = status_ttl_days
+        self.status_rollup_after_hours = status_rollup_after_hours
+        self.chat_archive_dir = chat_archive_dir
+        self.chat_archive_after_days = chat_archive_after_days
+        self.interval_seconds = interval_seconds
+        if (
+            chat_ttl_days is not None
+            and chat_archive_dir
+            and chat_archive_after_days is not None
+            and chat_ttl_days < chat_archive_after_days
+        ):
+            # The TTL index would delete messages before they are archived
+            raise ValueError(
+                f"CHAT_TTL_DAYS ({chat_ttl_days:g}) must be at least CHAT_ARCHIVE_AFTER_DAYS "
+                f"({chat_archive_after_days:g}) when chat archival is enabled"
+            )
+
+    @classmethod
+    def from_env(cls) -> "RetentionPolicy":
+        return cls(
+            chat_ttl_days=_env_float('CHAT_TTL_DAYS'),
+            status_ttl_days=_env_float('STATUS_TTL_DAYS'),
+            status_rollup_after_hours=_env_float('STATUS_ROLLUP_AFTER_HOURS'),
+            chat_archive_dir=os.environ.get('CHAT_ARCHIVE_DIR') or None,
+            chat_archive_after_days=_env_float('CHAT_ARCHIVE_AFTER_DAYS'),
+            interval_seconds=_env_float('RETENTION_INTERVAL_SECONDS') or 3600
+        )
+
+
+async def ensure_ttl_index(collection, field: str, days: Optional[float]):
+    """Create, retune or drop the TTL index on ``field`` to match ``days``"""
+    name = f"{field}_ttl"
+    existing = (await collection.index_information()).get(name)
+    if days is None:
+        if existing:
+            await collection.drop_index(name)
+        return
+    seconds = int(days * 86400)
+    if existing is None:
+        await collection.create_index([(field, ASCENDING)], name=name, expireAfterSeconds=seconds)
+    elif existing.get("expireAfterSeconds") != seconds:
+        await collection.database.command(
+            "collMod", collection.name, index={"name": name, "expireAfterSeconds": seconds}
+        )
+
+
+async def rollup_status_checks(db, cutoff: datetime) -> int:
+    """Fold status checks older than cutoff into per-client, per-hour counters.
+
+    Safe to rerun after a failure at any step: rows are first claimed with a
+    run id, each bucket records the runs it has counted, and claimed rows are
+    deleted only once counted, so no row is counted twice or lost.
+    """
+    run = uuid.uuid4().hex
+    await db.status_checks.update_many(
+        {"timestamp": {"$lt": cutoff}, "rollup_run": {"$exists": False}}, {"$set": {"rollup_run": run}}
+    )
+    # Rows claimed by an earlier run that failed part way are picked up too
+    groups = await db.status_checks.aggregate([
+        {"$match": {"rollup_run": {"$exists": True}}},
+        {"$group": {
+            "_id": {
+                "run": "$rollup_run",
+                "client_name": "$client_name",
+                "hour": {"$dateFromParts": {
+                    "year": {"$year": "$timestamp"},
+                    "month": {"$month": "$timestamp"},
+                    "day": {"$dayOfMonth": "$timestamp"},
+                    "hour": {"$hour": "$timestamp"}
+                }}
+            },
+            "count": {"$sum": 1}
+        }},
+    ]).to_list(length=None)
+    if not groups:
+        return 0
+    buckets = [{"client_name": group["_id"]["client_name"], "hour": group["_id"]["hour"]} for group in groups]
+    await db.status_check_rollups.bulk_write([
+        UpdateOne(bucket, {"$setOnInsert": {"count": 0, "runs": []}}, upsert=True) for bucket in buckets
+    ], ordered=False)
+    await db.status_check_rollups.bulk_write([
+        UpdateOne(
+            {**bucket, "runs": {"$ne": group["_id"]["run"]}},
+            {"$inc": {"count": group["count"]}, "$push": {"runs": group["_id"]["run"]}}
+        )
+        for bucket, group in zip(buckets, groups)
+    ], ordered=False)
+    runs = sorted({group["_id"]["run"] for group in groups})
+    result = await db.status_checks.delete_many({"rollup_run": {"$in": runs}})
+    await db.status_check_rollups.update_many({"runs": {"$in": runs}}, {"$pull": {"runs": {"$in": runs}}})
+    return result.deleted_count
+
+
+def _append_gzip(path: Path, lines: List[bytes]):
+    with gzip.open(path, "ab") as archive:
+        archive.writelines(lines)
+        archive.flush()
+        os.fsync(archive.fileno())
+
+
+async def archive_chat_sessions(db, cutoff: datetime, directory: str) -> int:
+    """Move sessions idle since before cutoff into a gzip NDJSON file, then delete them"""
+    # Sorted like the session_timestamp_id index, so the group reads one
+    # index entry per session (a DISTINCT_SCAN) instead of every message
+    idle = await db.chat_messages.aggregate([
+        {"$sort": {"session_id": 1, "timestamp": -1}},
+        {"$group": {"_id": "$session_id", "last": {"$first": "$timestamp"}}},
+        {"$match": {"last": {"$lt": cutoff}}},
+    ]).to_list(length=None)
+    session_ids = [session["_id"] for session in idle]
+    if not session_ids:
+        return 0
+
+    archive_dir = Path(directory)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    path = archive_dir / f"chat-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}.ndjson.gz"
+    for start in range(0, len(session_ids), ARCHIVE_BATCH_SESSIONS):
+        batch = session_ids[start:start + ARCHIVE_BATCH_SESSIONS]
+        messages = await db.chat_messages.find(
+            {"session_id": {"$in": batch}}
+        ).sort([("session_id", 1), ("timestamp", 1)]).to_list(length=None)
+        copied = [message.pop("_id") for message in messages]
+        await asyncio.to_thread(_append_gzip, path, [dumps(message) + b"\n" for message in messages])
+        # Only delete what is safely on disk: a session that became active
+        # again since the aggregation keeps its new messages and its memory
+        await db.chat_messages.delete_many({"_id": {"$in": copied}})
+        await db.chat_memory.delete_many({"session_id": {"$in": batch}, "updated_at": {"$lt": cutoff}})
+    logger.info("Archived %d idle chat sessions to %s", len(session_ids), path)
+    return len(session_ids)
+
+
+class RetentionWorker:
+    """Applies a RetentionPolicy: TTL indexes once, rollups and archival periodically.
+
+    With a ``lease`` (see coordination.MongoLease), periodic runs happen only
+    in the process holding it, so several workers do not archive the same
+    sessions at once.
+    """
+
+    def __init__(self, db, policy: RetentionPolicy, lease=None):
+        self._db = db
+        self.policy = policy
+        self.lease = lease
+        self._task: Optional[asyncio.Task] = None
+        self.last_run: Dict = {}
+
+    async def ensure_indexes(self):
+        try:
+            await ensure_ttl_index(self._db.chat_messages, "timestamp", self.policy.chat_ttl_days)
+            await ensure_ttl_index(self._db.status_checks, "timestamp", self.policy.status_ttl_days)
+        except OperationFailure as e:
+            logger.error("Could not apply TTL indexes: %s", e)
+
+    @property
+    def periodic(self) -> bool:
+        return self.policy.status_rollup_after_hours is not None or (
+            bool(self.policy.chat_archive_dir) and self.policy.chat_archive_after_days is not None
+        )
+
+    async def run_once(self) -> Dict:
+        now = datetime.now(timezone.utc)
+        summary = {"ran_at": now}
+        if self.policy.status_rollup_after_hours is not None:
+            cutoff = now - timedelta(hours=self.policy.status_rollup_after_hours)
+            summary["status_checks_rolled_up"] = await rollup_status_checks(self._db, cutoff)
+        if self.policy.chat_archive_dir and self.policy.chat_archive_after_days is not None:
+            cutoff = now - timedelta(days=self.policy.chat_archive_after_days)
+            summary["chat_sessions_archived"] = await archive_chat_sessions(
+                self._db, cutoff, self.policy.chat_archive_dir
+            )
+        self.last_run = summary
+        return summary
+
+    async def _run(self):
+        while True:
+            try:
+                if self.lease is None or await self.lease.acquire():
+                    await self.run_once()
+            except Exception as e:
+                logger.error("Retention run failed: %s", e)
+            await asyncio.sleep(self.policy.interval_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            if self.lease is not None:
+                try:
+                    await self.lease.release()
+                except Exception as e:
+                    logger.warning("Could not release the retention lease: %s", e)
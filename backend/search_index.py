@@ -0,0 +1,178 @@
+import math
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Relative weight of a term occurrence in each searchable field
+FIELD_WEIGHTS = {
+    "name": 5.0,
+    "location": 3.0,
+    "tradition": 2.0,
+    "highlights": 2.0,
+    "festivals": 1.5,
+    "description": 1.0,
+}
+
+# Score multiplier for a query token matching only as a prefix of a term
+PREFIX_MATCH_WEIGHT = 0.6
+
+# Tokens this short match many terms; their scores are cached, up to PREFIX_CACHE_SIZE of them
+PREFIX_CACHE_MAX_LENGTH = 3
+PREFIX_CACHE_SIZE = 128
+
+
+def fold(text: str) -> str:
+    """Casefold and strip diacritics so 'Pemayangtsé' matches 'pemayangtse'"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(fold(text))
+
+
+def monastery_fields(monastery) -> Dict[str, str]:
+    return {
+        "name": monastery.name,
+        "location": monastery.location,
+        "tradition": monastery.tradition,
+        "highlights": " ".join(monastery.highlights),
+        "festivals": " ".join(f"{f.name} {f.description}" for f in monastery.festivals),
+        "description": monastery.description,
+    }
+
+
+class SearchIndex:
+    """Inverted index over the monastery catalog with prefix matching.
+
+    Every query token must match a term exactly or as a prefix; documents
+    are ranked by the sum of field-weighted tf-idf scores over all tokens.
+    Postings keep raw field weights and idf is applied at query time, so
+    ``add`` only indexes the new item. Scoring runs on numpy arrays, and the
+    scores and rankings of short, broad prefixes are cached until the next
+    ``add``.
+    """
+
+    def __init__(self, items: Sequence):
+        self._items: List = []
+        self._weights: Dict[str, Dict[int, float]] = defaultdict(dict)
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._prefix_scores: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._prefix_rankings: "OrderedDict[Tuple[str, ...], np.ndarray]" = OrderedDict()
+        for item in items:
+            self._index(item)
+        self._terms = sorted(self._weights)
+
+    @classmethod
+    def from_postings(cls, items: Sequence, postings: Dict[str, List[Tuple[int, float]]]) -> "SearchIndex":
+        """Rebuild from postings() output without tokenizing the items again"""
+        index = cls([])
+        index._items = list(items)
+        for term, documents in postings.items():
+            index._weights[term] = {position: weight for position, weight in documents}
+        index._terms = sorted(index._weights)
+        return index
+
+    def postings(self) -> Dict[str, List[Tuple[int, float]]]:
+        """Field-weighted (item position, weight) pairs per term, in a JSON-friendly shape"""
+        return {term: list(documents.items()) for term, documents in self._weights.items()}
+
+    def _index(self, item) -> List[str]:
+        position = len(self._items)
+        self._items.append(item)
+        terms = []
+        for field, text in monastery_fields(item).items():
+            weight = FIELD_WEIGHTS[field]
+            for term in tokenize(text):
+                documents = self._weights[term]
+                if not documents:
+                    terms.append(term)
+                documents[position] = documents.get(position, 0.0) + weight
+                self._arrays.pop(term, None)
+        return terms
+
+    def add(self, item):
+        """Index one more item; its position is the current length"""
+        for term in self._index(item):
+            insort(self._terms, term)
+        # Scores depend on the item count through idf
+        self._prefix_scores.clear()
+        self._prefix_rankings.clear()
+
+    def _expand(self, token: str) -> List[str]:
+        start = bisect_left(self._terms, token)
+        matches = []
+        for term in self._terms[start:]:
+            if not term.startswith(token):
+                break
+            matches.append(term)
+        return matches
+
+    def _postings_array(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            documents = self._weights[term]
+            arrays = (
+                np.fromiter(documents.keys(), dtype=np.int64, count=len(documents)),
+                np.fromiter(documents.values(), dtype=float, count=len(documents)),
+            )
+            self._arrays[term] = arrays
+        return arrays
+
+    def _token_scores(self, token: str) -> np.ndarray:
+        """Best score per item over every term the token matches"""
+        cacheable = len(token) <= PREFIX_CACHE_MAX_LENGTH
+        if cacheable and token in self._prefix_scores:
+            self._prefix_scores.move_to_end(token)
+            return self._prefix_scores[token]
+        total = max(len(self._items), 1)
+        scores = np.zeros(len(self._items))
+        for term in self._expand(token):
+            positions, weights = self._postings_array(term)
+            factor = 1.0 if term == token else PREFIX_MATCH_WEIGHT
+            values = weights * (factor * math.log(1 + total / len(positions)))
+            scores[positions] = np.maximum(scores[positions], values)
+        if cacheable:
+            self._prefix_scores[token] = scores
+            while len(self._prefix_scores) > PREFIX_CACHE_SIZE:
+                self._prefix_scores.popitem(last=False)
+        return scores
+
+    def _rank(self, tokens: List[str]) -> np.ndarray:
+        scores = None
+        for token in tokens:
+            token_scores = self._token_scores(token)
+            if scores is None:
+                scores = token_scores.copy()
+            else:
+                scores = np.where((scores > 0) & (token_scores > 0), scores + token_scores, 0.0)
+        matched = np.flatnonzero(scores)
+        # Stable, so equal scores keep catalog order
+        return matched[np.argsort(-scores[matched], kind="stable")]
+
+    def search(self, query: str) -> List:
+        tokens = tokenize(query)
+        if not tokens:
+            return list(self._items)
+        key = tuple(tokens)
+        if all(len(token) <= PREFIX_CACHE_MAX_LENGTH for token in tokens):
+            ranked = self._prefix_rankings.get(key)
+            if ranked is None:
+                ranked = self._rank(tokens)
+                self._prefix_rankings[key] = ranked
+                while len(self._prefix_rankings) > PREFIX_CACHE_SIZE:
+                    self._prefix_rankings.popitem(last=False)
+            else:
+                self._prefix_rankings.move_to_end(key)
+        else:
+            ranked = self._rank(tokens)
+        # A plain gather: numpy object arrays probe items for __array__, which
+        # would build the models of lazily decoded snapshot records
+        items = self._items
+        return [items[position] for position in ranked.tolist()]
@@ -0,0 +1,115 @@
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        # Match pydantic's JSON output, which writes UTC offsets as Z
+        return value.isoformat().replace("+00:00", "Z")
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value) -> bytes:
+    """Encode to JSON bytes with orjson when installed, else the stdlib encoder"""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_UTC_Z)
+    return json.dumps(value, default=_default, separators=(",", ":")).encode()
+
+
+def loads(data):
+    """Decode JSON from bytes or a memoryview"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(bytes(data))
+
+
+def join_array(parts: Iterable[Union[bytes, memoryview]]) -> bytes:
+    return b"[" + b",".join(parts) + b"]"
+
+
+class ResponseBodyCache:
+    """Ready-to-send JSON bodies for catalog reads.
+
+    Each monastery is encoded once per field selection and each listing
+    (filter, page and projection) once, both keyed on the catalog version
+    so a write drops every body built from older data. Both are bounded LRUs,
+    since callers choose the field selection. ``extras`` may return
+    derived fields to add to each payload; whatever they depend on must be
+    part of the version. A monastery with an ``encoded`` attribute (a record
+    of a mapped snapshot) that needs no projection or extras is served as a
+    view of that record rather than a copy.
+    """
+
+    def __init__(
+        self,
+        max_listings: int = 256,
+        extras: Optional[Callable[[Dict], Dict]] = None,
+        max_items: int = 4096,
+    ):
+        self.max_listings = max_listings
+        self.max_items = max_items
+        self.extras = extras
+        self._version: Optional[Hashable] = None
+        self._items: "OrderedDict[Hashable, Union[bytes, memoryview]]" = OrderedDict()
+        self._listings: "OrderedDict[Hashable, Tuple[bytes, Optional[str]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _sync(self, version: Hashable):
+        if version != self._version:
+            self._version = version
+            self._items.clear()
+            self._listings.clear()
+
+    def item(self, version: Hashable, monastery, fields: Optional[Set[str]] = None) -> Union[bytes, memoryview]:
+        self._sync(version)
+        key = (monastery.id, frozenset(fields) if fields else None)
+        body = self._items.get(key)
+        if body is None:
+            payload = monastery.dict(include=fields) if fields else monastery.dict()
+            extras = self.extras(payload) if self.extras is not None else None
+            encoded = getattr(monastery, "encoded", None)
+            if encoded is not None and not fields and not extras:
+                body = encoded
+            else:
+                body = dumps({**payload, **extras} if extras else payload)
+            self._items[key] = body
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        else:
+            self._items.move_to_end(key)
+        return body
+
+    def get_listing(self, version: Hashable, key: Hashable) -> Optional[Tuple[bytes, Optional[str]]]:
+        self._sync(version)
+        listing = self._listings.get(key)
+        if listing is not None:
+            self.hits += 1
+            self._listings.move_to_end(key)
+        else:
+            self.misses += 1
+        return listing
+
+    def put_listing(
+        self,
+        version: Hashable,
+        key: Hashable,
+        monasteries: List,
+        fields: Optional[Set[str]],
+        next_cursor: Optional[str],
+    ) -> bytes:
+        self._sync(version)
+        body = join_array(self.item(version, monastery, fields) for monastery in monasteries)
+        self._listings[key] = (body, next_cursor)
+        while len(self._listings) > self.max_listings:
+            self._listings.popitem(last=False)
+        return body
@@ -1,24 +1,73 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from contextlib import asynccontextmanager
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Union
 import uuid
 from datetime import datetime, timezone
-from emergentintegrations.llm.chat import LlmChat, UserMessage
 import asyncio
+import hashlib
+import json
+import time
+from catalog import MonasteryCatalog
+from indexes import ensure_indexes, check_query_plans
+from llm import LlmOverloaded, LlmUsage, create_llm_backend, create_llm_dispatcher
+from chat_cache import ChatResponseCache
+from prompts import PromptCache, TokenCounter
+from memory import ConversationMemory
+from http_cache import CacheRule, ConditionalGetMiddleware
+from pagination import decode_cursor, encode_cursor, page_after, parse_fields
+from serialization import ResponseBodyCache
+from geo import plan_route
+from bulk import bulk_upsert_monasteries, export_ndjson, iter_ndjson_lines
+from write_buffer import WriteBehindBuffer
+from retention import RetentionPolicy, RetentionWorker
+from coordination import MongoLease, create_invalidation_bus
+from rate_limit import RateLimited, client_ip, create_chat_rate_limiter
+from metrics import (
+    CONTENT_TYPE, REGISTRY, MetricsMiddleware, MongoCommandMetrics, cache_samples, stats_samples
+)
+from tracing import tracer
+from database import Database, pool_samples
+from images import IMMUTABLE, MEDIA_TYPES, create_image_service
+from panorama import create_panorama_tiler
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+database = Database(mongo_url, os.environ['DB_NAME'], event_listeners=[MongoCommandMetrics()])
+client = database.client
+db = database.db
+
+# Batched, off-request-path inserts for chat messages and status checks
+write_buffer = WriteBehindBuffer(
+    database.write_db,
+    batch_size=int(os.environ.get('WRITE_BUFFER_BATCH_SIZE', '100')),
+    flush_interval=float(os.environ.get('WRITE_BUFFER_FLUSH_SECONDS', '0.5')),
+    max_pending=int(os.environ.get('WRITE_BUFFER_MAX_PENDING', '10000')),
+    max_retries=int(os.environ.get('WRITE_BUFFER_MAX_RETRIES', '3'))
+)
+
+# TTL, rollup and archival of chat messages and status checks; with several
+# workers, only the one holding the lease runs the periodic jobs
+retention_policy = RetentionPolicy.from_env()
+retention = RetentionWorker(
+    database.write_db,
+    retention_policy,
+    lease=MongoLease(database.write_db.leases, "retention", ttl_seconds=max(600, 2 * retention_policy.interval_seconds))
+)
+
+# Tells the other workers to drop their per-process caches after a write
+invalidation = create_invalidation_bus(database.write_db.cache_invalidations, os.environ['DB_NAME'])
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -27,7 +76,20 @@ app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 # AI Chat Configuration
-EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY')
+token_counter = TokenCounter()
+llm = create_llm_dispatcher(create_llm_backend(), token_counter)
+prompt_cache = PromptCache(token_counter)
+
+# Cache of guide replies for repeated questions
+CHAT_CACHE_ENABLED = os.environ.get('CHAT_CACHE_ENABLED', 'true').lower() == 'true'
+chat_cache = ChatResponseCache(
+    max_entries=int(os.environ.get('CHAT_CACHE_MAX_ENTRIES', '1000')),
+    ttl=float(os.environ.get('CHAT_CACHE_TTL_SECONDS', '3600')),
+    similarity_threshold=float(os.environ.get('CHAT_CACHE_SIMILARITY', '0.8')) or None
+)
+
+# Per client IP and session request rates and daily LLM token quotas for chat
+chat_limiter = create_chat_rate_limiter(database.write_db)
 
 # Define Models
 class StatusCheck(BaseModel):
@@ -76,6 +138,13 @@ class SikkimMonastery(BaseModel):
     travel_info: TravelInfo
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class MonasterySummary(BaseModel):
+    id: str
+    name: str
+    district: str
+    tradition: str
+    main_image: str
+
 class MonasteryCreate(BaseModel):
     name: str
     location: str
@@ -98,6 +167,15 @@ class MonasteryCreate(BaseModel):
     festivals: List[Festival]
     travel_info: TravelInfo
 
+class GeoPoint(BaseModel):
+    lat: float = Field(..., ge=-90, le=90)
+    lng: float = Field(..., ge=-180, le=180)
+
+class ItineraryRequest(BaseModel):
+    monastery_ids: List[str] = Field(..., min_length=1, max_length=500)
+    start: Optional[GeoPoint] = None
+    return_to_start: bool = False
+
 class ChatMessage(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     session_id: str
@@ -110,6 +188,83 @@ class ChatRequest(BaseModel):
     message: str
     session_id: str
     monastery_id: Optional[str] = None
+    bypass_cache: bool = False
+
+# Per-session rolling window and summary of past chat turns
+conversation_memory = ConversationMemory(
+    database.write_db.chat_memory,
+    window_turns=int(os.environ.get('CHAT_MEMORY_TURNS', '6')),
+    turn_tokens=int(os.environ.get('CHAT_MEMORY_TURN_TOKENS', '200')),
+    summary_tokens=int(os.environ.get('CHAT_MEMORY_SUMMARY_TOKENS', '300'))
+)
+
+# Named field sets accepted by the fields= parameter
+MONASTERY_FIELD_PRESETS = {"summary": list(MonasterySummary.__fields__)}
+
+# Resized WebP/AVIF derivatives of the catalog's images
+images = create_image_service(ROOT_DIR / 'image_cache')
+IMAGE_PREFETCH = os.environ.get('IMAGE_PREFETCH', 'true').lower() == 'true'
+IMAGE_FIELDS = ("main_image", "gallery_images", "panoramic_images")
+
+# Cube-map tile pyramids of the panoramic images, built after ingest or on first view
+panoramas = create_panorama_tiler(images)
+PANORAMA_CACHE_CONTROL = "public, max-age=86400"
+
+def image_variant_fields(payload: dict) -> dict:
+    """srcset metadata for every image URL in a monastery payload that is ready"""
+    urls = []
+    for field in IMAGE_FIELDS:
+        if field in payload:
+            value = payload[field]
+            urls.extend(value if isinstance(value, list) else [value])
+    variants = {url: images.variants(url) for url in dict.fromkeys(urls)}
+    ready = {url: variant for url, variant in variants.items() if variant}
+    # Records with nothing ingested yet keep their stored shape
+    return {"images": ready} if ready else {}
+
+# Pre-encoded JSON bodies for catalog reads
+response_bodies = ResponseBodyCache(extras=image_variant_fields)
+
+# In-memory monastery catalog, reloaded whenever its version is bumped and
+# started from a snapshot file when one exists (empty CATALOG_SNAPSHOT disables it)
+CATALOG_SNAPSHOT = os.environ.get('CATALOG_SNAPSHOT', str(ROOT_DIR / 'catalog.snapshot'))
+catalog = MonasteryCatalog(
+    database.catalog_db.sikkim_monasteries,
+    SikkimMonastery,
+    facets_source=os.environ.get('FACETS_SOURCE', 'python'),
+    primary_collection=db.sikkim_monasteries,
+    snapshot_path=CATALOG_SNAPSHOT or None
+)
+
+invalidation.subscribe("catalog", lambda payload: catalog.invalidate(read_primary=True))
+invalidation.subscribe("images", lambda payload: images.reload_index())
+
+def body_version():
+    """Cached bodies depend on the catalog and on which images have variants"""
+    return (catalog.version, images.version)
+
+image_prefetch_tasks = set()
+
+async def ingest_images(urls, panoramic_urls=()):
+    version = images.version
+    await images.ingest_many(urls)
+    if images.version != version:
+        await invalidation.publish("images")
+    # One at a time: building a pyramid holds the whole panorama in memory
+    for url in dict.fromkeys(panoramic_urls):
+        await panoramas.prepare(url)
+
+def prefetch_images(monasteries):
+    """Ingest the images of these monasteries in the background"""
+    if not IMAGE_PREFETCH or not images.enabled:
+        return
+    # dict() rather than attributes, so snapshot records are not built into models
+    fields = [m.dict(include=set(IMAGE_FIELDS)) for m in monasteries]
+    urls = [url for f in fields for url in [f["main_image"], *f["gallery_images"], *f["panoramic_images"]]]
+    panoramic_urls = [url for f in fields for url in f["panoramic_images"]]
+    task = asyncio.create_task(ingest_images(urls, panoramic_urls))
+    image_prefetch_tasks.add(task)
+    task.add_done_callback(image_prefetch_tasks.discard)
 
 # Sikkim Monastery Data
 sikkim_monasteries_data = [
@@ -409,6 +564,43 @@ sikkim_monasteries_data = [
     }
 ]
 
+# Static travel guide, serialised once and served with a precomputed ETag
+TRAVEL_GUIDE = {
+    "permits": {
+        "inner_line_permit": "Required for non-Indians visiting most areas",
+        "how_to_get": "Online application or at checkpoints",
+        "duration": "15-30 days",
+        "documents": "Valid ID proof, passport photos"
+    },
+    "best_time": {
+        "peak_season": "March to June, September to December",
+        "monsoon": "July-August (avoid due to landslides)",
+        "winter": "December-February (cold but clear views)",
+        "festival_time": "February-March for major festivals"
+    },
+    "getting_there": {
+        "nearest_airport": "Bagdogra Airport (West Bengal)",
+        "nearest_railway": "New Jalpaiguri (NJP)",
+        "road_access": "NH10 from West Bengal",
+        "local_transport": "Shared jeeps, private taxis, government buses"
+    },
+    "accommodation": {
+        "types": ["Luxury hotels", "Budget hotels", "Guest houses", "Homestays"],
+        "booking_tips": "Book in advance during peak season",
+        "monastery_stays": "Some monasteries offer basic accommodation"
+    },
+    "important_tips": [
+        "Carry warm clothes even in summer",
+        "Respect photography restrictions in monasteries",
+        "Remove shoes before entering prayer halls",
+        "Don't point feet towards Buddha statues",
+        "Carry cash as ATMs are limited in remote areas",
+        "Stay hydrated at high altitudes"
+    ]
+}
+TRAVEL_GUIDE_BODY = json.dumps(TRAVEL_GUIDE).encode()
+TRAVEL_GUIDE_TOKEN = hashlib.blake2b(TRAVEL_GUIDE_BODY).hexdigest()
+
 @api_router.get("/")
 async def root():
     return {"message": "Welcome to Sikkim Monasteries - Virtual Heritage Tours"}
@@ -417,135 +609,323 @@ async def root():
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
+    await write_buffer.put("status_checks", status_obj.dict())
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
+async def get_status_checks(limit: int = Query(100, ge=1, le=1000)):
+    """Get the most recent status checks"""
+    status_checks = await db.status_checks.find({}, {"_id": 0}).sort("timestamp", -1).to_list(limit)
     return [StatusCheck(**status_check) for status_check in status_checks]
 
+@api_router.get("/status/rollups")
+async def get_status_rollups(
+    client_name: Optional[str] = None,
+    limit: int = Query(168, ge=1, le=5000)
+):
+    """Get hourly status check counts for checks older than the rollup window"""
+    query = {"client_name": client_name} if client_name else {}
+    rollups = await db.status_check_rollups.find(query, {"_id": 0, "runs": 0}).sort("hour", -1).to_list(limit)
+    return {"rollups": rollups}
+
+# Seeding state, set once the bundled monastery data is known to be in Mongo
+seed_state = {"seeded": False, "inserted": 0}
+seed_lock = asyncio.Lock()
+SEED_ID_NAMESPACE = uuid.UUID("5f0c2d8e-3b7a-4c1e-9a6d-2e8f4b1c7a90")
+
+def seed_id(name: str) -> str:
+    """Stable id for a bundled monastery, the same in every worker"""
+    return str(uuid.uuid5(SEED_ID_NAMESPACE, name))
+
+async def seed_sikkim_monasteries():
+    """Upsert the bundled monastery data keyed on name; safe to run repeatedly"""
+    async with seed_lock:
+        if seed_state["seeded"]:
+            return
+        operations = [
+            UpdateOne(
+                {"name": data["name"]},
+                {"$setOnInsert": SikkimMonastery(**{**data, "id": seed_id(data["name"])}).dict()},
+                upsert=True
+            )
+            for data in sikkim_monasteries_data
+        ]
+        try:
+            inserted = (await db.sikkim_monasteries.bulk_write(operations, ordered=False)).upserted_count
+        except BulkWriteError as e:
+            # Workers seeding at once insert the same ids, and id_unique lets
+            # only one of them win; every other error is real
+            if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            inserted = e.details.get("nUpserted", 0)
+        if inserted:
+            catalog.invalidate(read_primary=True)
+            await invalidation.publish("catalog")
+        seed_state["inserted"] = inserted
+        seed_state["seeded"] = True
+        logger.info("Seeded %d new Sikkim monasteries", inserted)
+
 @api_router.post("/monasteries/initialize")
 async def initialize_sikkim_monasteries():
     """Initialize the database with Sikkim monastery data"""
+    if seed_state["seeded"]:
+        return {"message": "Sikkim monasteries already initialized"}
     try:
-        # Check if monasteries already exist
-        existing_count = await db.sikkim_monasteries.count_documents({})
-        if existing_count > 0:
-            return {"message": f"Database already contains {existing_count} Sikkim monasteries"}
-        
-        # Insert monastery data
-        monasteries = []
-        for data in sikkim_monasteries_data:
-            monastery = SikkimMonastery(**data)
-            monasteries.append(monastery.dict())
-        
-        result = await db.sikkim_monasteries.insert_many(monasteries)
-        return {"message": f"Successfully initialized {len(result.inserted_ids)} Sikkim monasteries"}
+        await seed_sikkim_monasteries()
+        return {"message": f"Successfully initialized {seed_state['inserted']} Sikkim monasteries"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.get("/monasteries", response_model=List[SikkimMonastery])
+@api_router.get(
+    "/monasteries",
+    response_model=None,
+    responses={200: {"model": Union[List[SikkimMonastery], List[MonasterySummary]]}}
+)
 async def get_sikkim_monasteries(
     district: Optional[str] = Query(None, description="Filter by district"),
     tradition: Optional[str] = Query(None, description="Filter by tradition"),
-    search: Optional[str] = Query(None, description="Search in name or description")
+    search: Optional[str] = Query(None, description="Full-text search, ranked by relevance"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size; omit for all results"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, or 'summary'")
 ):
-    """Get all Sikkim monasteries with optional filtering"""
-    query = {}
+    """Get all Sikkim monasteries with optional filtering, paging and field projection"""
+    key = (district, tradition, search, limit, cursor, fields)
+    listing = response_bodies.get_listing(body_version(), key) if catalog.loaded else None
+    if listing is None:
+        try:
+            selected = parse_fields(fields, SikkimMonastery.__fields__, MONASTERY_FIELD_PRESETS)
+            monasteries = await catalog.filter(district=district, tradition=tradition, search=search)
+            page, next_cursor = page_after(monasteries, cursor, limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        body = response_bodies.put_listing(body_version(), key, page, selected, next_cursor)
+        listing = (body, next_cursor)
     
-    if district:
-        query["district"] = {"$regex": district, "$options": "i"}
-    if tradition:
-        query["tradition"] = {"$regex": tradition, "$options": "i"}
-    if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}},
-            {"location": {"$regex": search, "$options": "i"}}
+    body, next_cursor = listing
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@api_router.get("/monasteries/export")
+async def export_monasteries():
+    """Stream the whole monastery collection as NDJSON"""
+    return StreamingResponse(export_ndjson(db.sikkim_monasteries), media_type="application/x-ndjson")
+
+@api_router.get("/monasteries/nearby")
+async def get_nearby_monasteries(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(50, gt=0, le=20000),
+    k: int = Query(10, ge=1, le=100)
+):
+    """Get the monasteries closest to a point, nearest first"""
+    geo_index = await catalog.geo()
+    summary_fields = set(MonasterySummary.__fields__)
+    return {
+        "results": [
+            {
+                **monastery.dict(include=summary_fields),
+                "coordinates": monastery.coordinates,
+                "distance_km": round(distance, 3)
+            }
+            for monastery, distance in geo_index.nearby(lat, lng, radius_km, k)
         ]
-    
-    monasteries = await db.sikkim_monasteries.find(query).to_list(length=None)
-    return [SikkimMonastery(**monastery) for monastery in monasteries]
+    }
 
 @api_router.get("/monasteries/{monastery_id}", response_model=SikkimMonastery)
 async def get_monastery(monastery_id: str):
     """Get a specific Sikkim monastery by ID"""
-    monastery = await db.sikkim_monasteries.find_one({"id": monastery_id})
+    monastery = await catalog.get(monastery_id)
     if not monastery:
         raise HTTPException(status_code=404, detail="Monastery not found")
-    return SikkimMonastery(**monastery)
+    return Response(content=bytes(response_bodies.item(body_version(), monastery)), media_type="application/json")
 
 @api_router.post("/monasteries", response_model=SikkimMonastery)
 async def create_monastery(monastery: MonasteryCreate):
     """Create a new Sikkim monastery"""
     new_monastery = SikkimMonastery(**monastery.dict())
     await db.sikkim_monasteries.insert_one(new_monastery.dict())
+    catalog.add(new_monastery)
+    await invalidation.publish("catalog")
+    prefetch_images([new_monastery])
     return new_monastery
 
+async def build_system_message(monastery_id: Optional[str]):
+    """Get the guide's cached system prompt, with monastery context when available"""
+    monastery = await catalog.get(monastery_id) if monastery_id else None
+    system_message, prompt_tokens = prompt_cache.get(monastery, catalog.version)
+    logger.debug("System prompt for %s: %d tokens", monastery_id or "general chat", prompt_tokens)
+    return system_message, monastery is not None
+
+@api_router.post("/monasteries/bulk")
+async def bulk_import_monasteries(request: Request):
+    """Upsert monasteries by name from an NDJSON body of MonasteryCreate records"""
+    report = await bulk_upsert_monasteries(
+        db.sikkim_monasteries,
+        iter_ndjson_lines(request.stream()),
+        MonasteryCreate,
+        batch_size=int(os.environ.get('BULK_IMPORT_BATCH_SIZE', '500'))
+    )
+    if report.upserted or report.modified:
+        catalog.invalidate(read_primary=True)
+        await invalidation.publish("catalog")
+        prefetch_images(await catalog.all())
+    return report.as_dict()
+
+@api_router.get("/images/stats")
+async def get_image_stats():
+    """Get source, original and derivative counts of the image cache"""
+    return images.stats()
+
+@api_router.get("/images/{image_hash}/{width}")
+async def get_image(
+    image_hash: str,
+    width: int,
+    request: Request,
+    format: Optional[str] = Query(None, description="avif, webp or jpeg; negotiated from Accept when omitted")
+):
+    """Serve a resized, re-encoded derivative of an ingested image"""
+    try:
+        fmt = images.negotiate(request.headers.get("accept", ""), format)
+        path = await images.derivative(image_hash, width, fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(
+        path,
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Cache-Control": IMMUTABLE, "Vary": "Accept"}
+    )
+
+async def get_panorama_pyramid(monastery_id: str, image: int):
+    """The monastery's image-th panorama as (monastery, content hash, pyramid config)"""
+    monastery = await catalog.get(monastery_id)
+    if not monastery:
+        raise HTTPException(status_code=404, detail="Monastery not found")
+    if not 0 <= image < len(monastery.panoramic_images):
+        raise HTTPException(status_code=404, detail="Panorama not found")
+    pyramid = await panoramas.pyramid(monastery.panoramic_images[image])
+    if pyramid is None:
+        raise HTTPException(status_code=404, detail="Panorama not available")
+    return (monastery, *pyramid)
+
+@api_router.get("/monasteries/{monastery_id}/panorama")
+async def get_panorama_config(monastery_id: str, image: int = Query(0, ge=0)):
+    """Get a Pannellum multires config for one of the monastery's panoramas"""
+    monastery, digest, config = await get_panorama_pyramid(monastery_id, image)
+    base_path = f"/api/monasteries/{monastery.id}/panorama"
+    query = f"?image={image}" if image else ""
+    return {
+        "type": "multires",
+        "hash": digest,
+        "preview": f"{base_path}/preview{query}",
+        "multiRes": {
+            "basePath": base_path,
+            "path": "/%l/%s/%x_%y",
+            "extension": config["extension"] + query,
+            "tileResolution": config["tileResolution"],
+            "maxLevel": config["maxLevel"],
+            "cubeResolution": config["cubeResolution"],
+        },
+    }
+
+@api_router.get("/monasteries/{monastery_id}/panorama/preview")
+async def get_panorama_preview(monastery_id: str, image: int = Query(0, ge=0)):
+    """Serve a small equirectangular preview of a panorama"""
+    _, digest, config = await get_panorama_pyramid(monastery_id, image)
+    return FileResponse(
+        await panoramas.preview_path(digest),
+        media_type=MEDIA_TYPES[config["extension"]],
+        headers={"Cache-Control": PANORAMA_CACHE_CONTROL}
+    )
+
+@api_router.get("/monasteries/{monastery_id}/panorama/{level}/{face}/{tile}")
+async def get_panorama_tile(monastery_id: str, level: int, face: str, tile: str, image: int = Query(0, ge=0)):
+    """Serve one cube-face tile ("x_y") of a panorama's tile pyramid"""
+    _, digest, config = await get_panorama_pyramid(monastery_id, image)
+    path = panoramas.tile_path(digest, config, level, face, tile)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    try:
+        await panoramas.tiles_ready(digest, config)
+    except Exception as e:
+        logger.error("Panorama tiles for %s failed: %s", digest, e)
+        raise HTTPException(status_code=503, detail="Panorama tiles are not available")
+    return FileResponse(
+        path,
+        media_type=MEDIA_TYPES[config["extension"]],
+        headers={"Cache-Control": PANORAMA_CACHE_CONTROL}
+    )
+
+@api_router.get("/panoramas/stats")
+async def get_panorama_stats():
+    """Get pyramid counts of the panorama tiler"""
+    return panoramas.stats()
+
+@api_router.post("/itinerary")
+async def plan_itinerary(request: ItineraryRequest):
+    """Order a set of monasteries into a short visiting route"""
+    if request.return_to_start and request.start is None:
+        raise HTTPException(status_code=400, detail="return_to_start requires a start point")
+    monasteries = []
+    for monastery_id in dict.fromkeys(request.monastery_ids):
+        monastery = await catalog.get(monastery_id)
+        if not monastery:
+            raise HTTPException(status_code=404, detail=f"Monastery not found: {monastery_id}")
+        if "lat" not in monastery.coordinates or "lng" not in monastery.coordinates:
+            raise HTTPException(status_code=400, detail=f"Monastery has no coordinates: {monastery_id}")
+        monasteries.append(monastery)
+    
+    points = [(m.coordinates["lat"], m.coordinates["lng"]) for m in monasteries]
+    start = (request.start.lat, request.start.lng) if request.start else None
+    order, legs = plan_route(points, start, request.return_to_start)
+    
+    # Without a start point the first stop has no incoming leg
+    if start is None:
+        legs = [0.0] + legs
+    summary_fields = set(MonasterySummary.__fields__)
+    stops = [
+        {
+            **monasteries[index].dict(include=summary_fields),
+            "coordinates": monasteries[index].coordinates,
+            "leg_km": round(legs[position], 3)
+        }
+        for position, index in enumerate(order)
+    ]
+    return {
+        "stops": stops,
+        "return_leg_km": round(legs[-1], 3) if request.return_to_start else None,
+        "total_km": round(sum(legs), 3)
+    }
+
 @api_router.post("/chat")
-async def chat_with_sikkim_guide(request: ChatRequest):
+async def chat_with_sikkim_guide(request: ChatRequest, http_request: Request):
     """Chat with AI guide about Sikkim monasteries and culture"""
+    ip = client_ip(http_request, chat_limiter.trusted_proxies)
+    await chat_limiter.check(ip, request.session_id)
     try:
-        if not EMERGENT_LLM_KEY:
+        if not llm.configured:
             raise HTTPException(status_code=500, detail="AI service not configured")
         
-        # Get monastery context if monastery_id is provided
-        monastery_context = ""
-        if request.monastery_id:
-            monastery = await db.sikkim_monasteries.find_one({"id": request.monastery_id})
-            if monastery:
-                monastery_context = f"""
-Current Monastery Context:
-Name: {monastery['name']}
-Location: {monastery['location']}, {monastery['district']}
-Altitude: {monastery['altitude']}
-Tradition: {monastery['tradition']}
-Founded: {monastery['founded']}
-Description: {monastery['description']}
-Architecture: {monastery['architecture']}
-Spiritual Significance: {monastery['spiritual_significance']}
-Cultural Importance: {monastery['cultural_importance']}
-Highlights: {', '.join(monastery['highlights'])}
-Visiting Hours: {monastery['visiting_hours']}
-Festivals: {', '.join([f["name"] for f in monastery['festivals']])}
-Travel Info: Best time - {monastery['travel_info']['best_time_to_visit']}
-"""
+        with tracer.span("chat.context"):
+            system_message, has_context = await build_system_message(request.monastery_id)
+            memory_block = conversation_memory.render(await conversation_memory.load(request.session_id))
         
-        # Create system message with Sikkim expertise
-        system_message = f"""You are an expert guide specializing in Sikkim monasteries, Himalayan Buddhism, and Sikkimese culture. You have deep knowledge about:
-
-- All major monasteries in Sikkim (Rumtek, Pemayangtse, Enchey, Tashiding, Do-drul Chorten, Khecheopalri)
-- Tibetan Buddhist traditions (Nyingma, Kagyu schools)
-- Sikkim's unique Buddhist culture and festivals
-- Himalayan geography and travel in Sikkim
-- Local customs, permits, and travel logistics
-- Sacred sites and pilgrimage routes
-
-{monastery_context}
-
-Guidelines:
-- Provide detailed, accurate information about Sikkim monasteries and culture
-- Include practical travel advice when relevant (permits, weather, accessibility)
-- Explain Buddhist concepts and traditions respectfully
-- Mention relevant festivals and their significance
-- Suggest related monasteries or sites when appropriate
-- Keep responses informative but conversational (2-3 paragraphs)
-- Focus specifically on Sikkim's unique Buddhist heritage
-"""
-        
-        # Initialize AI chat
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=request.session_id,
-            system_message=system_message
-        ).with_model("openai", "gpt-4o-mini")
-        
-        # Create user message
-        user_message = UserMessage(text=request.message)
+        # Answer repeated questions from the cache; follow-ups depend on the conversation
+        use_cache = CHAT_CACHE_ENABLED and not request.bypass_cache and not memory_block
+        ai_response = None
+        if use_cache:
+            ai_response = chat_cache.get(request.message, request.monastery_id, catalog.version)
+        cached = ai_response is not None
         
         # Get AI response
-        ai_response = await chat.send_message(user_message)
+        if not cached:
+            usage = LlmUsage()
+            ai_response = await llm.complete(request.session_id, system_message + memory_block, request.message, usage)
+            await chat_limiter.charge(ip, request.session_id, usage.total)
+            if use_cache:
+                chat_cache.put(request.message, request.monastery_id, ai_response, catalog.version)
         
         # Save chat message to database
         chat_message = ChatMessage(
@@ -554,109 +934,268 @@ Guidelines:
             ai_response=ai_response,
             monastery_context=request.monastery_id
         )
-        await db.chat_messages.insert_one(chat_message.dict())
+        with tracer.span("chat.persist"):
+            await write_buffer.put("chat_messages", chat_message.dict())
+            await conversation_memory.record(request.session_id, request.message, ai_response)
         
         return {
             "response": ai_response,
             "session_id": request.session_id,
-            "monastery_context": bool(monastery_context)
+            "monastery_context": has_context,
+            "cached": cached
         }
         
+    except (HTTPException, LlmOverloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
 
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@api_router.post("/chat/stream")
+async def stream_chat_with_sikkim_guide(request: ChatRequest, http_request: Request):
+    """Chat with AI guide, streaming the reply as Server-Sent Events"""
+    ip = client_ip(http_request, chat_limiter.trusted_proxies)
+    await chat_limiter.check(ip, request.session_id)
+    if not llm.configured:
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    
+    with tracer.span("chat.context"):
+        system_message, has_context = await build_system_message(request.monastery_id)
+        memory_block = conversation_memory.render(await conversation_memory.load(request.session_id))
+    use_cache = CHAT_CACHE_ENABLED and not request.bypass_cache and not memory_block
+    cached_response = None
+    if use_cache:
+        cached_response = chat_cache.get(request.message, request.monastery_id, catalog.version)
+    
+    async def cached_tokens():
+        yield cached_response
+    
+    # Reserve an LLM slot before the response starts so overload is a plain 503
+    usage = LlmUsage()
+    if cached_response is not None:
+        tokens = cached_tokens()
+    else:
+        tokens = await llm.open_stream(request.session_id, system_message + memory_block, request.message, usage)
+    
+    async def events():
+        started = time.perf_counter()
+        time_to_first_token = None
+        chunks = []
+        try:
+            async for token in tokens:
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - started
+                chunks.append(token)
+                yield sse_event("token", {"text": token})
+        except Exception as e:
+            logger.error("Streaming chat failed: %s", e)
+            yield sse_event("error", {"detail": f"AI service error: {str(e)}"})
+            return
+        finally:
+            await tokens.aclose()
+            # Charge whatever was generated, including replies cut short
+            await chat_limiter.charge(ip, request.session_id, usage.total)
+        
+        # Save chat message to database once the reply is complete
+        ai_response = "".join(chunks)
+        if use_cache and cached_response is None:
+            chat_cache.put(request.message, request.monastery_id, ai_response, catalog.version)
+        chat_message = ChatMessage(
+            session_id=request.session_id,
+            user_message=request.message,
+            ai_response=ai_response,
+            monastery_context=request.monastery_id
+        )
+        await write_buffer.put("chat_messages", chat_message.dict())
+        await conversation_memory.record(request.session_id, request.message, ai_response)
+        
+        ttft_ms = round(time_to_first_token * 1000, 1) if time_to_first_token is not None else None
+        logger.info("Chat stream for session %s: time to first token %s ms", request.session_id, ttft_ms)
+        yield sse_event("done", {
+            "session_id": request.session_id,
+            "monastery_context": has_context,
+            "cached": cached_response is not None,
+            "time_to_first_token_ms": ttft_ms,
+            "total_ms": round((time.perf_counter() - started) * 1000, 1)
+        })
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def collect_component_metrics():
+    chat = chat_cache.stats()
+    yield from cache_samples({
+        "chat_response": (chat["exact_hits"] + chat["similar_hits"], chat["misses"]),
+        "system_prompt": (prompt_cache.hits, prompt_cache.renders),
+        "response_body": (response_bodies.hits, response_bodies.misses),
+    })
+    yield from stats_samples("llm_dispatcher", "LLM dispatcher", llm.stats())
+    yield from stats_samples("write_buffer", "Write-behind buffer", write_buffer.stats())
+    yield from stats_samples("cache_invalidation", "Cache invalidation bus", invalidation.stats())
+    yield from stats_samples("chat_rate_limit", "Chat rate limiter", chat_limiter.stats())
+    yield "catalog_version", "Catalog reloads and writes since start", [({}, catalog.version)]
+    yield from pool_samples(database)
+
+REGISTRY.collector(collect_component_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@api_router.get("/db/stats")
+async def get_database_stats():
+    """Get connection pool utilisation and the catalog read preference"""
+    return database.stats()
+
+@api_router.get("/llm/stats")
+async def get_llm_stats():
+    """Get queue depth, wait times and outcome counters of the LLM dispatcher"""
+    return llm.stats()
+
+@api_router.get("/chat/cache/stats")
+async def get_chat_cache_stats():
+    """Get hit/miss counters for the chat response cache"""
+    return {"enabled": CHAT_CACHE_ENABLED, **chat_cache.stats()}
+
+@api_router.get("/chat/prompts/stats")
+async def get_prompt_stats():
+    """Get render counts and token sizes of the cached system prompts"""
+    return prompt_cache.stats()
+
+@api_router.get("/chat/limits/stats")
+async def get_chat_limit_stats():
+    """Get the chat rate limits and quotas with admitted and rejected counters"""
+    return chat_limiter.stats()
+
+@api_router.get("/chat/memory/{session_id}")
+async def get_chat_memory(session_id: str):
+    """Get the rolling conversation memory and token usage for a session"""
+    memory = await conversation_memory.load(session_id)
+    return conversation_memory.usage(memory)
+
+# Fields a chat history page may be projected to
+CHAT_MESSAGE_FIELDS = list(ChatMessage.__fields__)
+
 @api_router.get("/chat/history/{session_id}")
-async def get_chat_history(session_id: str, limit: int = 20):
-    """Get chat history for a session"""
-    messages = await db.chat_messages.find(
-        {"session_id": session_id}
-    ).sort("timestamp", -1).limit(limit).to_list(length=None)
+async def get_chat_history(
+    session_id: str,
+    limit: int = Query(20, ge=1, le=200),
+    before: Optional[str] = Query(None, description="next_before value from the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated message fields to return")
+):
+    """Get chat history for a session, newest page first"""
+    try:
+        selected = parse_fields(fields, CHAT_MESSAGE_FIELDS, {})
+        query = {"session_id": session_id}
+        if before:
+            position = decode_cursor(before)
+            timestamp = datetime.fromisoformat(position["timestamp"])
+            query["$or"] = [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "id": {"$lt": position["id"]}}
+            ]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid before cursor")
+    
+    # Project in Mongo, always keeping the keys the cursor is built from
+    projection = {"_id": 0}
+    if selected is not None:
+        projection.update({field: 1 for field in selected | {"timestamp"}})
+    messages = await db.chat_messages.find(query, projection).sort(
+        [("timestamp", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(length=None)
     
+    next_before = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        oldest = messages[-1]
+        next_before = encode_cursor({"timestamp": oldest["timestamp"].isoformat(), "id": oldest["id"]})
+    
+    if selected is None:
+        items = [ChatMessage(**msg) for msg in reversed(messages)]
+    else:
+        items = [{k: v for k, v in msg.items() if k in selected} for msg in reversed(messages)]
     return {
-        "messages": [ChatMessage(**msg) for msg in reversed(messages)],
-        "session_id": session_id
+        "messages": items,
+        "session_id": session_id,
+        "next_before": next_before
     }
 
 @api_router.get("/districts")
 async def get_districts():
     """Get list of districts with monasteries"""
-    districts = await db.sikkim_monasteries.distinct("district")
-    return {"districts": sorted(districts)}
+    return (await catalog.facets()).payload("districts")
 
 @api_router.get("/traditions")
 async def get_traditions():
     """Get list of Buddhist traditions"""
-    traditions = await db.sikkim_monasteries.distinct("tradition")
-    return {"traditions": sorted(traditions)}
+    return (await catalog.facets()).payload("traditions")
 
 @api_router.get("/festivals")
 async def get_all_festivals():
     """Get all festivals celebrated across Sikkim monasteries"""
-    monasteries = await db.sikkim_monasteries.find().to_list(length=None)
-    all_festivals = []
-    
-    for monastery in monasteries:
-        for festival in monastery.get('festivals', []):
-            festival_info = {
-                "name": festival['name'],
-                "date": festival['date'],
-                "description": festival['description'],
-                "significance": festival['significance'],
-                "monastery": monastery['name'],
-                "location": monastery['location']
-            }
-            all_festivals.append(festival_info)
-    
-    return {"festivals": all_festivals}
+    return (await catalog.facets()).payload("festivals")
 
 @api_router.get("/travel-guide")
 async def get_sikkim_travel_guide():
     """Get comprehensive travel guide for visiting Sikkim monasteries"""
-    return {
-        "permits": {
-            "inner_line_permit": "Required for non-Indians visiting most areas",
-            "how_to_get": "Online application or at checkpoints",
-            "duration": "15-30 days",
-            "documents": "Valid ID proof, passport photos"
-        },
-        "best_time": {
-            "peak_season": "March to June, September to December",
-            "monsoon": "July-August (avoid due to landslides)",
-            "winter": "December-February (cold but clear views)",
-            "festival_time": "February-March for major festivals"
-        },
-        "getting_there": {
-            "nearest_airport": "Bagdogra Airport (West Bengal)",
-            "nearest_railway": "New Jalpaiguri (NJP)",
-            "road_access": "NH10 from West Bengal",
-            "local_transport": "Shared jeeps, private taxis, government buses"
-        },
-        "accommodation": {
-            "types": ["Luxury hotels", "Budget hotels", "Guest houses", "Homestays"],
-            "booking_tips": "Book in advance during peak season",
-            "monastery_stays": "Some monasteries offer basic accommodation"
-        },
-        "important_tips": [
-            "Carry warm clothes even in summer",
-            "Respect photography restrictions in monasteries",
-            "Remove shoes before entering prayer halls",
-            "Don't point feet towards Buddha statues",
-            "Carry cash as ATMs are limited in remote areas",
-            "Stay hydrated at high altitudes"
-        ]
-    }
+    return Response(content=TRAVEL_GUIDE_BODY, media_type="application/json")
 
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.exception_handler(LlmOverloaded)
+async def llm_overloaded_handler(request, exc: LlmOverloaded):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request, exc: RateLimited):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc), "limit": exc.limit},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+# ETags and Cache-Control for read-only catalog and guide endpoints
+CATALOG_MAX_AGE = int(os.environ.get('HTTP_CACHE_MAX_AGE', '60'))
+app.add_middleware(
+    ConditionalGetMiddleware,
+    rules=[
+        CacheRule(
+            r"/api/(monasteries(/(?!export$)[^/]+)?|districts|traditions|festivals)",
+            lambda: f"{catalog.fingerprint}.{images.fingerprint}" if catalog.loaded else None,
+            f"public, max-age={CATALOG_MAX_AGE}, must-revalidate"
+        ),
+        CacheRule(
+            r"/api/travel-guide",
+            lambda: TRAVEL_GUIDE_TOKEN,
+            "public, max-age=86400"
+        ),
+    ]
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Outermost, so latency covers every other middleware including 304s
+app.add_middleware(MetricsMiddleware, routes=app.routes)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -664,6 +1203,62 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def prepare_database(verify_catalog: bool = False):
+    try:
+        await ensure_indexes(db)
+        await seed_sikkim_monasteries()
+        if verify_catalog:
+            await catalog.verify()
+        await check_query_plans(db)
+    except Exception as e:
+        logger.error("Preparing the database failed: %s", e)
+
+async def start_images():
+    images.start()
+    try:
+        prefetch_images(await catalog.all())
+    except Exception as e:
+        logger.error("Could not queue image prefetch: %s", e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop this worker's background work.
+
+    Importing this module only builds objects; sockets, threads, tasks and
+    process pools are opened here, once per worker, so a preloading master
+    (gunicorn --preload) can import the app and fork workers safely.
+    """
+    tracer.configure(os.environ.get('TRACE_FILE'))
+    preparing = None
+    try:
+        await invalidation.start()
+        if catalog.load_snapshot():
+            # Serve from the snapshot right away; seed and check it against Mongo meanwhile
+            preparing = asyncio.create_task(prepare_database(verify_catalog=True))
+        else:
+            await prepare_database()
+        write_buffer.start()
+        await retention.ensure_indexes()
+        await chat_limiter.start()
+        if retention.periodic:
+            retention.start()
+        await start_images()
+        if os.environ.get('CATALOG_CHANGE_STREAM', 'false').lower() == 'true':
+            catalog.start_watching()
+        yield
+    finally:
+        if preparing is not None:
+            preparing.cancel()
+        await catalog.stop_watching()
+        await retention.stop()
+        await write_buffer.close()
+        for task in list(image_prefetch_tasks):
+            task.cancel()
+        await panoramas.close()
+        await images.close()
+        await invalidation.stop()
+        tracer.shutdown()
+        database.close()
+
+# Set here rather than in FastAPI(...), since it uses everything defined above
+app.router.lifespan_context = lifespan
@@ -0,0 +1,211 @@
+"""Versioned, memory-mapped snapshot of the monastery catalog.
+
+A snapshot holds the catalog documents with the facets and search postings
+built from them, so a worker can start serving without a Mongo round trip or
+re-indexing. The file stays mapped read-only while the catalog serves from
+it, so workers on one node share its pages in the OS page cache; only the
+small key table is decoded per worker, and records are decoded on access.
+
+Layout, little-endian:
+    8 bytes   magic b"MONSNAP\\0"
+    uint32    format version
+    uint32    header length, including padding to 8 bytes
+    header    JSON: fingerprint, built_at, count and {section: [offset, length]}
+    sections  offsets  - uint64 (offset, length) per record within "records"
+              records  - one JSON document per monastery, back to back
+              keys     - JSON, [id, district, tradition, coordinates] per record
+              facets   - JSON, the shape of an aggregate_facets result
+              search   - JSON, SearchIndex postings (raw field weights)
+
+Build one from the database configured in .env, from the backend directory:
+    python snapshot.py                    # writes CATALOG_SNAPSHOT
+    python snapshot.py --output path.snap
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from serialization import dumps, loads
+
+MAGIC = b"MONSNAP\x00"
+FORMAT_VERSION = 3
+_PREAMBLE = struct.Struct("<8sII")
+SECTIONS = ("offsets", "records", "keys", "facets", "search")
+
+# Fields of each record decoded up front, enough to filter, page and locate it
+KEY_FIELDS = ("id", "district", "tradition", "coordinates")
+
+
+class SnapshotError(Exception):
+    """The file is missing, truncated or written by an incompatible version"""
+
+
+def write_snapshot(
+    path: Path,
+    documents: Sequence[Dict],
+    fingerprint: str,
+    facets: Dict,
+    postings: Dict[str, List[Tuple[int, float]]],
+) -> int:
+    """Write a snapshot atomically; returns its size in bytes"""
+    path = Path(path)
+    records = [dumps(document) for document in documents]
+    offsets = array("Q")
+    position = 0
+    for record in records:
+        offsets.extend((position, len(record)))
+        position += len(record)
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    data = {
+        "offsets": offsets.tobytes(),
+        "records": b"".join(records),
+        "keys": dumps([[document.get(field) for field in KEY_FIELDS] for document in documents]),
+        "facets": dumps(facets),
+        "search": dumps(postings),
+    }
+    layout = {}
+    position = 0
+    for name in SECTIONS:
+        layout[name] = [position, len(data[name])]
+        position += len(data[name])
+    header = dumps({
+        "fingerprint": fingerprint,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "count": len(records),
+        "sections": layout,
+    })
+    # Keep the offsets section 8-byte aligned; JSON allows trailing spaces
+    header += b" " * (-(_PREAMBLE.size + len(header)) % 8)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temporary, "wb") as output:
+        output.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        output.write(header)
+        for name in SECTIONS:
+            output.write(data[name])
+    # Workers that still map the old file keep reading it until they close it
+    os.replace(temporary, path)
+    return _PREAMBLE.size + len(header) + position
+
+
+class CatalogSnapshot:
+    """Read-only mmap of a snapshot file; records are decoded on access"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        try:
+            with open(self.path, "rb") as source:
+                self._mmap = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise SnapshotError(f"Cannot map {self.path}: {e}") from e
+        try:
+            self._view = memoryview(self._mmap)
+            if len(self._view) < _PREAMBLE.size:
+                raise SnapshotError(f"{self.path} is truncated")
+            magic, version, header_length = _PREAMBLE.unpack_from(self._view)
+            if magic != MAGIC:
+                raise SnapshotError(f"{self.path} is not a catalog snapshot")
+            if version != FORMAT_VERSION:
+                raise SnapshotError(f"{self.path} has format {version}, expected {FORMAT_VERSION}")
+            header = loads(self._view[_PREAMBLE.size:_PREAMBLE.size + header_length])
+            self._base = _PREAMBLE.size + header_length
+            self._layout = header["sections"]
+            if self._base + sum(length for _, length in self._layout.values()) > len(self._view):
+                raise SnapshotError(f"{self.path} is truncated")
+            self.fingerprint: str = header["fingerprint"]
+            self.built_at: str = header["built_at"]
+            self.count: int = header["count"]
+            offsets = self._section("offsets").cast("Q")
+            if sys.byteorder != "little":
+                swapped = array("Q", offsets)
+                offsets.release()
+                swapped.byteswap()
+                offsets = memoryview(swapped)
+            self._offsets = offsets
+            self._records = self._section("records")
+        except BaseException:
+            self.close()
+            raise
+
+    def _section(self, name: str) -> memoryview:
+        offset, length = self._layout[name]
+        return self._view[self._base + offset:self._base + offset + length]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def record(self, position: int) -> memoryview:
+        """Encoded JSON of one document, without copying it out of the mapping"""
+        offset, length = self._offsets[2 * position], self._offsets[2 * position + 1]
+        return self._records[offset:offset + length]
+
+    def documents(self) -> Iterator[Dict]:
+        for position in range(self.count):
+            yield loads(self.record(position))
+
+    def keys(self) -> List[List]:
+        """KEY_FIELDS values of every record, in record order"""
+        return loads(self._section("keys"))
+
+    def facets(self) -> Dict:
+        return loads(self._section("facets"))
+
+    def postings(self) -> Dict[str, List[Tuple[int, float]]]:
+        return loads(self._section("search"))
+
+    def close(self):
+        for name in ("_offsets", "_records", "_view"):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        if getattr(self, "_mmap", None) is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="snapshot path (defaults to CATALOG_SNAPSHOT)")
+    args = parser.parse_args()
+
+    import asyncio
+    import server
+
+    output = Path(args.output) if args.output else server.catalog.snapshot_path
+    if output is None:
+        parser.error("set CATALOG_SNAPSHOT or pass --output")
+    # Written explicitly below rather than as a refresh after loading
+    server.catalog.snapshot_path = None
+
+    async def build() -> int:
+        try:
+            monasteries = await server.catalog.all()
+            if not monasteries:
+                print("The database has no monasteries; start the server once to seed it", file=sys.stderr)
+                return 1
+            size = server.catalog.save_snapshot(output)
+            print(f"Wrote {len(monasteries)} monasteries ({size} bytes, "
+                  f"fingerprint {server.catalog.fingerprint}) to {output}")
+            return 0
+        finally:
+            server.database.close()
+
+    sys.exit(asyncio.run(build()))
+
+
+if __name__ == "__main__":
+    main()
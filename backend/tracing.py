@@ -0,0 +1,143 @@
+import contextvars
+import logging
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+
+    def as_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class FileSpanExporter:
+    """Appends finished spans as JSON lines from a background thread"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.SimpleQueue[Optional[bytes]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        self._queue.put(dumps(span.as_dict()) + b"\n")
+
+    def _run(self):
+        with open(self.path, "ab") as output:
+            while True:
+                line = self._queue.get()
+                if line is None:
+                    break
+                lines = [line]
+                # Write whatever else is already waiting in one go
+                while True:
+                    try:
+                        line = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if line is None:
+                        self._queue.put(None)
+                        break
+                    lines.append(line)
+                output.writelines(lines)
+                output.flush()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+class Tracer:
+    """Minimal in-process tracer.
+
+    Spans nest through a context variable, so stages awaited inside a request
+    share its trace id. Finished spans go to the end hooks (metrics) and, when
+    an exporter is configured, to the trace file.
+    """
+
+    def __init__(self):
+        self.exporter: Optional[FileSpanExporter] = None
+        self._on_end: List[Callable[[Span], None]] = []
+
+    def on_end(self, hook: Callable[[Span], None]):
+        self._on_end.append(hook)
+
+    def configure(self, path: Optional[str]):
+        self.shutdown()
+        if path:
+            self.exporter = FileSpanExporter(path)
+            logger.info("Exporting trace spans to %s", path)
+
+    def shutdown(self):
+        if self.exporter is not None:
+            self.exporter.close()
+            self.exporter = None
+
+    def _start(self, name: str, attributes: Dict) -> Span:
+        parent = _current_span.get()
+        trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        return Span(name, trace_id, parent.span_id if parent else None, attributes)
+
+    def _end(self, span: Span):
+        for hook in self._on_end:
+            hook(span)
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time the enclosed block as a child of the current span"""
+        span = self._start(name, attributes)
+        token = _current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            _current_span.reset(token)
+            self._end(span)
+
+    def record(self, name: str, start: float, duration: float, **attributes):
+        """Export a span measured elsewhere, such as by a driver event listener.
+
+        End hooks are skipped: the caller records its own metrics.
+        """
+        span = self._start(name, attributes)
+        span.start = start
+        span.duration = duration
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+
+tracer = Tracer()
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import random
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.errors import AutoReconnect, BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (AutoReconnect, asyncio.TimeoutError, ConnectionError)):
+        return True
+    return isinstance(error, PyMongoError) and error.has_error_label("RetryableWriteError")
+
+
+def _is_duplicate_id(error: Dict) -> bool:
+    if error.get("code") != 11000:
+        return False
+    key_pattern = error.get("keyPattern")
+    if key_pattern is not None:
+        return list(key_pattern) == ["_id"]
+    return "_id_" in error.get("errmsg", "")
+
+
+class WriteBehindBuffer:
+    """Batches inserts off the request path.
+
+    Documents are queued per collection and written with ``insert_many``
+    once ``batch_size`` are waiting or ``flush_interval`` seconds have passed,
+    which bounds how long an acknowledged write may sit only in memory. When
+    ``max_pending`` documents are queued, ``put`` waits for room instead of
+    growing without limit. ``close()`` drains everything that is left.
+
+    A batch that fails on a transient error (a lost connection, a primary
+    stepping down) is retried up to ``max_retries`` times with full-jitter
+    backoff. ``insert_many`` has given every document an ``_id`` by then,
+    so a retry cannot store one twice: duplicate ``_id`` errors on a retry
+    are documents the earlier attempt already wrote. Only the documents the
+    server reports as rejected count as failed.
+    """
+
+    def __init__(
+        self,
+        db,
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        max_pending: int = 10000,
+        max_retries: int = 3,
+        backoff_base: float = 0.1,
+        backoff_max: float = 2.0,
+    ):
+        self._db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.flushes = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, collection: str, document: Dict):
+        """Queue a document, waiting for room when the buffer is full"""
+        if self._task is None:
+            # Not started (or already closed): fall back to a direct write
+            await self._db[collection].insert_one(document)
+            return
+        await self._queue.put((collection, document))
+
+    async def _next_batch(self) -> List[Tuple[str, Dict]]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch: List[Tuple[str, Dict]]):
+        grouped: Dict[str, List[Dict]] = defaultdict(list)
+        for collection, document in batch:
+            grouped[collection].append(document)
+        for collection, documents in grouped.items():
+            await self._insert(collection, documents)
+        self.flushes += 1
+
+    async def _insert(self, collection: str, documents: List[Dict]):
+        attempt = 0
+        while True:
+            try:
+                await self._db[collection].insert_many(documents, ordered=False)
+                self.written += len(documents)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                # Duplicate _ids on a retry were stored by an earlier attempt
+                rejected = [error for error in errors if attempt == 0 or not _is_duplicate_id(error)]
+                self.written += len(documents) - len(rejected)
+                self.failed += len(rejected)
+                if rejected:
+                    logger.error(
+                        "Write-behind insert into %s rejected %d of %d documents: %s",
+                        collection, len(rejected), len(documents), rejected[0].get("errmsg"),
+                    )
+                return
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self.failed += len(documents)
+                    logger.error("Write-behind insert of %d documents into %s failed: %s", len(documents), collection, e)
+                    return
+                self.retries += 1
+                logger.warning("Write-behind insert into %s failed, retrying: %s", collection, e)
+                await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+                attempt += 1
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def close(self):
+        """Stop the flusher and write every queued document"""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "failed": self.failed,
+            "retries": self.retries,
+            "flushes": self.flushes,
+        }
@@ -1,6 +1,8 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { BrowserRouter, Routes, Route } from 'react-router-dom';
 import axios from 'axios';
+import 'pannellum/build/pannellum.js';
+import 'pannellum/build/pannellum.css';
 import './App.css';
 import { Button } from './components/ui/button';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from './components/ui/card';
@@ -14,50 +16,73 @@ import { MapPin, Calendar, Clock, DollarSign, Globe, MessageCircle, Search, Came
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
-const PanoramicViewer = ({ images, onClose }) => {
-  const [currentImageIndex, setCurrentImageIndex] = useState(0);
-  const [isDragging, setIsDragging] = useState(false);
-  const [rotation, setRotation] = useState(0);
-  const [zoom, setZoom] = useState(1);
-  const [position, setPosition] = useState({ x: 0, y: 0 });
-  const [dragStart, setDragStart] = useState({ x: 0, y: 0 });
-  const imageRef = useRef(null);
-
-  const handleMouseDown = (e) => {
-    setIsDragging(true);
-    setDragStart({
-      x: e.clientX - position.x,
-      y: e.clientY - position.y
-    });
+// Resized WebP/AVIF sources and a blurred placeholder when the API has them, else the original
+const responsiveImage = (monastery, url, sizes) => {
+  const variants = monastery.images && monastery.images[url];
+  if (!variants) return { src: url };
+  return {
+    src: url,
+    srcSet: variants.srcset.replace(/\/api\//g, `${API}/`),
+    sizes,
+    style: { backgroundImage: `url(${variants.placeholder})`, backgroundSize: 'cover' }
   };
+};
 
-  const handleMouseMove = (e) => {
-    if (!isDragging) return;
-    
-    setPosition({
-      x: e.clientX - dragStart.x,
-      y: e.clientY - dragStart.y
-    });
-    
-    // For 360 rotation effect
-    const rotationSpeed = 0.5;
-    setRotation(prev => prev + (e.movementX * rotationSpeed));
-  };
+// Spots shown on every panorama, as (pitch, yaw) in degrees
+const PANORAMA_HOTSPOTS = [
+  { pitch: 10, yaw: -60, type: 'info', text: 'Prayer Hall' },
+  { pitch: 0, yaw: 30, type: 'info', text: 'Sacred Altar' },
+  { pitch: -15, yaw: 120, type: 'info', text: 'Meditation Area' }
+];
+
+// Tiled (multires) config from the API, so only the visible tiles at the
+// current zoom are fetched; the full equirectangular image if it has none
+const panoramaConfig = async (monasteryId, url, index) => {
+  const base = { autoLoad: true, showControls: false, hotSpots: PANORAMA_HOTSPOTS };
+  try {
+    const response = await axios.get(`${API}/monasteries/${monasteryId}/panorama`, { params: { image: index } });
+    const { preview, multiRes } = response.data;
+    return {
+      ...base,
+      type: 'multires',
+      preview: `${BACKEND_URL}${preview}`,
+      multiRes: { ...multiRes, basePath: `${BACKEND_URL}${multiRes.basePath}` }
+    };
+  } catch (error) {
+    console.error('Error loading panorama tiles:', error);
+    return { ...base, type: 'equirectangular', panorama: url };
+  }
+};
 
-  const handleMouseUp = () => {
-    setIsDragging(false);
-  };
+const PanoramicViewer = ({ monasteryId, images, onClose }) => {
+  const [currentImageIndex, setCurrentImageIndex] = useState(0);
+  const containerRef = useRef(null);
+  const viewerRef = useRef(null);
+
+  useEffect(() => {
+    let cancelled = false;
+    panoramaConfig(monasteryId, images[currentImageIndex], currentImageIndex).then(config => {
+      if (cancelled || !containerRef.current) return;
+      viewerRef.current = window.pannellum.viewer(containerRef.current, config);
+    });
+    return () => {
+      cancelled = true;
+      if (viewerRef.current) {
+        viewerRef.current.destroy();
+        viewerRef.current = null;
+      }
+    };
+  }, [monasteryId, images, currentImageIndex]);
 
-  const handleWheel = (e) => {
-    e.preventDefault();
-    const zoomSpeed = 0.1;
-    setZoom(prev => Math.max(0.5, Math.min(3, prev + (e.deltaY > 0 ? -zoomSpeed : zoomSpeed))));
+  const zoomBy = (degrees) => {
+    if (viewerRef.current) viewerRef.current.setHfov(viewerRef.current.getHfov() + degrees);
   };
 
   const resetView = () => {
-    setRotation(0);
-    setZoom(1);
-    setPosition({ x: 0, y: 0 });
+    if (!viewerRef.current) return;
+    viewerRef.current.setPitch(0);
+    viewerRef.current.setYaw(0);
+    viewerRef.current.setHfov(100);
   };
 
   useEffect(() => {
@@ -105,7 +130,7 @@ const PanoramicViewer = ({ images, onClose }) => {
         
         <div className="flex items-center space-x-2">
           <Button
-            onClick={() => setZoom(zoom => Math.max(0.5, zoom - 0.2))}
+            onClick={() => zoomBy(10)}
             size="sm"
             variant="outline"
             className="text-white border-white hover:bg-white/20"
@@ -113,7 +138,7 @@ const PanoramicViewer = ({ images, onClose }) => {
             <ZoomOut className="w-4 h-4" />
           </Button>
           <Button
-            onClick={() => setZoom(zoom => Math.min(3, zoom + 0.2))}
+            onClick={() => zoomBy(-10)}
             size="sm"
             variant="outline"
             className="text-white border-white hover:bg-white/20"
@@ -135,48 +160,9 @@ const PanoramicViewer = ({ images, onClose }) => {
         </div>
       </div>
 
-      {/* Panoramic Image Container */}
-      <div 
-        className="flex-1 relative overflow-hidden cursor-move"
-        onMouseDown={handleMouseDown}
-        onMouseMove={handleMouseMove}
-        onMouseUp={handleMouseUp}
-        onMouseLeave={handleMouseUp}
-        onWheel={handleWheel}
-      >
-        <img
-          ref={imageRef}
-          src={images[currentImageIndex]}
-          alt={`Panoramic view ${currentImageIndex + 1}`}
-          className="w-full h-full object-cover transition-transform duration-100"
-          style={{
-            transform: `scale(${zoom}) rotate(${rotation}deg) translate(${position.x}px, ${position.y}px)`,
-            cursor: isDragging ? 'grabbing' : 'grab'
-          }}
-          draggable={false}
-        />
-        
-        {/* Virtual Hotspots */}
-        <div className="absolute top-1/3 left-1/4 transform -translate-x-1/2 -translate-y-1/2">
-          <div className="bg-amber-600 text-white px-3 py-2 rounded-full text-sm animate-pulse cursor-pointer hover:bg-amber-700 transition-colors">
-            <MapPin className="w-4 h-4 inline mr-1" />
-            Prayer Hall
-          </div>
-        </div>
-        
-        <div className="absolute top-1/2 right-1/3 transform translate-x-1/2 -translate-y-1/2">
-          <div className="bg-amber-600 text-white px-3 py-2 rounded-full text-sm animate-pulse cursor-pointer hover:bg-amber-700 transition-colors">
-            <Star className="w-4 h-4 inline mr-1" />
-            Sacred Altar
-          </div>
-        </div>
-
-        <div className="absolute bottom-1/3 left-1/2 transform -translate-x-1/2 translate-y-1/2">
-          <div className="bg-amber-600 text-white px-3 py-2 rounded-full text-sm animate-pulse cursor-pointer hover:bg-amber-700 transition-colors">
-            <Navigation className="w-4 h-4 inline mr-1" />
-            Meditation Area
-          </div>
-        </div>
+      {/* Panorama, rendered by Pannellum */}
+      <div className="flex-1 relative overflow-hidden">
+        <div ref={containerRef} className="absolute inset-0" />
       </div>
 
       {/* Bottom Controls */}
@@ -185,7 +171,7 @@ const PanoramicViewer = ({ images, onClose }) => {
           <div className="text-white text-sm flex items-center space-x-4">
             <span><Move className="w-4 h-4 inline mr-1" />Drag to explore</span>
             <span><ZoomIn className="w-4 h-4 inline mr-1" />Scroll to zoom</span>
-            <span><Navigation className="w-4 h-4 inline mr-1" />Click hotspots</span>
+            <span><Navigation className="w-4 h-4 inline mr-1" />Hover hotspots</span>
             <span className="text-amber-400">ESC to exit | R to reset</span>
           </div>
         </div>
@@ -211,6 +197,7 @@ const VirtualTourViewer = ({ monastery, onClose }) => {
   if (showPanorama) {
     return (
       <PanoramicViewer 
+        monasteryId={monastery.id}
         images={monastery.panoramic_images} 
         onClose={() => setShowPanorama(false)} 
       />
@@ -326,8 +313,9 @@ const MonasteryCard = ({ monastery, onStartTour, onLearnMore }) => {
     <Card className="group overflow-hidden border-0 shadow-lg hover:shadow-2xl transition-all duration-300 transform hover:-translate-y-2 bg-white/90 backdrop-blur-sm">
       <div className="relative overflow-hidden">
         <img 
-          src={monastery.main_image} 
+          {...responsiveImage(monastery, monastery.main_image, '(min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw')}
           alt={monastery.name}
+          loading="lazy"
           className="w-full h-48 object-cover group-hover:scale-110 transition-transform duration-500"
         />
         <div className="absolute inset-0 bg-gradient-to-t from-black/60 via-transparent to-transparent opacity-0 group-hover:opacity-100 transition-opacity duration-300"></div>
@@ -422,7 +410,7 @@ const MonasteryDetails = ({ monastery, onClose, onStartTour }) => {
     <div className="max-w-6xl mx-auto">
       <div className="relative mb-8">
         <img 
-          src={monastery.main_image} 
+          {...responsiveImage(monastery, monastery.main_image, '(min-width: 1152px) 1152px, 100vw')}
           alt={monastery.name}
           className="w-full h-64 object-cover rounded-2xl"
         />
@@ -660,8 +648,9 @@ const MonasteryDetails = ({ monastery, onClose, onStartTour }) => {
             {monastery.gallery_images.map((image, index) => (
               <div key={index} className="relative group overflow-hidden rounded-lg">
                 <img 
-                  src={image} 
+                  {...responsiveImage(monastery, image, '(min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw')}
                   alt={`${monastery.name} view ${index + 1}`}
+                  loading="lazy"
                   className="w-full h-48 object-cover group-hover:scale-110 transition-transform duration-300"
                 />
                 <div className="absolute inset-0 bg-black/0 group-hover:bg-black/20 transition-colors duration-300"></div>
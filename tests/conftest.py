@@ -0,0 +1,83 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Backend modules import each other by bare name, as when run from backend/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    """The app module on mongomock and the fake LLM backend, as benchmarks/load_test.py runs it"""
+    os.environ.update({
+        "MONGO_URL": "mongodb://localhost:27017",
+        "DB_NAME": "tests",
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_FIRST_TOKEN_DELAY": "0",
+        "FAKE_LLM_TOKEN_DELAY": "0",
+        # mongomock clients do not share data, so keep writes on the main client
+        "MONGO_WRITE_POOL_SIZE": "0",
+        "IMAGE_PREFETCH": "false",
+        "IMAGE_CACHE_DIR": str(tmp_path_factory.mktemp("image_cache")),
+        "CATALOG_SNAPSHOT": "",
+        "CHAT_RATE_LIMIT_ENABLED": "false",
+    })
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+
+    # Must happen before server is imported, which builds its clients at import time
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+    # A test module may already have imported database, binding the real class
+    import database
+    database.AsyncIOMotorClient = AsyncMongoMockClient
+    import server
+    return server
+
+
+@pytest.fixture(scope="session")
+def client(server):
+    from fastapi.testclient import TestClient
+
+    with TestClient(server.app) as client:
+        yield client
+
+
+@pytest.fixture
+def monastery_record():
+    """Build a complete MonasteryCreate body with a given name"""
+    def build(name: str, **fields):
+        record = {
+            "name": name,
+            "location": "Test Village",
+            "district": "North Sikkim",
+            "altitude": "2,000 m",
+            "tradition": "Nyingma",
+            "description": "A monastery created by the test suite",
+            "founded": "2024",
+            "architecture": "Tibetan",
+            "spiritual_significance": "None yet",
+            "main_image": "https://images.example.org/main.jpg",
+            "gallery_images": [],
+            "panoramic_images": [],
+            "coordinates": {"lat": 27.5, "lng": 88.5},
+            "highlights": [],
+            "visiting_hours": "6 AM - 6 PM",
+            "entrance_fee": "Free",
+            "accessibility": "Road",
+            "cultural_importance": "Test",
+            "festivals": [],
+            "travel_info": {
+                "best_time_to_visit": "Spring",
+                "nearest_airport": "Pakyong",
+                "accommodation": [],
+                "local_transport": "Taxi",
+                "permits_required": "None",
+                "weather_info": "Cool",
+            },
+        }
+        record.update(fields)
+        return record
+
+    return build
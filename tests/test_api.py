@@ -0,0 +1,8 @@
+def test_create_monastery_allows_a_name_already_in_use(client, monastery_record):
+    first = client.post("/api/monasteries", json=monastery_record("Namesake Gompa"))
+    second = client.post("/api/monasteries", json=monastery_record("Namesake Gompa"))
+    assert first.status_code == second.status_code == 200
+    assert first.json()["id"] != second.json()["id"]
+
+    names = [entry["name"] for entry in client.get("/api/monasteries", params={"search": "namesake"}).json()]
+    assert names == ["Namesake Gompa", "Namesake Gompa"]
@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+from mongomock_motor import AsyncMongoMockClient
+
+import bulk
+from bulk import bulk_upsert_monasteries, iter_ndjson_lines
+
+
+async def chunked(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def collect(lines):
+    async def run():
+        return [pair async for pair in lines]
+
+    return asyncio.run(run())
+
+
+def test_lines_are_split_across_chunk_boundaries():
+    lines = collect(iter_ndjson_lines(chunked(b'{"a"', b': 1}\n{"b": 2}\n\n{"c"', b": 3}")))
+    assert lines == [(1, b'{"a": 1}'), (2, b'{"b": 2}'), (3, b""), (4, b'{"c": 3}')]
+
+
+def test_oversized_lines_are_dropped_while_streaming(monkeypatch):
+    monkeypatch.setattr(bulk, "MAX_LINE_BYTES", 8)
+    lines = collect(iter_ndjson_lines(chunked(b"short\n", b"x" * 6, b"x" * 6, b"x\nok\n", b"y" * 20)))
+    assert lines == [(1, b"short"), (2, None), (3, b"ok"), (4, None)]
+
+
+def test_bulk_upsert_reports_per_line_errors(server, monastery_record):
+    collection = AsyncMongoMockClient().bulk_test.sikkim_monasteries
+    body = b"\n".join([
+        json.dumps(monastery_record("Bulk One")).encode(),
+        b"{not json",
+        json.dumps({"name": "Missing fields"}).encode(),
+        json.dumps(monastery_record("Bulk Two")).encode(),
+        json.dumps(monastery_record("Bulk One", altitude="2,100 m")).encode(),
+    ])
+
+    async def scenario():
+        report = await bulk_upsert_monasteries(
+            collection, iter_ndjson_lines(chunked(body)), server.MonasteryCreate, batch_size=2
+        )
+        documents = await collection.find({}, {"_id": 0}).to_list(length=None)
+        return report.as_dict(), documents
+
+    report, documents = asyncio.run(scenario())
+    assert report["received"] == 5 and report["error_count"] == 2
+    assert [error["line"] for error in report["errors"]] == [2, 3]
+    assert report["upserted"] == 2 and report["modified"] == 1
+    # Upserted by name: the later record updated the first one and kept its id
+    assert sorted(document["name"] for document in documents) == ["Bulk One", "Bulk Two"]
+    [first] = [document for document in documents if document["name"] == "Bulk One"]
+    assert first["altitude"] == "2,100 m" and first["id"]
+
+
+def test_bulk_import_endpoint_updates_the_catalog(client, monastery_record):
+    body = "\n".join(json.dumps(monastery_record(name)) for name in ("Bulk API One", "Bulk API Two"))
+    response = client.post("/api/monasteries/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.json()["upserted"] == 2
+
+    names = {entry["name"] for entry in client.get("/api/monasteries", params={"search": "bulk api"}).json()}
+    assert names == {"Bulk API One", "Bulk API Two"}
@@ -0,0 +1,66 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from catalog import MonasteryCatalog
+
+
+def test_catalog_accepts_motor_collections():
+    # Motor collections refuse truth testing; building the catalog needs no server
+    client = AsyncIOMotorClient("mongodb://localhost:27017", connect=False)
+    try:
+        collection = client.test_db.sikkim_monasteries
+        catalog = MonasteryCatalog(collection, dict)
+        assert catalog._primary_collection is collection
+
+        primary = client.get_database("test_db").sikkim_monasteries
+        catalog = MonasteryCatalog(collection, dict, primary_collection=primary)
+        assert catalog._primary_collection is primary
+    finally:
+        client.close()
+
+
+def test_fingerprint_after_add_matches_a_fresh_load(server, monastery_record):
+    async def scenario():
+        collection = AsyncMongoMockClient().fingerprint_test.sikkim_monasteries
+        await collection.insert_many([server.SikkimMonastery(**data).dict() for data in server.sikkim_monasteries_data])
+        catalog = MonasteryCatalog(collection, server.SikkimMonastery)
+        await catalog.ensure_loaded()
+
+        # As create_monastery does it; created_at loses its tzinfo and microseconds in Mongo
+        created = server.SikkimMonastery(**monastery_record("Fingerprint Gompa"))
+        await collection.insert_one(created.dict())
+        catalog.add(created)
+        assert catalog.loaded
+
+        # Another worker loads the same collection from scratch
+        other = MonasteryCatalog(collection, server.SikkimMonastery)
+        await other.ensure_loaded()
+        return catalog.fingerprint, other.fingerprint
+
+    added, loaded = asyncio.run(scenario())
+    assert added == loaded
+
+
+def test_add_to_an_unverified_snapshot_reloads(server, monastery_record, tmp_path):
+    async def scenario():
+        collection = AsyncMongoMockClient().fingerprint_snapshot_test.sikkim_monasteries
+        await collection.insert_many([server.SikkimMonastery(**data).dict() for data in server.sikkim_monasteries_data])
+        path = tmp_path / "catalog.snapshot"
+        await MonasteryCatalog(collection, server.SikkimMonastery, snapshot_path=path).ensure_loaded()
+
+        catalog = MonasteryCatalog(collection, server.SikkimMonastery, snapshot_path=path)
+        assert catalog.load_snapshot()
+        created = server.SikkimMonastery(**monastery_record("Snapshot Gompa"))
+        await collection.insert_one(created.dict())
+        catalog.add(created)
+        assert not catalog.loaded
+        await catalog.ensure_loaded()
+
+        other = MonasteryCatalog(collection, server.SikkimMonastery)
+        await other.ensure_loaded()
+        return catalog.fingerprint, other.fingerprint
+
+    reloaded, loaded = asyncio.run(scenario())
+    assert reloaded == loaded
@@ -0,0 +1,50 @@
+import chat_cache
+from chat_cache import ChatResponseCache
+
+
+def test_questions_match_after_normalisation():
+    cache = ChatResponseCache(similarity_threshold=None)
+    cache.put("What festivals happen at Rumtek?", "rumtek", "Losar and Cham dances")
+    assert cache.get("what festivals happen at rumtek", "rumtek") == "Losar and Cham dances"
+    # Context is part of the key: another monastery or catalog version misses
+    assert cache.get("What festivals happen at Rumtek?", "enchey") is None
+    assert cache.get("What festivals happen at Rumtek?", "rumtek", version=1) is None
+    assert cache.stats()["exact_hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_similar_questions_share_a_reply():
+    cache = ChatResponseCache(similarity_threshold=0.6)
+    cache.put("When is the best time to visit Rumtek monastery?", "rumtek", "October to May")
+    assert cache.get("Best time to visit Rumtek monastery", "rumtek") == "October to May"
+    assert cache.get("How do I get a permit for North Sikkim?", "rumtek") is None
+    assert cache.get("Best time to visit Rumtek monastery", "enchey") is None
+    assert (cache.similar_hits, cache.misses) == (1, 2)
+
+    exact_only = ChatResponseCache(similarity_threshold=None)
+    exact_only.put("When is the best time to visit Rumtek monastery?", "rumtek", "October to May")
+    assert exact_only.get("Best time to visit Rumtek monastery", "rumtek") is None
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(chat_cache.time, "monotonic", lambda: clock[0])
+    cache = ChatResponseCache(ttl=60, similarity_threshold=0.6)
+    cache.put("When is the best time to visit Rumtek monastery?", "rumtek", "October to May")
+    clock[0] += 59
+    assert cache.get("When is the best time to visit Rumtek monastery?", "rumtek") == "October to May"
+    clock[0] += 2
+    # Neither an exact nor a similar lookup returns a stale reply
+    assert cache.get("Best time to visit Rumtek monastery", "rumtek") is None
+    assert cache.get("When is the best time to visit Rumtek monastery?", "rumtek") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ChatResponseCache(max_entries=2, similarity_threshold=None)
+    cache.put("first question", None, "one")
+    cache.put("second question", None, "two")
+    assert cache.get("first question", None) == "one"
+    cache.put("third question", None, "three")
+    assert cache.get("second question", None) is None
+    assert cache.get("first question", None) == "one" and cache.get("third question", None) == "three"
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,65 @@
+import json
+
+from starlette.requests import Request
+
+from llm import FakeLlmBackend
+
+
+def read_events(response):
+    """Parse an SSE body into (event, data) pairs"""
+    events = []
+    for block in response.text.split("\n\n"):
+        if not block.strip():
+            continue
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_stream_sends_tokens_in_order_then_done(client):
+    message = "Which monastery should I see first?"
+    response = client.post("/api/chat/stream", json={"message": message, "session_id": "stream-order", "bypass_cache": True})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = read_events(response)
+    names = [name for name, _ in events]
+    assert names[-1] == "done" and set(names[:-1]) == {"token"} and len(names) > 2
+    text = "".join(data["text"] for name, data in events if name == "token")
+    assert text == FakeLlmBackend()._reply(message)
+
+    done = events[-1][1]
+    assert done["session_id"] == "stream-order" and done["cached"] is False
+    assert done["time_to_first_token_ms"] is not None
+
+    # The finished reply is remembered for the session
+    memory = client.get("/api/chat/memory/stream-order").json()
+    assert memory["turn_count"] == 1
+
+
+def test_stream_serves_repeated_questions_from_the_cache(client):
+    body = {"message": "Is photography allowed inside the prayer halls?"}
+    first = read_events(client.post("/api/chat/stream", json={**body, "session_id": "stream-cache-1"}))
+    second = read_events(client.post("/api/chat/stream", json={**body, "session_id": "stream-cache-2"}))
+
+    assert second[-1][1]["cached"] is True
+    assert "".join(d["text"] for n, d in second if n == "token") == "".join(d["text"] for n, d in first if n == "token")
+
+
+def test_disconnect_mid_stream_frees_the_llm_slot(server, client):
+    request = server.ChatRequest(message="Tell me about Rumtek", session_id="stream-disconnect", bypass_cache=True)
+
+    async def read_one_event_then_disconnect():
+        http_request = Request({"type": "http", "method": "POST", "headers": [], "client": ("127.0.0.1", 50000)})
+        response = await server.stream_chat_with_sikkim_guide(request, http_request)
+        assert server.llm.stats()["running"] == 1
+        first = await response.body_iterator.__anext__()
+        # What Starlette does when the client goes away: the body generator is closed
+        await response.body_iterator.aclose()
+        return first
+
+    first = client.portal.call(read_one_event_then_disconnect)
+    assert first.startswith("event: token")
+    assert server.llm.stats()["running"] == 0
+    # An interrupted reply is not recorded as a turn
+    assert client.get("/api/chat/memory/stream-disconnect").json()["turn_count"] == 0
@@ -0,0 +1,115 @@
+import asyncio
+import socket
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import coordination
+from coordination import (
+    InvalidationBus,
+    LocalInvalidationBus,
+    MongoInvalidationBus,
+    MongoLease,
+    create_invalidation_bus,
+)
+
+
+def test_bus_transport_is_chosen_by_environment(monkeypatch, tmp_path):
+    collection = AsyncMongoMockClient().bus_test.cache_invalidations
+    monkeypatch.delenv("CACHE_INVALIDATION", raising=False)
+    assert type(create_invalidation_bus(collection, "app")) is InvalidationBus
+    monkeypatch.setenv("CACHE_INVALIDATION", "local")
+    monkeypatch.setenv("CACHE_INVALIDATION_DIR", str(tmp_path))
+    local = create_invalidation_bus(collection, "app")
+    assert isinstance(local, LocalInvalidationBus) and local.directory == tmp_path
+    monkeypatch.setenv("CACHE_INVALIDATION", "mongo")
+    assert isinstance(create_invalidation_bus(collection, "app"), MongoInvalidationBus)
+    monkeypatch.setenv("CACHE_INVALIDATION", "redis")
+    with pytest.raises(ValueError):
+        create_invalidation_bus(collection, "app")
+
+
+def test_local_bus_reaches_peers_but_not_the_publisher(monkeypatch, tmp_path):
+    # Peers are told apart by pid, so give each bus its own
+    pids = iter([101, 102])
+    monkeypatch.setattr(coordination.os, "getpid", lambda: next(pids, 999))
+
+    async def scenario():
+        publisher, peer = LocalInvalidationBus(tmp_path), LocalInvalidationBus(tmp_path)
+        await publisher.start()
+        await peer.start()
+        # A worker that died without removing its socket
+        dead = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        dead.bind(str(tmp_path / "103.sock"))
+        dead.close()
+
+        own, received, reloaded = [], [], asyncio.Event()
+
+        async def reload(payload):
+            reloaded.set()
+
+        publisher.subscribe("catalog", own.append)
+        peer.subscribe("catalog", received.append)
+        peer.subscribe("catalog", reload)
+        await publisher.publish("catalog", ids=["a"])
+        await asyncio.wait_for(reloaded.wait(), 1)
+        await publisher.stop()
+        await peer.stop()
+        return own, received, publisher.stats(), peer.stats()
+
+    own, received, published, delivered = asyncio.run(scenario())
+    assert own == [] and received == [{"ids": ["a"]}]
+    assert published["published"] == 1 and delivered["received"] == 1
+    # The dead worker's socket was removed on the first refused send
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_mongo_bus_publishes_documents_and_ignores_its_own():
+    collection = AsyncMongoMockClient().mongo_bus_test.cache_invalidations
+
+    async def scenario():
+        bus = MongoInvalidationBus(collection)
+        await bus.start()
+        received = []
+        bus.subscribe("catalog", received.append)
+        await bus.publish("catalog", ids=["a"])
+        [document] = await collection.find({}, {"_id": 0}).to_list(None)
+        bus._deliver(document)
+        bus._deliver({**document, "origin": "another-worker"})
+        await bus.stop()
+        return document, received
+
+    document, received = asyncio.run(scenario())
+    assert document["topic"] == "catalog" and document["payload"] == {"ids": ["a"]}
+    assert received == [{"ids": ["a"]}]
+
+
+def test_lease_has_one_holder_until_it_expires(monkeypatch):
+    collection = AsyncMongoMockClient().lease_test.leases
+    identity = ["worker-a"]
+    monkeypatch.setattr(coordination, "process_identity", lambda: identity[0])
+
+    async def as_worker(name, call):
+        identity[0] = name
+        return await call()
+
+    async def scenario():
+        lease = MongoLease(collection, "retention", ttl_seconds=60)
+        taken = await as_worker("worker-a", lease.acquire)
+        contended = await as_worker("worker-b", lease.acquire)
+        renewed = await as_worker("worker-a", lease.acquire)
+        # Only the holder can release it
+        await as_worker("worker-b", lease.release)
+        held_by = (await collection.find_one({"_id": "retention"}))["holder"]
+        # The holder dies; its lease runs out
+        await collection.update_one(
+            {"_id": "retention"}, {"$set": {"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+        )
+        taken_over = await as_worker("worker-b", lease.acquire)
+        await as_worker("worker-b", lease.release)
+        return taken, contended, renewed, held_by, taken_over, await collection.count_documents({})
+
+    taken, contended, renewed, held_by, taken_over, remaining = asyncio.run(scenario())
+    assert (taken, contended, renewed, taken_over) == (True, False, True, True)
+    assert held_by == "worker-a" and remaining == 0
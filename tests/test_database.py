@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+import database
+from database import Database, PoolStats, client_options, read_preference
+
+
+class RecordingClient:
+    """Stands in for AsyncIOMotorClient, keeping the options it was built with"""
+
+    def __init__(self, url, event_listeners=(), **options):
+        self.options = options
+        self.event_listeners = event_listeners
+
+    def __getitem__(self, name):
+        return SimpleNamespace(client=self, name=name)
+
+    def get_database(self, name, read_preference=None):
+        return SimpleNamespace(client=self, name=name, read_preference=read_preference)
+
+
+def test_client_options_come_from_the_environment(monkeypatch):
+    for name in ("MONGO_MAX_POOL_SIZE", "MONGO_SOCKET_TIMEOUT_MS", "MONGO_COMPRESSORS", "MONGO_WRITE_POOL_SIZE"):
+        monkeypatch.delenv(name, raising=False)
+    defaults = client_options()
+    assert defaults["maxPoolSize"] == 100 and defaults["waitQueueTimeoutMS"] == 2000
+    assert "socketTimeoutMS" not in defaults and "compressors" not in defaults
+    assert client_options('MONGO_WRITE_POOL_SIZE', '10')["maxPoolSize"] == 10
+
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "25")
+    monkeypatch.setenv("MONGO_SOCKET_TIMEOUT_MS", "15000")
+    monkeypatch.setenv("MONGO_COMPRESSORS", "zstd,zlib")
+    tuned = client_options()
+    assert tuned["maxPoolSize"] == 25 and tuned["socketTimeoutMS"] == 15000
+    assert tuned["compressors"] == "zstd,zlib" and tuned["zlibCompressionLevel"] == -1
+
+
+def test_read_preferences_are_parsed_by_name():
+    assert isinstance(read_preference("primary"), Primary)
+    preferred = read_preference("secondaryPreferred", 90)
+    assert isinstance(preferred, SecondaryPreferred) and preferred.max_staleness == 90
+    with pytest.raises(ValueError):
+        read_preference("fastest")
+
+
+def test_writes_get_their_own_pool_and_catalog_reads_their_preference(monkeypatch):
+    monkeypatch.setattr(database, "AsyncIOMotorClient", RecordingClient)
+    monkeypatch.setenv("MONGO_WRITE_POOL_SIZE", "5")
+    monkeypatch.setenv("MONGO_CATALOG_READ_PREFERENCE", "nearest")
+    db = Database("mongodb://localhost", "pool_test")
+    assert db.write_client is not db.client
+    assert (db.client.options["maxPoolSize"], db.write_client.options["maxPoolSize"]) == (100, 5)
+    assert db.write_db.client is db.write_client and db.db.client is db.client
+    assert db.catalog_db.read_preference.name == "Nearest"
+    assert set(db.stats()["pools"]) == {"main", "writes"}
+
+    monkeypatch.setenv("MONGO_WRITE_POOL_SIZE", "0")
+    monkeypatch.delenv("MONGO_CATALOG_READ_PREFERENCE")
+    shared = Database("mongodb://localhost", "pool_test")
+    assert shared.write_client is shared.client and set(shared.pools) == {"main"}
+    assert shared.stats()["catalog_read_preference"] == "SecondaryPreferred"
+
+
+def test_pool_stats_track_checkouts_and_failures():
+    pool = PoolStats(max_pool_size=4)
+    event = SimpleNamespace(reason="timeout")
+    pool.connection_created(event)
+    pool.connection_created(event)
+    for _ in range(2):
+        pool.connection_check_out_started(event)
+        pool.connection_checked_out(event)
+    pool.connection_checked_in(event)
+    pool.connection_check_out_started(event)
+    pool.connection_check_out_failed(event)
+
+    stats = pool.stats()
+    assert (stats["open"], stats["in_use"], stats["peak_in_use"], stats["checkouts"]) == (2, 1, 2, 2)
+    assert stats["utilisation"] == 0.25
+    assert stats["checkout_failures"] == 1 and stats["checkout_failures_by_reason"] == {"timeout": 1}
@@ -0,0 +1,45 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from catalog import MonasteryCatalog
+from facets import CatalogFacets, aggregate_facets
+
+
+def seeded_collection(server):
+    async def seed():
+        collection = AsyncMongoMockClient().facets_test.sikkim_monasteries
+        await collection.insert_many([server.SikkimMonastery(**data).dict() for data in server.sikkim_monasteries_data])
+        return collection
+
+    return asyncio.run(seed())
+
+
+def test_mongo_facets_match_the_python_ones(server):
+    collection = seeded_collection(server)
+    models = [server.SikkimMonastery(**data) for data in server.sikkim_monasteries_data]
+    python = CatalogFacets.from_items(models)
+    mongo = asyncio.run(aggregate_facets(collection))
+
+    for facet in ("districts", "traditions"):
+        assert mongo.payload(facet) == python.payload(facet)
+    # $unwind emits one row per festival, tagged with its monastery
+    key = lambda festival: (festival["monastery"], festival["name"])
+    assert sorted(mongo.payload("festivals")["festivals"], key=key) == sorted(python.festivals, key=key)
+    assert len(python.festivals) == sum(len(model.festivals) for model in models)
+
+
+def test_catalog_facets_follow_writes(server, monastery_record):
+    collection = seeded_collection(server)
+
+    async def scenario():
+        catalog = MonasteryCatalog(collection, server.SikkimMonastery, facets_source="mongo")
+        before = dict((await catalog.facets()).payload("districts")["counts"])
+        created = server.SikkimMonastery(**monastery_record("Facet Gompa", district="West Sikkim"))
+        await collection.insert_one(created.dict())
+        catalog.add(created)
+        return before, (await catalog.facets()).payload("districts")["counts"]
+
+    before, after = asyncio.run(scenario())
+    assert after["West Sikkim"] == before.get("West Sikkim", 0) + 1
+    assert sum(after.values()) == len(server.sikkim_monasteries_data) + 1
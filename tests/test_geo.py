@@ -0,0 +1,69 @@
+from itertools import permutations
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from geo import GeoIndex, distance_matrix, haversine_km, plan_route
+
+# Points along the equator, where one degree of longitude is ~111.2 km
+DEGREE_KM = 111.195
+
+
+def route_length(points, order, start=None, return_to_start=False):
+    stops = ([start] if start is not None else []) + [points[i] for i in order]
+    if return_to_start:
+        stops.append(start)
+    distances = distance_matrix(stops)
+    return sum(distances[i, i + 1] for i in range(len(stops) - 1))
+
+
+def test_distance_matrix_matches_haversine():
+    distances = distance_matrix([(0, 0), (0, 1), (27.33, 88.61)])
+    assert distances[0, 1] == pytest.approx(DEGREE_KM, rel=1e-4)
+    assert distances[1, 0] == distances[0, 1] and distances[2, 2] == 0
+    assert distances[0, 2] == pytest.approx(haversine_km(0, 0, np.radians([27.33]), np.radians([88.61]))[0])
+
+
+def test_route_visits_points_on_a_line_in_order():
+    points = [(0, 3), (0, 1), (0, 4), (0, 0), (0, 2)]
+    order, legs = plan_route(points)
+    visited = [points[i][1] for i in order]
+    assert visited in ([0, 1, 2, 3, 4], [4, 3, 2, 1, 0])
+    assert len(legs) == len(points) - 1
+    assert sum(legs) == pytest.approx(4 * DEGREE_KM, rel=1e-4)
+
+
+def test_route_from_a_start_and_back_is_optimal_for_small_sets():
+    points = [(27.3, 88.6), (27.1, 88.3), (27.6, 88.5), (27.2, 88.8), (27.45, 88.2)]
+    start = (27.33, 88.61)
+    order, legs = plan_route(points, start=start, return_to_start=True)
+    assert sorted(order) == list(range(len(points)))
+    # One leg per stop plus the way back
+    assert len(legs) == len(points) + 1
+    best = min(route_length(points, list(p), start, True) for p in permutations(range(len(points))))
+    assert sum(legs) == pytest.approx(best, rel=1e-6)
+
+
+def test_route_edge_cases():
+    assert plan_route([]) == ([], [])
+    assert plan_route([(27.0, 88.0)]) == ([0], [])
+    order, legs = plan_route([(0, 1)], start=(0, 0))
+    assert order == [0] and legs == [pytest.approx(DEGREE_KM, rel=1e-4)]
+
+
+def test_nearby_filters_by_radius_and_orders_by_distance():
+    items = [
+        SimpleNamespace(id=name, coordinates=coordinates)
+        for name, coordinates in [
+            ("far", {"lat": 0, "lng": 2}),
+            ("near", {"lat": 0, "lng": 0.1}),
+            ("unlocated", {}),
+            ("middle", {"lat": 0, "lng": 0.5}),
+        ]
+    ]
+    index = GeoIndex(items)
+    assert [item.id for item, _ in index.nearby(0, 0)] == ["near", "middle", "far"]
+    assert [item.id for item, _ in index.nearby(0, 0, radius_km=100)] == ["near", "middle"]
+    [(item, distance)] = index.nearby(0, 0, k=1)
+    assert item.id == "near" and distance == pytest.approx(0.1 * DEGREE_KM, rel=1e-4)
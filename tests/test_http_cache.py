@@ -0,0 +1,39 @@
+from http_cache import etag_matches, make_etag
+
+
+def test_etag_matching_is_weak_and_accepts_lists():
+    etag = make_etag("token", "/api/districts", "")
+    assert etag.startswith('"') and etag == make_etag("token", "/api/districts", "")
+    assert etag != make_etag("token", "/api/districts", "limit=1")
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+
+
+def test_catalog_reads_answer_304_until_the_catalog_changes(client, monastery_record):
+    first = client.get("/api/districts")
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and "must-revalidate" in first.headers["cache-control"]
+
+    repeat = client.get("/api/districts", headers={"If-None-Match": etag})
+    assert repeat.status_code == 304 and repeat.content == b""
+    assert repeat.headers["etag"] == etag
+
+    # The query string is part of the representation
+    assert client.get("/api/monasteries?limit=1").headers["etag"] != client.get("/api/monasteries").headers["etag"]
+
+    assert client.post("/api/monasteries", json=monastery_record("ETag Test Gompa")).status_code == 200
+    changed = client.get("/api/districts", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+
+
+def test_writes_and_exports_are_not_cached(client):
+    assert "etag" not in client.get("/api/monasteries/export").headers
+    assert "etag" not in client.post("/api/chat/stream", json={"message": "Hello", "session_id": "etag-chat"}).headers
+
+
+def test_travel_guide_has_a_fixed_etag(client):
+    first = client.get("/api/travel-guide")
+    assert first.headers["cache-control"] == "public, max-age=86400"
+    assert client.get("/api/travel-guide", headers={"If-None-Match": first.headers["etag"]}).status_code == 304
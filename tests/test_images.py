@@ -0,0 +1,117 @@
+import asyncio
+import functools
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from images import ImageService, SourceNotAllowed
+
+Image = pytest.importorskip("PIL.Image")
+
+
+class StandInHandler(SimpleHTTPRequestHandler):
+    """Serves files from a directory, plus /redirect?to=<url>"""
+
+    def do_GET(self):
+        if self.path.startswith("/redirect?to="):
+            self.send_response(302)
+            self.send_header("Location", self.path.split("=", 1)[1])
+            self.end_headers()
+            return
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def file_server(tmp_path_factory):
+    """A local stand-in for an image host"""
+    root = tmp_path_factory.mktemp("image_host")
+    Image.new("RGB", (800, 600), (200, 120, 40)).save(root / "photo.jpg")
+    (root / "notes.txt").write_text("not an image")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(StandInHandler, directory=str(root)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def run_service(service: ImageService, scenario):
+    async def run():
+        service.start()
+        try:
+            return await scenario(service)
+        finally:
+            await service.close()
+
+    return asyncio.run(run())
+
+
+def stand_in_service(cache_dir, **options) -> ImageService:
+    options = {"allowed_hosts": ["127.0.0.1"], "allowed_schemes": ["http"], "allow_private_addresses": True, **options}
+    return ImageService(cache_dir, widths=[320, 640], workers=1, **options)
+
+
+def test_ingest_and_render_from_the_stand_in_host(file_server, tmp_path):
+    url = f"{file_server}/photo.jpg"
+
+    async def scenario(service):
+        image = await service.ingest(url)
+        variants = service.variants(url)
+        path = await service.derivative(variants["hash"], 320, "jpeg")
+        return image, variants, path
+
+    image, variants, path = run_service(stand_in_service(tmp_path), scenario)
+    assert (image["width"], image["height"]) == (800, 600)
+    assert variants["srcset"].split(", ")[0].endswith("/320 320w")
+    with Image.open(path) as derivative:
+        assert derivative.size == (320, 240)
+
+
+def test_ingest_follows_allowed_redirects(file_server, tmp_path):
+    url = f"{file_server}/redirect?to=/photo.jpg"
+    image = run_service(stand_in_service(tmp_path), lambda service: service.ingest(url))
+    assert image is not None and image["width"] == 800
+
+
+@pytest.mark.parametrize("path", [
+    "/notes.txt",
+    # A redirect may not leave the allowed hosts, for example for a metadata service
+    "/redirect?to=http://169.254.169.254/latest/meta-data/",
+])
+def test_ingest_refuses_bad_sources(file_server, tmp_path, path):
+    async def scenario(service):
+        return await service.ingest(f"{file_server}{path}"), service.stats()
+
+    image, stats = run_service(stand_in_service(tmp_path), scenario)
+    assert image is None
+    assert stats["failed"] == 1 and stats["sources"] == 0
+
+
+@pytest.mark.parametrize("url, reason", [
+    ("http://images.pexels.com/photo.jpg", "Scheme not allowed"),
+    ("https://internal.example/photo.jpg", "Host not allowed"),
+    ("https://localhost/photo.jpg", "non-public address"),
+    ("https://127.0.0.1/photo.jpg", "non-public address"),
+    ("https://10.0.0.8/photo.jpg", "non-public address"),
+    ("https://[::1]/photo.jpg", "non-public address"),
+])
+def test_check_source_refuses_private_and_unlisted_targets(tmp_path, url, reason):
+    service = ImageService(tmp_path, allowed_hosts=["images.pexels.com", "localhost", "127.0.0.1", "10.0.0.8", "::1"])
+    with pytest.raises(SourceNotAllowed, match=reason):
+        asyncio.run(service.check_source(httpx.URL(url)))
+
+
+def test_default_service_refuses_the_stand_in_host(file_server, tmp_path):
+    async def scenario(service):
+        return await service.ingest(f"{file_server}/photo.jpg")
+
+    assert run_service(ImageService(tmp_path, workers=1), scenario) is None
+
+
+def test_catalog_records_without_ingested_images_have_no_images_key(client):
+    monasteries = client.get("/api/monasteries").json()
+    assert monasteries and all("images" not in monastery for monastery in monasteries)
@@ -0,0 +1,41 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from indexes import INDEXES, ensure_indexes
+
+
+def test_ensure_indexes_keeps_same_named_monasteries():
+    async def scenario():
+        db = AsyncMongoMockClient().indexes_names_test
+        # Left behind by a version that declared names unique
+        await db.sikkim_monasteries.create_index("name", name="name_unique", unique=True)
+        await ensure_indexes(db)
+        await db.sikkim_monasteries.insert_many([
+            {"id": "1", "name": "Rumtek", "district": "East"},
+            {"id": "2", "name": "Rumtek", "district": "East"},
+        ])
+        names = await db.sikkim_monasteries.index_information()
+        documents = await db.sikkim_monasteries.find({}, {"_id": 0, "id": 1}).to_list(None)
+        return names, documents
+
+    names, documents = asyncio.run(scenario())
+    assert {model.document["name"] for model in INDEXES["sikkim_monasteries"]} <= set(names)
+    assert "name_unique" not in names
+    assert documents == [{"id": "1"}, {"id": "2"}]
+
+
+def test_ensure_indexes_builds_the_others_when_one_fails():
+    async def scenario():
+        db = AsyncMongoMockClient().indexes_test
+        # Duplicate ids are not repaired, so id_unique cannot be built
+        await db.sikkim_monasteries.insert_many([
+            {"id": "1", "name": "Rumtek"},
+            {"id": "1", "name": "Enchey"},
+        ])
+        await ensure_indexes(db)
+        return await db.sikkim_monasteries.index_information()
+
+    names = asyncio.run(scenario())
+    assert "id_unique" not in names
+    assert {"name", "district", "tradition"} <= set(names)
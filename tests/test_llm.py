@@ -0,0 +1,195 @@
+import asyncio
+
+import pytest
+
+from llm import LlmDispatcher, LlmOverloaded, LlmUsage
+
+
+class GatedBackend:
+    """Replies once ``gate`` opens; fails with the queued errors first"""
+
+    configured = True
+
+    def __init__(self, errors=()):
+        self.gate = asyncio.Event()
+        self.errors = list(errors)
+        self.calls = 0
+        self.cancelled = 0
+
+    async def complete(self, session_id, system_message, text, usage=None):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        try:
+            await self.gate.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return f"reply to {text}"
+
+    async def stream(self, session_id, system_message, text, usage=None):
+        yield await self.complete(session_id, system_message, text, usage)
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"upstream answered {status_code}")
+        self.status_code = status_code
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_calls_beyond_the_concurrency_cap_wait_in_the_queue():
+    async def scenario():
+        backend = GatedBackend()
+        dispatcher = LlmDispatcher(backend, max_concurrency=2, max_queue=4)
+        calls = [asyncio.create_task(dispatcher.complete("s", "system", f"q{i}")) for i in range(4)]
+        await settle()
+        during = dispatcher.stats()
+        backend.gate.set()
+        replies = await asyncio.gather(*calls)
+        return during, dispatcher.stats(), replies
+
+    during, after, replies = asyncio.run(scenario())
+    assert (during["running"], during["queue_depth"]) == (2, 2)
+    assert (after["running"], after["queue_depth"], after["completed"]) == (0, 0, 4)
+    assert replies == [f"reply to q{i}" for i in range(4)]
+
+
+def test_a_full_queue_is_refused_with_retry_after():
+    async def scenario():
+        backend = GatedBackend()
+        dispatcher = LlmDispatcher(backend, max_concurrency=1, max_queue=1)
+        calls = [asyncio.create_task(dispatcher.complete("s", "system", f"q{i}")) for i in range(2)]
+        await settle()
+        with pytest.raises(LlmOverloaded) as refused:
+            await dispatcher.complete("s", "system", "one too many")
+        backend.gate.set()
+        await asyncio.gather(*calls)
+        return refused.value, dispatcher.stats()
+
+    refused, stats = asyncio.run(scenario())
+    assert refused.status_code == 503 and refused.retry_after >= 1
+    assert stats["rejected"] == 1
+
+
+def test_queue_timeout_is_a_503():
+    async def scenario():
+        backend = GatedBackend()
+        dispatcher = LlmDispatcher(backend, max_concurrency=1, queue_timeout=0.01)
+        running = asyncio.create_task(dispatcher.complete("s", "system", "first"))
+        await settle()
+        with pytest.raises(LlmOverloaded) as refused:
+            await dispatcher.complete("s", "system", "second")
+        backend.gate.set()
+        await running
+        return refused.value, dispatcher.stats()
+
+    refused, stats = asyncio.run(scenario())
+    assert refused.status_code == 503 and stats["timed_out"] == 1
+
+
+def test_retryable_errors_are_retried_with_backoff():
+    async def scenario():
+        backend = GatedBackend(errors=[ConnectionError("reset"), UpstreamError(503)])
+        backend.gate.set()
+        dispatcher = LlmDispatcher(backend, max_retries=2, backoff_base=0.001)
+        reply = await dispatcher.complete("s", "system", "question")
+        return reply, backend.calls, dispatcher.stats()
+
+    reply, calls, stats = asyncio.run(scenario())
+    assert reply == "reply to question"
+    assert calls == 3 and stats["retries"] == 2 and stats["completed"] == 1
+
+
+def test_other_errors_are_not_retried():
+    async def scenario():
+        backend = GatedBackend(errors=[UpstreamError(400)])
+        dispatcher = LlmDispatcher(backend, max_retries=2, backoff_base=0.001)
+        with pytest.raises(UpstreamError):
+            await dispatcher.complete("s", "system", "question")
+        return backend.calls, dispatcher.stats()
+
+    calls, stats = asyncio.run(scenario())
+    assert calls == 1 and stats["retries"] == 0 and stats["failed"] == 1
+
+
+def test_persistent_upstream_rate_limit_becomes_429():
+    async def scenario():
+        backend = GatedBackend(errors=[UpstreamError(429)] * 3)
+        dispatcher = LlmDispatcher(backend, max_retries=1, backoff_base=0.001)
+        with pytest.raises(LlmOverloaded) as limited:
+            await dispatcher.complete("s", "system", "question")
+        return limited.value, backend.calls
+
+    limited, calls = asyncio.run(scenario())
+    assert limited.status_code == 429 and calls == 2
+
+
+def test_identical_calls_share_one_upstream_request():
+    async def scenario():
+        backend = GatedBackend()
+        dispatcher = LlmDispatcher(backend)
+        leader_usage, follower_usage = LlmUsage(), LlmUsage()
+        calls = [
+            asyncio.create_task(dispatcher.complete("s1", "system", "same", leader_usage)),
+            asyncio.create_task(dispatcher.complete("s2", "system", "same", follower_usage)),
+        ]
+        await settle()
+        backend.gate.set()
+        replies = await asyncio.gather(*calls)
+        return replies, backend.calls, dispatcher.stats(), leader_usage, follower_usage
+
+    replies, calls, stats, leader_usage, follower_usage = asyncio.run(scenario())
+    assert replies == ["reply to same"] * 2
+    assert calls == 1 and stats["coalesced"] == 1
+    assert leader_usage.total and not follower_usage.total
+
+
+def test_cancelled_leader_does_not_cancel_its_followers():
+    async def scenario():
+        backend = GatedBackend()
+        dispatcher = LlmDispatcher(backend)
+        leader = asyncio.create_task(dispatcher.complete("s1", "system", "same"))
+        await settle()
+        follower = asyncio.create_task(dispatcher.complete("s2", "system", "same"))
+        await settle()
+        # The leader's client disconnects
+        leader.cancel()
+        await settle()
+        backend.gate.set()
+        return await follower, leader.cancelled(), backend.cancelled, dispatcher.stats()
+
+    reply, leader_cancelled, backend_cancelled, stats = asyncio.run(scenario())
+    assert reply == "reply to same"
+    assert leader_cancelled and backend_cancelled == 0
+    assert stats["running"] == 0 and stats["completed"] == 1
+
+
+def test_call_is_cancelled_once_every_caller_has_gone():
+    async def scenario():
+        backend = GatedBackend()
+        dispatcher = LlmDispatcher(backend)
+        calls = [asyncio.create_task(dispatcher.complete(f"s{i}", "system", "same")) for i in range(2)]
+        await settle()
+        for call in calls:
+            call.cancel()
+        await settle()
+        return backend.cancelled, dispatcher.stats(), dispatcher._inflight
+
+    backend_cancelled, stats, inflight = asyncio.run(scenario())
+    assert backend_cancelled == 1
+    assert stats["running"] == 0 and not inflight
+
+
+def test_overload_is_answered_with_retry_after(client, server, monkeypatch):
+    async def overloaded(*args, **kwargs):
+        raise LlmOverloaded("AI service is busy, please retry shortly", 503, 7)
+
+    monkeypatch.setattr(server.llm, "complete", overloaded)
+    response = client.post("/api/chat", json={"message": "Hello", "session_id": "llm-overload", "bypass_cache": True})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "7"
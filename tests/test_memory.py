@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import memory as memory_module
+from memory import ConversationMemory
+
+
+class RacingMemory(ConversationMemory):
+    """Records another request's turn for the session right after the next load"""
+
+    race = False
+
+    async def load(self, session_id):
+        memory = await super().load(session_id)
+        if self.race:
+            self.race = False
+            await self.record(session_id, "Concurrent question?", "Concurrent answer.")
+        return memory
+
+
+def new_memory(cls=ConversationMemory, **options):
+    collection = AsyncMongoMockClient().memory_test.chat_memory
+    asyncio.run(collection.create_index("session_id", unique=True))
+    return cls(collection, **options)
+
+
+@pytest.mark.parametrize("earlier_turns", [0, 2])
+def test_concurrent_records_keep_every_turn(earlier_turns):
+    memory = new_memory(RacingMemory)
+
+    async def scenario():
+        for i in range(earlier_turns):
+            await memory.record("s1", f"Question {i}?", f"Answer {i}.")
+        memory.race = True
+        await memory.record("s1", "My question?", "My answer.")
+        return await memory.load("s1")
+
+    stored = asyncio.run(scenario())
+    assert stored["turn_count"] == earlier_turns + 2
+    assert [turn["user"] for turn in stored["turns"][-2:]] == ["Concurrent question?", "My question?"]
+
+
+def test_turns_beyond_the_window_fold_into_the_summary():
+    memory = new_memory(window_turns=2)
+
+    async def scenario():
+        for i in range(4):
+            await memory.record("s1", f"Question {i}?", f"Answer {i}. More detail.")
+        return await memory.load("s1")
+
+    stored = asyncio.run(scenario())
+    assert stored["turn_count"] == 4
+    assert [turn["user"] for turn in stored["turns"]] == ["Question 2?", "Question 3?"]
+    assert "Question 0?" in stored["summary"] and "Answer 1." in stored["summary"]
+
+
+def test_contended_record_still_appends_the_turn(monkeypatch):
+    monkeypatch.setattr(memory_module, "MAX_RECORD_ATTEMPTS", 0)
+    memory = new_memory(window_turns=2)
+
+    async def scenario():
+        for i in range(3):
+            await memory.record("s1", f"Question {i}?", f"Answer {i}.")
+        return await memory.load("s1")
+
+    stored = asyncio.run(scenario())
+    assert stored["turn_count"] == 3
+    assert [turn["user"] for turn in stored["turns"]] == ["Question 1?", "Question 2?"]
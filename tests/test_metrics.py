@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from metrics import MetricsRegistry
+from tracing import Tracer, tracer
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    registry.counter("jobs_total", "Jobs run", ["kind"]).inc(3, kind='a "quoted" kind')
+    registry.histogram("wait_seconds", "Time waited", buckets=(0.1, 1)).observe(0.5)
+    registry.collector(lambda: iter([("queue_depth", "Queued jobs", [({"queue": "main"}, 4)])]))
+
+    lines = registry.render().decode().splitlines()
+    assert "# TYPE jobs_total counter" in lines
+    assert 'jobs_total{kind="a \\"quoted\\" kind"} 3' in lines
+    assert ['wait_seconds_bucket{le="0.1"} 0', 'wait_seconds_bucket{le="1"} 1', 'wait_seconds_bucket{le="+Inf"} 1'] == [
+        line for line in lines if line.startswith("wait_seconds_bucket")
+    ]
+    assert "wait_seconds_count 1" in lines
+    assert "# TYPE queue_depth gauge" in lines and 'queue_depth{queue="main"} 4' in lines
+
+
+def test_metrics_endpoint_reports_requests_by_route(client):
+    assert client.get("/api/monasteries/no-such-id").status_code == 404
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    # Labelled by route template, not by the raw path
+    assert 'route="/api/monasteries/{monastery_id}",status="404"' in body
+    assert "no-such-id" not in body
+    for family in ("llm_dispatcher_", "write_buffer_", "catalog_version", "span_duration_seconds"):
+        assert family in body
+
+
+def test_spans_nest_and_record_errors(tmp_path):
+    local = Tracer()
+    finished = []
+    local.on_end(finished.append)
+    local.configure(str(tmp_path / "spans.jsonl"))
+
+    with local.span("request", path="/x") as root:
+        with local.span("stage"):
+            pass
+        with pytest.raises(ValueError):
+            with local.span("failing"):
+                raise ValueError("boom")
+    with local.span("next request") as other:
+        pass
+    local.shutdown()
+
+    stage, failing, request, _ = finished
+    assert {span.trace_id for span in (stage, failing, request)} == {root.trace_id}
+    assert stage.parent_id == failing.parent_id == root.span_id and root.parent_id is None
+    assert failing.error == "ValueError" and stage.error is None
+    assert other.trace_id != root.trace_id
+
+    exported = [json.loads(line) for line in (tmp_path / "spans.jsonl").read_text().splitlines()]
+    assert [span["name"] for span in exported] == ["stage", "failing", "request", "next request"]
+    assert exported[2]["attributes"] == {"path": "/x"}
+
+
+def test_chat_stages_are_traced_under_the_request(client, monkeypatch):
+    finished = []
+    monkeypatch.setattr(tracer, "_on_end", tracer._on_end + [finished.append])
+    response = client.post("/api/chat", json={"message": "Tell me about Rumtek", "session_id": "traced", "bypass_cache": True})
+    assert response.status_code == 200
+
+    [request] = [span for span in finished if span.name == "http.request"]
+    assert request.attributes["route"] == "/api/chat" and request.attributes["status"] == 200
+    names = {span.name for span in finished if span.trace_id == request.trace_id}
+    assert {"chat.context", "llm.queue", "llm.complete", "chat.persist"} <= names
@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+import pytest
+
+from pagination import decode_cursor, encode_cursor, page_after, parse_fields
+
+
+def entries(count):
+    return [SimpleNamespace(id=f"m{i}") for i in range(count)]
+
+
+def test_cursor_round_trips_and_rejects_garbage():
+    cursor = encode_cursor({"after": "m3"})
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == {"after": "m3"}
+    for bad in ("not a cursor", encode_cursor(["a list"])):
+        with pytest.raises(ValueError):
+            decode_cursor(bad)
+
+
+def test_pages_cover_every_entry_once():
+    items = entries(7)
+    seen, cursor = [], None
+    while True:
+        page, cursor = page_after(items, cursor, 3)
+        seen.extend(item.id for item in page)
+        if cursor is None:
+            break
+    assert seen == [item.id for item in items]
+    # An exact multiple of the page size ends without an empty page
+    page, cursor = page_after(entries(6), encode_cursor({"after": "m2"}), 3)
+    assert [item.id for item in page] == ["m3", "m4", "m5"] and cursor is None
+
+
+def test_cursor_for_a_removed_entry_is_refused():
+    with pytest.raises(ValueError):
+        page_after(entries(3), encode_cursor({"after": "gone"}), 2)
+
+
+def test_parse_fields_expands_presets_and_keeps_id():
+    presets = {"summary": ["name", "district"]}
+    assert parse_fields(None, ["name"], presets) is None
+    assert parse_fields("summary, tradition", ["name", "district", "tradition"], presets) == {
+        "id", "name", "district", "tradition"
+    }
+    with pytest.raises(ValueError):
+        parse_fields("password", ["name"], presets)
+
+
+def test_api_pages_with_next_cursor_header(client):
+    everything = [entry["id"] for entry in client.get("/api/monasteries").json()]
+    seen, params = [], {"limit": 2, "fields": "summary"}
+    while True:
+        response = client.get("/api/monasteries", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert all("description" not in entry for entry in page)
+        seen.extend(entry["id"] for entry in page)
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            break
+        params = {**params, "cursor": cursor}
+    assert seen == everything
+
+    assert client.get("/api/monasteries", params={"cursor": "bogus"}).status_code == 400
@@ -0,0 +1,57 @@
+import json
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import panorama
+from panorama import FACES, build_preview, build_pyramid, cube_face, level_resolution, pyramid_config
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def gradient_panorama(width: int, height: int) -> np.ndarray:
+    """Red follows longitude and green latitude, so each direction has its own colour"""
+    red = np.tile(np.linspace(0, 255, width, dtype=np.float32), (height, 1))
+    green = np.tile(np.linspace(0, 255, height, dtype=np.float32)[:, None], (1, width))
+    return np.dstack([red, green, np.full_like(red, 128)]).astype(np.uint8)
+
+
+def test_front_face_centre_looks_at_the_panorama_centre():
+    source = gradient_panorama(512, 256)
+    face = cube_face(source, "f", 64)
+    centre = face[31:33, 31:33].reshape(-1, 3).mean(axis=0)
+    assert np.allclose(centre, source[127:129, 255:257].reshape(-1, 3).mean(axis=0), atol=3)
+
+
+def test_cube_face_memory_does_not_grow_with_the_panorama(monkeypatch):
+    monkeypatch.setattr(panorama, "PIXELS_PER_PASS", 4096)
+    peaks = []
+    for width in (1024, 2048):
+        source = gradient_panorama(width, width // 2)
+        size = pyramid_config(width, 128, "jpeg")["cubeResolution"]
+        tracemalloc.start()
+        face = cube_face(source, "r", size)
+        peaks.append(tracemalloc.get_traced_memory()[1] - face.nbytes)
+        tracemalloc.stop()
+    # Only the band of floats is extra; it never scales with the source
+    assert max(peaks) < 2 * 1024 * 1024
+    assert peaks[1] < source.nbytes
+
+
+def test_preview_and_pyramid_layout(tmp_path):
+    source = tmp_path / "pano.png"
+    Image.fromarray(gradient_panorama(1024, 512)).save(source)
+    build_preview(str(source), str(tmp_path / "preview.jpeg"), 256, "jpeg", 80)
+    with Image.open(tmp_path / "preview.jpeg") as preview:
+        assert preview.size == (256, 128)
+
+    config = pyramid_config(1024, 128, "jpeg")
+    build_pyramid(str(source), str(tmp_path / "tiles"), config, 80)
+    assert json.loads((tmp_path / "tiles" / "config.json").read_text()) == config
+    for level in range(1, config["maxLevel"] + 1):
+        tiles = -(-level_resolution(config["cubeResolution"], config["maxLevel"], level) // 128)
+        for face in FACES:
+            names = sorted(path.name for path in (tmp_path / "tiles" / str(level) / face).iterdir())
+            assert len(names) == tiles * tiles
+    assert not list(tmp_path.glob("tiles.*.tmp"))
@@ -0,0 +1,27 @@
+from prompts import PromptCache, TokenCounter
+
+
+def test_prompts_are_rendered_once_per_monastery_and_version(server):
+    monastery = server.SikkimMonastery(**server.sikkim_monasteries_data[0])
+    other = server.SikkimMonastery(**server.sikkim_monasteries_data[1])
+    cache = PromptCache(TokenCounter())
+
+    prompt, tokens = cache.get(monastery, 0)
+    assert monastery.name in prompt and tokens > 0
+    assert cache.get(monastery, 0) == (prompt, tokens)
+    assert other.name in cache.get(other, 0)[0]
+    general, _ = cache.get(None, 0)
+    assert "Current Monastery Context" not in general
+    assert (cache.renders, cache.hits) == (3, 1)
+
+
+def test_a_new_catalog_version_drops_older_prompts(server):
+    monastery = server.SikkimMonastery(**server.sikkim_monasteries_data[0])
+    cache = PromptCache(TokenCounter())
+    cache.get(monastery, 0)
+    cache.get(None, 0)
+
+    edited = monastery.copy(update={"visiting_hours": "Dawn to dusk"})
+    prompt, _ = cache.get(edited, 1)
+    assert "Dawn to dusk" in prompt
+    assert cache.stats()["cached_prompts"] == 1 and cache.renders == 3
@@ -0,0 +1,187 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from starlette.requests import Request
+
+import rate_limit
+from llm import FakeLlmBackend, LlmDispatcher, LlmUsage
+from rate_limit import (
+    ChatRateLimiter,
+    Limit,
+    MemoryRateLimitBackend,
+    MongoRateLimitBackend,
+    RateLimited,
+    client_ip,
+    create_chat_rate_limiter,
+)
+
+# Mid-morning UTC, so a few minutes of refill never cross midnight
+MORNING = datetime(2026, 3, 1, 9, 0, tzinfo=timezone.utc).timestamp()
+
+
+def memory_backend():
+    return MemoryRateLimitBackend()
+
+
+def mongo_backend():
+    db = AsyncMongoMockClient().rate_limit_test
+    return MongoRateLimitBackend(db.rate_limit_buckets, db.chat_token_usage)
+
+
+@pytest.fixture(params=[memory_backend, mongo_backend], ids=["memory", "mongo"])
+def backend(request):
+    return request.param()
+
+
+def test_bucket_admits_a_burst_then_refills_one_per_interval(backend):
+    # 6 per minute: one request every 10 seconds, up to 3 at once
+    limit = Limit(6, 3)
+
+    async def take(now):
+        return await backend.take("ip:1.2.3.4", limit, now)
+
+    async def scenario():
+        burst = [await take(MORNING) for _ in range(3)]
+        over = await take(MORNING)
+        early = await take(MORNING + 9)
+        refilled = await take(MORNING + 10)
+        again = await take(MORNING + 10)
+        idle = [await take(MORNING + 100) for _ in range(3)]
+        return burst, over, early, refilled, again, idle
+
+    burst, over, early, refilled, again, idle = asyncio.run(scenario())
+    assert burst == [0, 0, 0]
+    assert over == pytest.approx(10)
+    assert early == pytest.approx(1)
+    assert refilled == 0
+    assert again == pytest.approx(10)
+    # A bucket idle long enough is full again, but never holds more than its burst
+    assert idle == [0, 0, 0]
+
+
+def test_keys_have_separate_buckets(backend):
+    limit = Limit(6, 1)
+
+    async def scenario():
+        return [await backend.take(key, limit, MORNING) for key in ("session:a", "session:b", "session:a")]
+
+    assert asyncio.run(scenario()) == [0, 0, pytest.approx(10)]
+
+
+def test_quota_is_exhausted_by_charges_and_resets_at_midnight(backend, monkeypatch):
+    clock = [MORNING]
+    monkeypatch.setattr(rate_limit.time, "time", lambda: clock[0])
+    limiter = ChatRateLimiter(backend, limits={}, quotas={"session": 100})
+
+    async def scenario():
+        await limiter.check("1.2.3.4", "s1")
+        await limiter.charge("1.2.3.4", "s1", 60)
+        await limiter.check("1.2.3.4", "s1")
+        await limiter.charge("1.2.3.4", "s1", 60)
+        with pytest.raises(RateLimited) as over:
+            await limiter.check("1.2.3.4", "s1")
+        # Other sessions have their own allowance
+        await limiter.check("1.2.3.4", "s2")
+        clock[0] = datetime(2026, 3, 2, 0, 0, 1, tzinfo=timezone.utc).timestamp()
+        await limiter.check("1.2.3.4", "s1")
+        return over.value
+
+    over = asyncio.run(scenario())
+    assert over.limit == "session_quota"
+    assert over.retry_after == 15 * 3600
+    assert limiter.limited == {"session_quota": 1}
+
+
+def test_rate_limit_rejects_with_retry_after(monkeypatch):
+    monkeypatch.setattr(rate_limit.time, "time", lambda: MORNING)
+    limiter = ChatRateLimiter(MemoryRateLimitBackend(), limits={"session": Limit(6, 2)}, quotas={})
+
+    async def scenario():
+        await limiter.check("1.2.3.4", "s1")
+        await limiter.check("1.2.3.4", "s1")
+        with pytest.raises(RateLimited) as over:
+            await limiter.check("1.2.3.4", "s1")
+        return over.value
+
+    over = asyncio.run(scenario())
+    assert (over.limit, over.retry_after) == ("session_rate", 10)
+
+
+def test_ip_limits_apply_by_default_and_key_on_the_configured_hop(monkeypatch):
+    db = AsyncMongoMockClient().rate_limit_env_test
+    monkeypatch.delenv("RATE_LIMIT_TRUSTED_PROXIES", raising=False)
+    limiter = create_chat_rate_limiter(db)
+    # A client minting a session id per request is still bounded by its address
+    assert set(limiter.limits) == set(limiter.quotas) == {"ip", "session"}
+    forwarded = Request({
+        "type": "http", "headers": [(b"x-forwarded-for", b"6.6.6.6, 203.0.113.7")], "client": ("10.0.0.2", 50000)
+    })
+    assert client_ip(forwarded, limiter.trusted_proxies) == "10.0.0.2"
+
+    monkeypatch.setenv("RATE_LIMIT_TRUSTED_PROXIES", "1")
+    limiter = create_chat_rate_limiter(db)
+    assert client_ip(forwarded, limiter.trusted_proxies) == "203.0.113.7"
+
+
+def test_fresh_session_ids_do_not_escape_the_ip_limit(monkeypatch):
+    monkeypatch.setattr(rate_limit.time, "time", lambda: MORNING)
+    limiter = ChatRateLimiter(
+        MemoryRateLimitBackend(), limits={"ip": Limit(6, 2), "session": Limit(6, 2)}, quotas={}
+    )
+
+    async def scenario():
+        await limiter.check("1.2.3.4", "s1")
+        await limiter.check("1.2.3.4", "s2")
+        with pytest.raises(RateLimited) as over:
+            await limiter.check("1.2.3.4", "s3")
+        return over.value
+
+    assert asyncio.run(scenario()).limit == "ip_rate"
+
+
+class ReportingBackend:
+    """Stand-in for a provider that returns token counts with its reply"""
+
+    configured = True
+
+    async def complete(self, session_id, system_message, text, usage=None):
+        if usage is not None:
+            usage.prompt_tokens += 1234
+            usage.completion_tokens += 56
+        return "A short reply"
+
+    async def stream(self, session_id, system_message, text, usage=None):
+        yield await self.complete(session_id, system_message, text, usage)
+
+
+def test_quota_charges_use_provider_reported_tokens():
+    dispatcher = LlmDispatcher(ReportingBackend())
+
+    async def scenario():
+        completed, streamed = LlmUsage(), LlmUsage()
+        await dispatcher.complete("s1", "system prompt", "question", completed)
+        stream = await dispatcher.open_stream("s1", "system prompt", "another question", streamed)
+        [token async for token in stream]
+        return completed, streamed
+
+    completed, streamed = asyncio.run(scenario())
+    assert (completed.prompt_tokens, completed.completion_tokens) == (1234, 56)
+    assert streamed.total == 1290
+    assert dispatcher.stats()["reported_usage"] == 2
+
+
+def test_quota_charges_fall_back_to_the_estimate():
+    dispatcher = LlmDispatcher(FakeLlmBackend(first_token_delay=0, token_delay=0))
+
+    async def scenario():
+        usage = LlmUsage()
+        reply = await dispatcher.complete("s1", "system prompt", "question", usage)
+        return reply, usage
+
+    reply, usage = asyncio.run(scenario())
+    counter = dispatcher.token_counter
+    assert usage.completion_tokens == counter.count(reply)
+    assert usage.prompt_tokens == counter.count("system prompt") + counter.count("question")
+    assert dispatcher.stats()["estimated_usage"] == 1
@@ -0,0 +1,111 @@
+import asyncio
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import OperationFailure
+
+import retention
+from retention import RetentionPolicy, archive_chat_sessions, rollup_status_checks
+
+
+def message(session_id, timestamp, text):
+    return {"id": f"{session_id}-{text}", "session_id": session_id, "message": text, "timestamp": timestamp}
+
+
+def test_archive_keeps_messages_that_arrive_while_it_runs(tmp_path, monkeypatch):
+    db = AsyncMongoMockClient().retention_test
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    old = now - timedelta(days=40)
+    cutoff = now - timedelta(days=30)
+    write_archive = retention._append_gzip
+
+    def append_then_receive(path, lines):
+        write_archive(path, lines)
+        # The visitor comes back between the archive copy and the delete
+        asyncio.run(db.chat_messages.insert_one(message("idle", now, "back again")))
+        asyncio.run(db.chat_memory.update_one({"session_id": "idle"}, {"$set": {"updated_at": now}}))
+
+    monkeypatch.setattr(retention, "_append_gzip", append_then_receive)
+
+    async def scenario():
+        await db.chat_messages.insert_many([
+            message("idle", old, "first"),
+            message("idle", old + timedelta(minutes=1), "second"),
+            message("active", now, "hello"),
+        ])
+        await db.chat_memory.insert_one({"session_id": "idle", "updated_at": old})
+        archived = await archive_chat_sessions(db, cutoff, str(tmp_path))
+        remaining = await db.chat_messages.find({}, {"_id": 0}).sort("timestamp", 1).to_list(length=None)
+        return archived, remaining, await db.chat_memory.count_documents({"session_id": "idle"})
+
+    archived, remaining, memories = asyncio.run(scenario())
+    assert archived == 1
+    assert [(m["session_id"], m["message"]) for m in remaining] == [("active", "hello"), ("idle", "back again")]
+    assert memories == 1
+
+    [path] = tmp_path.glob("chat-*.ndjson.gz")
+    with gzip.open(path) as archive:
+        lines = [json.loads(line) for line in archive]
+    assert [line["message"] for line in lines] == ["first", "second"]
+    assert all("_id" not in line for line in lines)
+
+
+def test_archive_removes_idle_sessions_and_their_memory(tmp_path):
+    db = AsyncMongoMockClient().retention_idle_test
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    old = now - timedelta(days=40)
+
+    async def scenario():
+        await db.chat_messages.insert_many([message("idle", old, "first"), message("active", now, "hello")])
+        await db.chat_memory.insert_many([
+            {"session_id": "idle", "updated_at": old},
+            {"session_id": "active", "updated_at": now},
+        ])
+        archived = await archive_chat_sessions(db, now - timedelta(days=30), str(tmp_path))
+        sessions = await db.chat_messages.distinct("session_id")
+        return archived, sessions, await db.chat_memory.distinct("session_id")
+
+    archived, sessions, memories = asyncio.run(scenario())
+    assert archived == 1
+    assert sessions == ["active"] and memories == ["active"]
+
+
+def test_rollup_rerun_after_a_failed_delete_does_not_double_count(monkeypatch):
+    db = AsyncMongoMockClient().retention_rollup_test
+    hour = datetime(2026, 3, 1, 9, 0)
+    checks = db.status_checks
+    delete_many = type(checks).delete_many
+    failures = [OperationFailure("interrupted")]
+
+    async def failing_delete(self, *args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return await delete_many(self, *args, **kwargs)
+
+    async def scenario():
+        await checks.insert_many([
+            {"client_name": "web", "timestamp": hour + timedelta(minutes=minute)} for minute in (1, 2, 3)
+        ])
+        monkeypatch.setattr(type(checks), "delete_many", failing_delete)
+        with pytest.raises(OperationFailure):
+            await rollup_status_checks(db, hour + timedelta(hours=2))
+        # A new check in the same hour arrives before the rerun
+        await checks.insert_one({"client_name": "web", "timestamp": hour + timedelta(minutes=4)})
+        rolled_up = await rollup_status_checks(db, hour + timedelta(hours=2))
+        again = await rollup_status_checks(db, hour + timedelta(hours=2))
+        rollups = await db.status_check_rollups.find({}, {"_id": 0}).to_list(length=None)
+        return rolled_up, again, rollups, await checks.count_documents({})
+
+    rolled_up, again, rollups, remaining = asyncio.run(scenario())
+    assert (rolled_up, again, remaining) == (4, 0, 0)
+    assert rollups == [{"client_name": "web", "hour": hour, "count": 4, "runs": []}]
+
+
+def test_chat_ttl_shorter_than_the_archive_age_is_refused():
+    with pytest.raises(ValueError):
+        RetentionPolicy(chat_ttl_days=7, chat_archive_dir="/tmp/archive", chat_archive_after_days=30)
+    # Without archival, a short TTL is fine
+    RetentionPolicy(chat_ttl_days=7, chat_archive_after_days=30)
@@ -0,0 +1,89 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from catalog import MonasteryCatalog
+from geo import GeoIndex
+from search_index import SearchIndex
+
+
+def catalog_items(server):
+    return [server.SikkimMonastery(**data) for data in server.sikkim_monasteries_data]
+
+
+def ids(items):
+    return [item.id for item in items]
+
+
+def test_search_ranks_name_matches_first_and_requires_every_token(server):
+    items = catalog_items(server)
+    index = SearchIndex(items)
+
+    rumtek = [item for item in items if "Rumtek" in item.name]
+    assert rumtek and ids(index.search("rumtek")[:len(rumtek)]) == ids(rumtek)
+    # Prefixes match, case and diacritics are folded
+    assert ids(index.search("RUMT")) == ids(index.search("rumtek"))
+    # Every token must match
+    assert index.search("rumtek zzzz") == []
+    both = index.search("nyingma monastery")
+    assert both and all(item in index.search("nyingma") for item in both)
+    assert index.search("") == items
+
+
+def test_short_prefix_results_are_cached_and_repeatable(server):
+    index = SearchIndex(catalog_items(server))
+
+    first = index.search("m")
+    assert first and index.search("m") == first
+    assert ("m",) in index._prefix_rankings
+
+
+def test_add_matches_a_rebuilt_index(server, monastery_record):
+    items = catalog_items(server)
+    added = server.SikkimMonastery(**monastery_record("Zangdok Palri Monastery"))
+    index = SearchIndex(items)
+    index.search("m")
+    index.add(added)
+
+    rebuilt = SearchIndex(items + [added])
+    for query in ("zang", "m", "palri monastery", "nyingma", "lake"):
+        assert ids(index.search(query)) == ids(rebuilt.search(query)), query
+    assert index.search("zangdok")[0] is added
+
+
+def test_postings_round_trip(server):
+    items = catalog_items(server)
+    index = SearchIndex(items)
+
+    restored = SearchIndex.from_postings(items, index.postings())
+    for query in ("rumtek", "m", "prayer wheel"):
+        assert ids(restored.search(query)) == ids(index.search(query))
+
+
+def test_geo_add_matches_a_rebuilt_index(server, monastery_record):
+    items = catalog_items(server)
+    added = server.SikkimMonastery(**monastery_record("Geo Test Gompa", coordinates={"lat": 27.33, "lng": 88.61}))
+    index = GeoIndex(items)
+    index.add(added)
+
+    assert index.nearby(27.33, 88.61, radius_km=1)[0][0] is added
+    rebuilt = GeoIndex(items + [added])
+    assert ids(item for item, _ in index.nearby(27.3, 88.6, k=5)) == ids(item for item, _ in rebuilt.nearby(27.3, 88.6, k=5))
+
+
+def test_catalog_add_updates_search_without_a_rebuild(server, monastery_record):
+    async def scenario():
+        collection = AsyncMongoMockClient().search_test.sikkim_monasteries
+        await collection.insert_many([item.dict() for item in catalog_items(server)])
+        catalog = MonasteryCatalog(collection, server.SikkimMonastery)
+        await catalog.ensure_loaded()
+        index = catalog._index
+        added = server.SikkimMonastery(**monastery_record("Zangdok Palri Monastery"))
+        await collection.insert_one(added.dict())
+        catalog.add(added)
+        assert catalog._index is index
+        return catalog, added
+
+    catalog, added = asyncio.run(scenario())
+    assert ids(asyncio.run(catalog.filter(search="zangdok"))) == [added.id]
+    assert asyncio.run(catalog.get(added.id)) is added
@@ -0,0 +1,76 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import BulkWriteError
+
+from indexes import ensure_indexes
+
+
+@pytest.fixture
+def seeding(server, monkeypatch):
+    """Seed into an empty, indexed database, recording catalog invalidations"""
+    db = AsyncMongoMockClient().seed_test
+    asyncio.run(ensure_indexes(db))
+    published = []
+
+    async def publish(topic):
+        published.append(topic)
+
+    monkeypatch.setattr(server, "db", db)
+    # Both are replaced per run below and restored afterwards
+    monkeypatch.setattr(server, "seed_state", None)
+    monkeypatch.setattr(server, "seed_lock", None)
+    monkeypatch.setattr(server.invalidation, "publish", publish)
+    monkeypatch.setattr(server.catalog, "invalidate", lambda read_primary=False: None)
+
+    def run():
+        """One worker starting up: its own seed_state and lock"""
+        async def seed():
+            server.seed_state = {"seeded": False, "inserted": 0}
+            server.seed_lock = asyncio.Lock()
+            await server.seed_sikkim_monasteries()
+            return server.seed_state
+
+        return asyncio.run(seed())
+
+    return SimpleNamespace(db=db, run=run, published=published)
+
+
+def test_seeding_is_idempotent_across_workers(server, seeding):
+    first = seeding.run()
+    ids = sorted(document["id"] for document in asyncio.run(seeding.db.sikkim_monasteries.find().to_list(None)))
+    second = seeding.run()
+    documents = asyncio.run(seeding.db.sikkim_monasteries.find().to_list(None))
+
+    assert first == {"seeded": True, "inserted": len(server.sikkim_monasteries_data)}
+    assert second == {"seeded": True, "inserted": 0}
+    assert sorted(document["id"] for document in documents) == ids
+    # Seed ids come from the name, so every worker picks the same ones
+    assert ids == sorted(server.seed_id(data["name"]) for data in server.sikkim_monasteries_data)
+    assert seeding.published == ["catalog"]
+
+
+class RacingCollection:
+    """Another worker inserted some seed documents between our upserts' filters and inserts"""
+
+    def __init__(self, codes):
+        self.codes = codes
+
+    async def bulk_write(self, operations, ordered=True):
+        errors = [{"index": index, "code": code, "errmsg": "conflict"} for index, code in enumerate(self.codes)]
+        raise BulkWriteError({"writeErrors": errors, "nUpserted": len(operations) - len(errors)})
+
+
+def test_losing_a_concurrent_seed_race_is_not_an_error(server, seeding, monkeypatch):
+    monkeypatch.setattr(server, "db", SimpleNamespace(sikkim_monasteries=RacingCollection([11000, 11000])))
+    state = seeding.run()
+    assert state == {"seeded": True, "inserted": len(server.sikkim_monasteries_data) - 2}
+
+
+def test_other_seed_write_errors_are_raised(server, seeding, monkeypatch):
+    monkeypatch.setattr(server, "db", SimpleNamespace(sikkim_monasteries=RacingCollection([11000, 121])))
+    with pytest.raises(BulkWriteError):
+        seeding.run()
+    assert not seeding.published
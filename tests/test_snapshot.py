@@ -0,0 +1,72 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from catalog import MonasteryCatalog, SnapshotRecord
+from serialization import ResponseBodyCache, join_array
+from snapshot import CatalogSnapshot
+
+
+def loaded_catalog(server, snapshot_path):
+    async def load():
+        collection = AsyncMongoMockClient().snapshot_test.sikkim_monasteries
+        documents = [server.SikkimMonastery(**data).dict() for data in server.sikkim_monasteries_data]
+        await collection.insert_many([dict(document) for document in documents])
+        catalog = MonasteryCatalog(collection, server.SikkimMonastery, snapshot_path=snapshot_path)
+        await catalog.ensure_loaded()
+        return catalog
+
+    return asyncio.run(load())
+
+
+def test_snapshot_round_trips_the_catalog(server, tmp_path):
+    path = tmp_path / "catalog.snapshot"
+    source = loaded_catalog(server, path)
+    assert path.exists()
+
+    with CatalogSnapshot(path) as snapshot:
+        assert snapshot.fingerprint == source.fingerprint
+        assert len(snapshot) == len(source._items)
+        assert [document["id"] for document in snapshot.documents()] == [item.id for item in source._items]
+        assert snapshot.keys()[0] == [
+            source._items[0].id, source._items[0].district, source._items[0].tradition, source._items[0].coordinates
+        ]
+
+
+def test_snapshot_entries_are_served_without_building_models(server, tmp_path):
+    path = tmp_path / "catalog.snapshot"
+    source = loaded_catalog(server, path)
+
+    mapped = MonasteryCatalog(None, server.SikkimMonastery, snapshot_path=path)
+    assert mapped.load_snapshot()
+    items = asyncio.run(mapped.all())
+    assert all(isinstance(item, SnapshotRecord) for item in items)
+
+    # Listing, filtering and search give the same bodies as the validated models
+    expected = ResponseBodyCache().put_listing(0, "all", source._items, None, None)
+    assert ResponseBodyCache().put_listing(0, "all", items, None, None) == expected
+    district = source._items[0].district
+    filtered = asyncio.run(mapped.filter(district=district, search="monastery"))
+    assert [item.id for item in filtered] == [
+        item.id for item in asyncio.run(source.filter(district=district, search="monastery"))
+    ]
+    summary = {"id", "name", "district"}
+    assert join_array(ResponseBodyCache().item(0, item, summary) for item in items) == join_array(
+        ResponseBodyCache().item(0, item, summary) for item in source._items
+    )
+    assert all(item._model is None for item in items)
+
+    # Anything beyond the key fields builds the model on first use
+    assert items[0].travel_info == source._items[0].travel_info
+    assert items[0]._model is not None
+
+
+def test_body_cache_keeps_only_the_most_recent_field_selections(server):
+    monastery = server.SikkimMonastery(**server.sikkim_monasteries_data[0])
+    cache = ResponseBodyCache(max_items=2)
+    full = cache.item(0, monastery)
+    cache.item(0, monastery, {"id"})
+    # Touching the full body keeps it while the older projection is evicted
+    assert cache.item(0, monastery) is full
+    cache.item(0, monastery, {"id", "name"})
+    assert list(cache._items) == [(monastery.id, None), (monastery.id, frozenset({"id", "name"}))]
@@ -0,0 +1,135 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import BulkWriteError
+
+from write_buffer import WriteBehindBuffer
+
+
+class FailingCollection:
+    async def insert_many(self, documents, ordered=True):
+        raise ConnectionError("primary stepped down")
+
+
+class FlakyCollection:
+    """Stores each batch, but loses the reply to the first attempt"""
+
+    def __init__(self, lost_replies=1):
+        self.lost_replies = lost_replies
+        self.stored = {}
+        self.attempts = 0
+
+    async def insert_many(self, documents, ordered=True):
+        self.attempts += 1
+        errors = []
+        for index, document in enumerate(documents):
+            document.setdefault("_id", f"id-{document['n']}")
+            if document["_id"] in self.stored or document.get("invalid"):
+                code = 11000 if document["_id"] in self.stored else 121
+                key_pattern = {"_id": 1} if code == 11000 else None
+                errors.append({"index": index, "code": code, "keyPattern": key_pattern, "errmsg": "rejected"})
+            else:
+                self.stored[document["_id"]] = document
+        if self.lost_replies:
+            self.lost_replies -= 1
+            raise ConnectionError("connection reset")
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(documents) - len(errors)})
+
+
+def test_documents_are_written_in_batches_and_drained_on_close():
+    db = AsyncMongoMockClient().write_buffer_test
+
+    async def scenario():
+        buffer = WriteBehindBuffer(db, batch_size=10, flush_interval=0.5)
+        buffer.start()
+        for i in range(25):
+            await buffer.put("chat_messages", {"n": i})
+        await buffer.put("status_checks", {"n": 0})
+        # Two full batches go out without waiting for the interval
+        for _ in range(100):
+            if buffer.written >= 20:
+                break
+            await asyncio.sleep(0.01)
+        written_before_close = buffer.written
+        await buffer.close()
+        return buffer, written_before_close, await db.chat_messages.count_documents({})
+
+    buffer, written_before_close, stored = asyncio.run(scenario())
+    assert written_before_close == 20
+    assert stored == 25 and buffer.written == 26
+    assert buffer.stats() == {"pending": 0, "written": 26, "failed": 0, "retries": 0, "flushes": 3}
+
+
+def test_partial_batch_is_flushed_after_the_interval():
+    db = AsyncMongoMockClient().write_buffer_interval_test
+
+    async def scenario():
+        buffer = WriteBehindBuffer(db, batch_size=100, flush_interval=0.05)
+        buffer.start()
+        await buffer.put("chat_messages", {"n": 1})
+        await asyncio.sleep(0.2)
+        stored = await db.chat_messages.count_documents({})
+        await buffer.close()
+        return stored
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_unstarted_buffer_writes_directly():
+    db = AsyncMongoMockClient().write_buffer_direct_test
+
+    async def scenario():
+        await WriteBehindBuffer(db).put("chat_messages", {"n": 1})
+        return await db.chat_messages.count_documents({})
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_failed_batches_are_counted_and_do_not_stop_the_flusher():
+    db = {"broken": FailingCollection(), "chat_messages": AsyncMongoMockClient().write_buffer_fail_test.chat_messages}
+
+    async def scenario():
+        buffer = WriteBehindBuffer(db, batch_size=2, flush_interval=0.5, max_retries=2, backoff_base=0.001)
+        buffer.start()
+        await buffer.put("broken", {"n": 1})
+        await buffer.put("broken", {"n": 2})
+        await buffer.put("chat_messages", {"n": 3})
+        await buffer.close()
+        return buffer.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["failed"] == 2 and stats["written"] == 1
+    assert stats["retries"] == 2
+
+
+def test_transient_errors_are_retried_without_duplicating_documents():
+    collection = FlakyCollection()
+
+    async def scenario():
+        buffer = WriteBehindBuffer({"chat_messages": collection}, batch_size=3, backoff_base=0.001)
+        buffer.start()
+        for n in range(3):
+            await buffer.put("chat_messages", {"n": n})
+        await buffer.close()
+        return buffer.stats()
+
+    stats = asyncio.run(scenario())
+    assert collection.attempts == 2 and len(collection.stored) == 3
+    assert stats["written"] == 3 and stats["failed"] == 0 and stats["retries"] == 1
+
+
+def test_only_rejected_documents_count_as_failed():
+    collection = FlakyCollection(lost_replies=0)
+
+    async def scenario():
+        buffer = WriteBehindBuffer({"chat_messages": collection}, batch_size=3, backoff_base=0.001)
+        buffer.start()
+        for document in ({"n": 0}, {"n": 1, "invalid": True}, {"n": 2}):
+            await buffer.put("chat_messages", document)
+        await buffer.close()
+        return buffer.stats()
+
+    stats = asyncio.run(scenario())
+    assert collection.attempts == 1
+    assert stats["written"] == 2 and stats["failed"] == 1 and stats["retries"] == 0